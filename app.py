@@ -1,10 +1,15 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
 from flask_cors import CORS
+import csv
+import io
 import json
+from database import SENDABLE_STATUS
 from email_service import EmailService
+from metrics import REGISTRY as metrics_registry
+from response_cache import ResponseCache
+from webhook_ingestor import flatten_event
 from config import Config
-import sqlite3
-from datetime import datetime
+from datetime import date, datetime, timedelta
 
 app = Flask(__name__)
 CORS(app)
@@ -12,6 +17,12 @@ CORS(app)
 # Inicializa o serviço de email
 email_service = EmailService()
 
+# Cache dos endpoints de leitura do painel, invalidado pelas versões dos dados gravados
+response_cache = ResponseCache(email_service.db.versions)
+
+# Com METRICS_DIR, grava as métricas deste worker para o /metrics de qualquer worker somar
+metrics_registry.start()
+
 # Valida configurações na inicialização
 try:
     Config.validate()
@@ -48,18 +59,25 @@ def import_contacts():
         
         try:
             source = request.form.get('source', 'csv_import')
-            count = email_service.add_contacts_from_csv(tmp_path, source)
+            result = email_service.import_contacts_csv(tmp_path, source)
+            count = result['imported']
             
-            # Busca o lote mais recente para retornar informações
-            batches = email_service.db.get_active_batches()
-            latest_batch = batches[0] if batches else None
+            if result.get('error'):
+                return jsonify({'error': result['error']}), 400
             
-            return jsonify({
+            response = {
                 'success': True,
                 'contacts_imported': count,
-                'batch_id': latest_batch['batch_id'] if latest_batch else None,
-                'message': f'{count} contatos importados com sucesso no lote {latest_batch["batch_id"] if latest_batch else "N/A"}'
-            })
+                'invalid_rows': result['invalid'],
+                'batch_id': result['batch_id'],
+                'message': f'{count} contatos importados com sucesso no lote {result["batch_id"]}'
+            }
+            
+            # Validação opcional do lote recém-importado (endereços já conhecidos vêm do cache)
+            if request.form.get('validate', 'false').lower() == 'true':
+                response['validation'] = email_service.validate_batch(result['batch_id'])
+            
+            return jsonify(response)
         
         finally:
             # Remove arquivo temporário
@@ -104,6 +122,7 @@ def add_contact_manual():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/contacts/batches', methods=['GET'])
+@response_cache.cached('contacts')
 def get_contact_batches():
     """Lista todos os lotes de contatos"""
     try:
@@ -130,7 +149,7 @@ def activate_contact_batch(batch_id):
                 'message': f'Lote {batch_id} ativado com sucesso'
             })
         else:
-            return jsonify({'error': 'Erro ao ativar lote'}), 500
+            return jsonify({'error': 'Lote não encontrado'}), 404
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -147,22 +166,84 @@ def deactivate_contact_batch(batch_id):
                 'message': f'Lote {batch_id} desativado com sucesso'
             })
         else:
-            return jsonify({'error': 'Erro ao desativar lote'}), 500
+            return jsonify({'error': 'Lote não encontrado'}), 404
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+CONTACTS_PAGE_SIZE = 100
+CONTACTS_MAX_PAGE_SIZE = 1000
+
+def stream_contacts(contacts, export_format: str):
+    """Gera o export linha a linha (NDJSON ou CSV), sem montar a resposta inteira na memória"""
+    if export_format == 'ndjson':
+        for contact in contacts:
+            yield json.dumps(contact, default=str) + '\n'
+        return
+    
+    buffer = io.StringIO()
+    writer = None
+    for contact in contacts:
+        if writer is None:
+            writer = csv.DictWriter(buffer, fieldnames=list(contact))
+            writer.writeheader()
+        writer.writerow(contact)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+def contacts_listing(status: str = None, batch_id: str = None, extra: dict = None):
+    """Página de contatos (?after=<id>&limit=N) ou export completo em streaming (?format=ndjson|csv)"""
+    export_format = request.args.get('format', 'json')
+    
+    if export_format in ('ndjson', 'csv'):
+        contacts = email_service.db.iter_contacts(status=status, batch_id=batch_id)
+        mimetype = 'application/x-ndjson' if export_format == 'ndjson' else 'text/csv'
+        filename = f"contacts_{batch_id or status or 'all'}.{export_format}"
+        return Response(
+            stream_with_context(stream_contacts(contacts, export_format)),
+            mimetype=mimetype,
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
+        )
+    
+    if export_format != 'json':
+        return jsonify({'error': 'Formato inválido (use json, ndjson ou csv)'}), 400
+    
+    limit = min(request.args.get('limit', CONTACTS_PAGE_SIZE, type=int), CONTACTS_MAX_PAGE_SIZE)
+    after_id = request.args.get('after', 0, type=int)
+    contacts = email_service.db.get_contacts_page(status, batch_id, after_id, limit)
+    
+    return jsonify({
+        'success': True,
+        **(extra or {}),
+        'contacts': contacts,
+        'count': len(contacts),
+        # Cursor da próxima página (None quando não há mais contatos)
+        'next_cursor': contacts[-1]['id'] if len(contacts) == limit else None
+    })
+
 @app.route('/contacts/batches/<batch_id>', methods=['GET'])
 def get_contacts_by_batch(batch_id):
-    """Retorna contatos de um lote específico"""
+    """Retorna contatos de um lote específico, paginados por cursor"""
     try:
-        contacts = email_service.db.get_contacts_by_batch(batch_id)
+        return contacts_listing(
+            status=request.args.get('status'),
+            batch_id=batch_id,
+            extra={'batch_id': batch_id}
+        )
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/contacts/batches/<batch_id>/validate', methods=['POST'])
+def validate_contact_batch(batch_id):
+    """Valida os contatos ativos de um lote e desativa os inválidos"""
+    try:
+        summary = email_service.validate_batch(batch_id)
         
         return jsonify({
             'success': True,
-            'batch_id': batch_id,
-            'contacts': contacts,
-            'count': len(contacts)
+            'validation': summary
         })
     
     except Exception as e:
@@ -177,11 +258,11 @@ def update_contact_status(contact_id):
             return jsonify({'error': 'Status é obrigatório'}), 400
         
         status = data['status']
-        if status not in ['active', 'inactive', 'bounced']:
+        if status not in ['active', 'inactive', 'bounced', 'invalid', 'unsubscribed', 'complained']:
             return jsonify({'error': 'Status inválido'}), 400
         
         # Busca o contato para obter o batch_id
-        with sqlite3.connect(email_service.db.db_path) as conn:
+        with email_service.db.changing('contacts') as conn:
             cursor = conn.cursor()
             cursor.execute('SELECT batch_id FROM contacts WHERE id = ?', (contact_id,))
             result = cursor.fetchone()
@@ -213,7 +294,7 @@ def delete_contact(contact_id):
     """Exclui um contato específico"""
     try:
         # Busca o contato para obter o batch_id antes de excluir
-        with sqlite3.connect(email_service.db.db_path) as conn:
+        with email_service.db.changing('contacts') as conn:
             cursor = conn.cursor()
             cursor.execute('SELECT batch_id FROM contacts WHERE id = ?', (contact_id,))
             result = cursor.fetchone()
@@ -238,23 +319,16 @@ def delete_contact(contact_id):
 
 @app.route('/contacts', methods=['GET'])
 def get_contacts():
-    """Lista contatos"""
+    """Lista contatos, paginados por cursor (por padrão, os que recebem campanhas)"""
     try:
-        status = request.args.get('status', 'active')
-        limit = request.args.get('limit', type=int)
-        
-        contacts = email_service.db.get_contacts(status=status, limit=limit)
-        
-        return jsonify({
-            'success': True,
-            'contacts': contacts,
-            'count': len(contacts)
-        })
+        status = request.args.get('status', SENDABLE_STATUS)
+        return contacts_listing(status=None if status == 'all' else status)
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/campaigns', methods=['GET'])
+@response_cache.cached('campaigns')
 def list_campaigns():
     """Lista todas as campanhas"""
     try:
@@ -378,6 +452,22 @@ def delete_campaign(campaign_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/campaigns/<int:campaign_id>/preview', methods=['GET'])
+def preview_campaign(campaign_id):
+    """Valida as variáveis do template e renderiza a campanha para alguns contatos"""
+    try:
+        contact_ids = request.args.getlist('contact_id', type=int)
+        limit = min(max(request.args.get('limit', 3, type=int), 1), 20)
+        
+        result = email_service.preview_campaign(campaign_id, contact_ids, limit)
+        if not result['success']:
+            return jsonify(result), 404
+        
+        return jsonify(result)
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/campaigns/<int:campaign_id>/send', methods=['POST'])
 def send_campaign(campaign_id):
     """Envia uma campanha"""
@@ -389,17 +479,23 @@ def send_campaign(campaign_id):
         async_mode = data.get('async_mode', False)
         
         if async_mode:
-            # Envia de forma assíncrona
-            thread = email_service.send_campaign_async(
+            # Agenda os lotes e retorna imediatamente
+            result = email_service.send_campaign_async(
                 campaign_id=campaign_id,
                 contact_limit=contact_limit,
                 test_mode=test_mode
             )
             
+            if not result['success']:
+                return jsonify(result), 400
+            
             return jsonify({
                 'success': True,
                 'message': 'Campanha iniciada em modo assíncrono',
-                'campaign_id': campaign_id
+                'campaign_id': campaign_id,
+                'total_contacts': result['total_contacts'],
+                'total_batches': result['total_batches'],
+                'events_url': f'/campaigns/{campaign_id}/events'
             })
         else:
             # Envia de forma síncrona
@@ -418,10 +514,13 @@ def send_campaign(campaign_id):
         return jsonify({'error': str(e)}), 500
 
 @app.route('/campaigns/<int:campaign_id>/stats', methods=['GET'])
+@response_cache.cached(lambda campaign_id: f'campaign:{campaign_id}', 'events')
 def get_campaign_stats(campaign_id):
     """Retorna estatísticas de uma campanha"""
     try:
-        stats = email_service.get_campaign_stats(campaign_id)
+        # ?reconcile=1 recalcula o resumo a partir de email_logs
+        reconcile = request.args.get('reconcile', '').lower() in ('1', 'true', 'yes')
+        stats = email_service.get_campaign_stats(campaign_id, reconcile=reconcile)
         
         return jsonify({
             'success': True,
@@ -432,7 +531,77 @@ def get_campaign_stats(campaign_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/dispatch/queue', methods=['GET'])
+def get_dispatch_queue():
+    """Lista os lotes na fila e em andamento no despachante"""
+    try:
+        return jsonify({
+            'success': True,
+            'queue': email_service.get_dispatch_queue()
+        })
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/campaigns/<int:campaign_id>/progress', methods=['GET'])
+def get_campaign_progress(campaign_id):
+    """Retorna o andamento do envio de uma campanha"""
+    try:
+        return jsonify({
+            'success': True,
+            'progress': email_service.get_campaign_progress(campaign_id)
+        })
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/campaigns/<int:campaign_id>/events', methods=['GET'])
+def stream_campaign_progress(campaign_id):
+    """Progresso do envio em tempo real (Server-Sent Events), sem consultar o banco a cada lote"""
+    try:
+        subscription = email_service.subscribe_progress(campaign_id)
+        
+        return Response(
+            stream_with_context(subscription.stream()),
+            mimetype='text/event-stream',
+            # Sem cache e sem buffer em proxies (nginx) para os eventos chegarem na hora
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/campaigns/<int:campaign_id>/dead-letters', methods=['GET'])
+def get_dead_letters(campaign_id):
+    """Lista os destinatários que falharam em definitivo"""
+    try:
+        limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+        
+        return jsonify({
+            'success': True,
+            **email_service.get_dead_letters(campaign_id, limit)
+        })
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/campaigns/<int:campaign_id>/dead-letters/requeue', methods=['POST'])
+def requeue_dead_letters(campaign_id):
+    """Reagenda o envio dos destinatários que falharam (todos ou os IDs informados)"""
+    try:
+        data = request.get_json(silent=True) or {}
+        
+        result = email_service.requeue_dead_letters(campaign_id, data.get('ids'))
+        if not result['success']:
+            return jsonify(result), 404
+        
+        return jsonify(result)
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/stats/daily', methods=['GET'])
+@response_cache.cached('sends', 'events', 'quota', 'contacts', 'campaigns')
 def get_daily_stats():
     """Retorna estatísticas do dia atual"""
     try:
@@ -446,30 +615,111 @@ def get_daily_stats():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/stats/range', methods=['GET'])
+@response_cache.cached('sends', 'events')
+def get_stats_range():
+    """Série histórica de envios e eventos (?start=AAAA-MM-DD&end=AAAA-MM-DD&granularity=day|hour&campaign_id=)"""
+    try:
+        try:
+            end = date.fromisoformat(request.args['end']) if 'end' in request.args else email_service.stats.today()
+            start = date.fromisoformat(request.args['start']) if 'start' in request.args else end - timedelta(days=6)
+        except ValueError:
+            return jsonify({'error': 'Datas devem estar no formato AAAA-MM-DD'}), 400
+        
+        try:
+            stats = email_service.get_stats_range(
+                start, end,
+                granularity=request.args.get('granularity', 'day'),
+                campaign_id=request.args.get('campaign_id', type=int)
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        return jsonify({
+            'success': True,
+            'stats': stats
+        })
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def webhook_event_data() -> dict:
+    """Extrai o evento do webhook, aceitando o formato JSON (event-data) e o formulário legado"""
+    # Aqui você pode adicionar validação da assinatura do Mailgun
+    # Por simplicidade, vamos processar todos os eventos
+    payload = request.get_json(silent=True)
+    if payload and 'event-data' in payload:
+        return flatten_event(payload['event-data'])
+    
+    return {
+        'recipient': request.form.get('recipient'),
+        'event': request.form.get('event'),
+        'severity': request.form.get('severity'),
+        'timestamp': request.form.get('timestamp'),
+        'message-id': request.form.get('message-id'),
+        'domain': request.form.get('domain')
+    }
+
 @app.route('/webhook/mailgun', methods=['POST'])
 def mailgun_webhook():
     """Webhook para receber eventos do Mailgun"""
     try:
-        # Verifica se é um evento válido do Mailgun
-        signature = request.form.get('signature')
-        timestamp = request.form.get('timestamp')
-        token = request.form.get('token')
+        event_data = webhook_event_data()
         
-        # Aqui você pode adicionar validação da assinatura do Mailgun
-        # Por simplicidade, vamos processar todos os eventos
+        # Enfileira para gravação em lote; a resposta não espera o banco
+        result = email_service.enqueue_webhook_event(event_data)
+        
+        if result == 'rejected':
+            # Buffer cheio: o Mailgun tenta novamente mais tarde
+            response = jsonify({'error': 'Fila de eventos cheia, tente novamente'})
+            response.headers['Retry-After'] = '30'
+            return response, 503
+        
+        return jsonify({'success': True, 'message': 'Evento recebido', 'status': result})
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/webhook/metrics', methods=['GET'])
+def webhook_metrics():
+    """Métricas da fila de ingestão de webhooks"""
+    return jsonify({
+        'success': True,
+        'metrics': email_service.webhook_ingestor.metrics()
+    })
+
+@app.route('/events/sync', methods=['POST'])
+def sync_events():
+    """Busca eventos na API do Mailgun (begin/end em epoch para um backfill)"""
+    try:
+        begin = request.args.get('begin', type=float)
+        end = request.args.get('end', type=float)
+        if end is not None and begin is None:
+            return jsonify({'error': 'Informe begin junto com end'}), 400
         
-        event_data = {
-            'recipient': request.form.get('recipient'),
-            'event': request.form.get('event'),
-            'timestamp': timestamp,
-            'message-id': request.form.get('message-id'),
-            'domain': request.form.get('domain')
-        }
+        summary = email_service.sync_events(begin, end)
         
-        # Atualiza status no banco de dados
-        email_service.update_email_status_from_webhook(event_data)
+        return jsonify({
+            'success': True,
+            'summary': summary
+        })
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/suppressions/sync', methods=['POST'])
+def sync_suppressions():
+    """Sincroniza as listas de supressão do Mailgun (use ?full=1 para percorrer tudo)"""
+    try:
+        full = request.args.get('full', '0').lower() in ('1', 'true')
+        summary = email_service.cleanup_bounced_emails(full=full)
         
-        return jsonify({'success': True, 'message': 'Evento processado'})
+        return jsonify({
+            'success': True,
+            'summary': summary,
+            'suppressed_total': len(email_service.suppressions),
+            'counts': email_service.db.get_suppression_counts()
+        })
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -478,14 +728,15 @@ def mailgun_webhook():
 def health_check():
     """Verificação de saúde da aplicação"""
     try:
-        # Verifica se pode enviar mais emails
-        can_send = email_service.can_send_more_emails()
+        # Lê a cota compartilhada (uma consulta pela chave primária)
+        quota = email_service.quota.usage()
         
         return jsonify({
             'status': 'healthy',
-            'can_send_emails': can_send,
-            'daily_sent_count': email_service.daily_sent_count,
-            'daily_limit': Config.MAX_EMAILS_PER_DAY
+            'can_send_emails': quota['remaining'] > 0,
+            'daily_sent_count': quota['sent'],
+            'daily_reserved_count': quota['reserved'],
+            'daily_limit': quota['limit']
         })
     
     except Exception as e:
@@ -494,6 +745,16 @@ def health_check():
             'error': str(e)
         }), 500
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Métricas no formato de texto do Prometheus (somadas entre os workers com METRICS_DIR)"""
+    try:
+        email_service.update_queue_metrics()
+        return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 if __name__ == '__main__':
     print("🚀 Iniciando Cold Email Service...")
     print(f"📧 Domínio: {Config.MAILGUN_DOMAIN}")
@@ -0,0 +1,157 @@
+import json
+import uuid
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from template_engine import recipient_variables
+
+# JSON compacto e ASCII: o tamanho em caracteres é o tamanho em bytes
+_JSON = json.JSONEncoder(separators=(',', ':'))
+
+# Corpo em multipart/form-data: o JSON vai cru, sem a expansão da codificação de URL
+BOUNDARY = f'mailgun-batch-{uuid.uuid4().hex}'
+CONTENT_TYPE = f'multipart/form-data; boundary={BOUNDARY}'
+CLOSING = f'--{BOUNDARY}--\r\n'
+
+# ', ' entre os endereços do campo to e ',' entre as variáveis
+RECIPIENT_OVERHEAD = len(', ') + len(',')
+
+# Respostas do Mailgun que indicam requisição grande demais
+PAYLOAD_TOO_LARGE_STATUS = 413
+PAYLOAD_TOO_LARGE_HINTS = ('too large', 'too big', 'exceeds', 'size limit')
+
+
+def multipart_field(name: str, value: str = '') -> str:
+    """Cabeçalho de um campo do formulário multipart, seguido do valor"""
+    return f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}'
+
+
+def form_prefix(fields: Dict) -> str:
+    """Campos fixos do POST /messages, codificados uma vez por campanha"""
+    return ''.join(multipart_field(name, value) + '\r\n' for name, value in fields.items() if value is not None)
+
+
+def is_payload_rejected(status_code: int, text: str = '') -> bool:
+    """True se o Mailgun recusou o POST pelo tamanho (vale a pena dividir o lote)"""
+    if status_code == PAYLOAD_TOO_LARGE_STATUS:
+        return True
+    return status_code == 400 and any(hint in (text or '').lower() for hint in PAYLOAD_TOO_LARGE_HINTS)
+
+
+class EncodedRecipient:
+    """Destinatário serializado uma única vez, pronto para entrar no corpo do POST"""
+
+    __slots__ = ('contact', 'email', 'variables', 'size')
+
+    def __init__(self, contact, variables: Dict):
+        self.contact = contact
+        self.email = contact['email']
+        self.variables = _JSON.encode(self.email) + ':' + _JSON.encode(recipient_variables(contact, variables))
+        email_size = len(self.email) if self.email.isascii() else len(self.email.encode('utf-8'))
+        self.size = email_size + len(self.variables) + RECIPIENT_OVERHEAD
+
+
+class PayloadBatch:
+    """Lote de destinatários serializados; dividir o lote reaproveita os fragmentos"""
+
+    __slots__ = ('recipients', 'size')
+
+    def __init__(self, recipients: List[EncodedRecipient], size: int = None):
+        self.recipients = recipients
+        self.size = sum(recipient.size for recipient in recipients) if size is None else size
+
+    def __len__(self) -> int:
+        return len(self.recipients)
+
+    @property
+    def contacts(self) -> List:
+        return [recipient.contact for recipient in self.recipients]
+
+    @property
+    def emails(self) -> List[str]:
+        return [recipient.email for recipient in self.recipients]
+
+    def encode(self, prefix: str) -> bytes:
+        """Corpo completo do POST: campos fixos, destinatários e recipient-variables"""
+        return ''.join((
+            prefix,
+            multipart_field('to'), ', '.join(recipient.email for recipient in self.recipients), '\r\n',
+            multipart_field('recipient-variables'),
+            '{', ','.join(recipient.variables for recipient in self.recipients), '}\r\n',
+            CLOSING
+        )).encode('utf-8')
+
+    def split(self) -> Tuple['PayloadBatch', 'PayloadBatch']:
+        """Divide o lote ao meio sem serializar de novo"""
+        middle = len(self.recipients) // 2
+        return PayloadBatch(self.recipients[:middle]), PayloadBatch(self.recipients[middle:])
+
+
+class BatchBuilder:
+    """Agrupa destinatários em lotes limitados por quantidade e pelo tamanho da requisição"""
+
+    def __init__(self, variables: Dict, max_recipients: int, max_bytes: int, fields: Dict = None):
+        self.variables = variables
+        self.max_recipients = max_recipients
+        self.max_bytes = max_bytes
+        # Campos fixos da requisição (remetente, assunto, corpo...), já codificados
+        self.prefix = form_prefix(fields or {})
+        self.base_bytes = len(PayloadBatch([], 0).encode(self.prefix))
+
+    def pack(self, contacts: Iterable) -> Iterator[PayloadBatch]:
+        """Gera os lotes à medida que os contatos chegam (um lote em memória por vez)"""
+        current = []
+        size = 0
+        for contact in contacts:
+            recipient = EncodedRecipient(contact, self.variables)
+            full = len(current) >= self.max_recipients
+            if current and (full or self.base_bytes + size + recipient.size > self.max_bytes):
+                yield PayloadBatch(current, size)
+                current = []
+                size = 0
+            current.append(recipient)
+            size += recipient.size
+
+        if current:
+            yield PayloadBatch(current, size)
+
+    def pack_contacts(self, batches: Iterable[Iterable]) -> Iterator[List]:
+        """Reagrupa lotes vindos do banco em lotes de contatos que cabem na requisição"""
+        contacts = (contact for batch in batches for contact in batch)
+        for batch in self.pack(contacts):
+            yield batch.contacts
+
+    def encode(self, batch: PayloadBatch) -> bytes:
+        """Corpo do POST de um lote deste envio"""
+        return batch.encode(self.prefix)
+
+
+def merge_results(parts: List[Tuple[PayloadBatch, Optional[int], Optional[Dict], str, Optional[str]]]) -> Dict:
+    """Junta as respostas das requisições de um lote (mais de uma quando foi dividido)"""
+    recipients = [email for batch, *_ in parts for email in batch.emails]
+    result = {
+        'recipients': recipients,
+        'recipients_count': len(recipients),
+        'status_code': 200,
+        'success': True
+    }
+    if len(parts) > 1:
+        result['requests'] = len(parts)
+        result['message_ids'] = {}
+
+    errors = []
+    for batch, status_code, body, text, retry_after in parts:
+        if status_code != 200:
+            result['success'] = False
+            result['status_code'] = status_code
+            if retry_after:
+                result['retry_after'] = retry_after
+            errors.append(text)
+            continue
+        result.setdefault('message_id', body.get('id'))
+        result.setdefault('message', body.get('message'))
+        if len(parts) > 1:
+            result['message_ids'].update((email, body.get('id')) for email in batch.emails)
+
+    if errors:
+        result['error'] = ' | '.join(errors)
+    return result
@@ -0,0 +1,785 @@
+#!/usr/bin/env python3
+"""
+Benchmarks de performance do sistema de Cold Emails.
+
+Uso:
+    python benchmark.py                                  # executa todos os cenários
+    python benchmark.py db_pool                          # executa apenas os cenários informados
+    python benchmark.py --size 100k --output base.json   # cenários de volume com 100 mil linhas
+    python benchmark.py campaign_send --latency 0.05 --error-rate 0.02 --throttle-rate 0.05
+    python benchmark.py compare base.json novo.json      # diferença entre dois resultados
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from database import Database
+
+SCENARIOS = {}
+
+# Volumes de --size para os cenários que têm um parâmetro de escala
+SIZES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+
+# Comportamento do Mailgun falso nos cenários que enviam (definido pela linha de comando)
+STUB_OPTIONS = {}
+
+# Diretórios dos bancos temporários do cenário em execução (removidos ao fim de cada execução)
+TEMP_DIRS = []
+
+
+def scenario(name, scale: str = None):
+    """Registra uma função como cenário de benchmark; scale é o parâmetro ajustado por --size"""
+    def decorator(func):
+        func.scale = scale
+        SCENARIOS[name] = func
+        return func
+    return decorator
+
+
+def timed(func, *args, **kwargs):
+    """Executa a função e retorna (resultado, segundos)"""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def temp_database() -> Database:
+    """Cria um banco de dados temporário para o benchmark (apagado por run_scenario)"""
+    tmp_dir = tempfile.mkdtemp(prefix='bench_')
+    TEMP_DIRS.append(tmp_dir)
+    return Database(os.path.join(tmp_dir, 'bench.db'))
+
+
+def remove_temp_databases():
+    """Apaga os bancos temporários criados desde a última limpeza (inclusive os arquivos WAL)"""
+    while TEMP_DIRS:
+        shutil.rmtree(TEMP_DIRS.pop(), ignore_errors=True)
+
+
+def bench_stub(**defaults):
+    """Mailgun falso com os padrões do cenário, sobrescritos pelas opções da linha de comando"""
+    from mailgun_stub import MailgunStub
+    return MailgunStub(**{'seed': 0, **defaults, **STUB_OPTIONS})
+
+
+def median_ms(func, repeats: int) -> float:
+    """Mediana, em milissegundos, de várias execuções da função"""
+    samples = []
+    for _ in range(repeats):
+        _, seconds = timed(func)
+        samples.append(seconds * 1000)
+    return statistics.median(samples)
+
+
+def synthetic_contacts(count: int, seed: int = 0, invalid_rate: float = 0.01):
+    """Contatos sintéticos reprodutíveis (mesma semente, mesmos dados), com alguns emails inválidos"""
+    rng = random.Random(seed)
+    positions = ('CEO', 'CTO', 'Diretora Financeira', 'Gerente de Compras', 'Sócio')
+    for i in range(count):
+        company = f'Empresa {rng.randrange(max(count // 20, 1))}'
+        invalid = rng.random() < invalid_rate
+        yield {
+            'email': f'contato{i}-sem-arroba' if invalid else f'contato{i}@empresa{i % 500}.com.br',
+            'name': f'Contato {i}' if rng.random() > 0.1 else '',
+            'company': company,
+            'position': rng.choice(positions)
+        }
+
+
+def write_contacts_csv(path: str, count: int, seed: int = 0) -> str:
+    """Grava um CSV sintético no formato de importação"""
+    with open(path, 'w', newline='') as csv_file:
+        csv_file.write('email,name,company,position\n')
+        for contact in synthetic_contacts(count, seed):
+            csv_file.write(f"{contact['email']},{contact['name']},{contact['company']},{contact['position']}\n")
+    return path
+
+
+def insert_contacts(db: Database, count: int, batches: int = 1, seed: int = 0,
+                    chunk_size: int = 10000) -> list:
+    """Insere contatos válidos distribuídos em lotes de importação; o último lote fica ativo"""
+    batch_ids = [f'bench_{index}' for index in range(batches)]
+    now = datetime.now()
+    rows = []
+    for i, contact in enumerate(synthetic_contacts(count, seed, invalid_rate=0)):
+        rows.append((contact['email'], contact['name'], contact['company'], contact['position'],
+                     'bench', batch_ids[i % batches], now))
+        if len(rows) >= chunk_size:
+            db.insert_contact_rows(rows)
+            rows = []
+    if rows:
+        db.insert_contact_rows(rows)
+    for batch_id in batch_ids:
+        db.activate_batch(batch_id, create=True)
+    return batch_ids
+
+
+def seed_send_history(db: Database, campaign_id: int, count: int, days: int = 30, seed: int = 0,
+                      chunk_size: int = 10000):
+    """Envios espalhados pelos últimos dias, com entregas, aberturas, cliques e bounces (os resumos
+    são mantidos pelos triggers na própria inserção)"""
+    rng = random.Random(seed)
+    now = datetime.now()
+    rows = []
+    for i in range(count):
+        sent_at = now - timedelta(seconds=rng.randrange(days * 86400))
+        bounced = rng.random() < 0.03
+        delivered = None if bounced else sent_at + timedelta(seconds=30)
+        opened = delivered + timedelta(hours=1) if delivered and rng.random() < 0.4 else None
+        clicked = opened + timedelta(minutes=5) if opened and rng.random() < 0.25 else None
+        status = 'bounced' if bounced else 'clicked' if clicked else 'opened' if opened else 'delivered'
+        rows.append((campaign_id, i, f'contato{i}@exemplo.com', status, sent_at, delivered, opened,
+                     clicked, sent_at if bounced else None, f'bench-{i // 1000}'))
+        if len(rows) >= chunk_size or i == count - 1:
+            with db.connection() as conn:
+                conn.executemany('''
+                    INSERT INTO email_logs (campaign_id, contact_id, email, status, sent_at, delivered_at,
+                                            opened_at, clicked_at, bounced_at, message_id)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', rows)
+            rows = []
+
+
+@scenario('db_pool')
+def bench_db_pool(operations: int = 2000):
+    """Compara uma conexão nova por chamada com o pool de conexões"""
+    db = temp_database()
+    campaign_id = db.create_campaign('Benchmark', 'Assunto', 'Corpo')
+    contact_id = db.add_contact('bench@exemplo.com', name='Bench')
+
+    def connect_per_call():
+        # Reproduz o padrão antigo: sqlite3.connect a cada operação
+        for _ in range(operations):
+            with sqlite3.connect(db.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT * FROM campaigns WHERE id = ?', (campaign_id,))
+                cursor.fetchone()
+            with sqlite3.connect(db.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO email_logs (campaign_id, contact_id, email, status, sent_at)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (campaign_id, contact_id, 'bench@exemplo.com', 'sent', datetime.now()))
+                conn.commit()
+
+    def pooled():
+        for _ in range(operations):
+            db.get_campaign(campaign_id)
+            db.log_email_sent(campaign_id, contact_id, 'bench@exemplo.com')
+
+    _, old_seconds = timed(connect_per_call)
+    _, new_seconds = timed(pooled)
+    db.close()
+
+    calls = operations * 2
+    return {
+        'calls': calls,
+        'connect_per_call_us': old_seconds / calls * 1e6,
+        'pooled_us': new_seconds / calls * 1e6,
+        'speedup': old_seconds / new_seconds if new_seconds else 0
+    }
+
+
+@scenario('send_logging')
+def bench_send_logging(sizes=(1000, 10000, 50000)):
+    """Mede o registro de envios em lote por número de destinatários"""
+    db = temp_database()
+    campaign_id = db.create_campaign('Benchmark', 'Assunto', 'Corpo')
+    result = {}
+
+    for size in sizes:
+        contacts = [{'id': i, 'email': f'contato{i}@exemplo.com'} for i in range(size)]
+        _, seconds = timed(db.log_emails_sent_bulk, campaign_id, contacts, 'bench-message-id')
+        result[f'bulk_{size}_ms'] = seconds * 1000
+        result[f'bulk_{size}_us_per_row'] = seconds / size * 1e6
+
+    # Referência: um log_email_sent (uma transação) por contato
+    sample = 1000
+    _, seconds = timed(lambda: [
+        db.log_email_sent(campaign_id, i, f'contato{i}@exemplo.com') for i in range(sample)
+    ])
+    result['per_row_us_per_row'] = seconds / sample * 1e6
+    db.close()
+    return result
+
+
+@scenario('csv_import', scale='rows')
+def bench_csv_import(rows: int = 200000):
+    """Importa um CSV sintético em streaming e mede vazão e pico de memória"""
+    import tracemalloc
+    from contact_import import ContactImporter
+
+    db = temp_database()
+    csv_path = write_contacts_csv(os.path.join(os.path.dirname(db.db_path), 'contacts.csv'), rows)
+
+    importer = ContactImporter(db, progress_callback=lambda progress: None)
+    tracemalloc.start()
+    result, seconds = timed(importer.import_file, csv_path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    db.close()
+
+    return {
+        'rows': result['rows_read'],
+        'imported': result['imported'],
+        'seconds': seconds,
+        'rows_per_sec': result['rows_read'] / seconds if seconds else 0,
+        'peak_memory_mb': peak / 1024 / 1024
+    }
+
+
+@scenario('mailgun_transport')
+def bench_mailgun_transport(batches: int = 40, batch_size: int = 100, latency: float = 0.05,
+                            concurrency: int = 8):
+    """Compara o envio serial com o transporte concorrente contra o Mailgun falso"""
+    from mailgun_client import MailgunClient
+
+    contacts = [
+        {'email': f'contato{i}@exemplo.com', 'name': f'Contato {i}', 'company': 'Empresa'}
+        for i in range(batches * batch_size)
+    ]
+    chunks = [contacts[i:i + batch_size] for i in range(0, len(contacts), batch_size)]
+
+    with bench_stub(latency=latency) as stub:
+        client = MailgunClient(api_key='bench', api_url=stub.url, max_concurrency=concurrency)
+
+        _, serial_seconds = timed(lambda: [
+            client.send_personalized_batch(chunk, 'Olá %recipient.name%', 'Corpo') for chunk in chunks
+        ])
+        _, concurrent_seconds = timed(
+            client.send_batches_concurrent, chunks, 'Olá %recipient.name%', 'Corpo'
+        )
+
+    return {
+        'messages': len(contacts),
+        'stub_latency_ms': latency * 1000,
+        'concurrency': concurrency,
+        'serial_msgs_per_sec': len(contacts) / serial_seconds,
+        'concurrent_msgs_per_sec': len(contacts) / concurrent_seconds,
+        'speedup': serial_seconds / concurrent_seconds
+    }
+
+
+@scenario('webhook_flood', scale='events')
+def bench_webhook_flood(events: int = 20000):
+    """Compara a gravação síncrona por evento com a ingestão em lotes"""
+    from webhook_ingestor import WebhookIngestor, parse_webhook_event
+
+    db = temp_database()
+    campaign_id = db.create_campaign('Benchmark', 'Assunto', 'Corpo')
+    contacts = [{'id': i, 'email': f'contato{i}@exemplo.com'} for i in range(events)]
+    db.log_emails_sent_bulk(campaign_id, contacts, 'bench-message-id')
+
+    payloads = [
+        {'recipient': contact['email'], 'event': 'opened', 'timestamp': time.time(),
+         'message-id': 'bench-message-id'}
+        for contact in contacts
+    ]
+    sample = min(events, 2000)
+
+    def synchronous():
+        for payload in payloads[:sample]:
+            message_id, email, status, timestamp = parse_webhook_event(payload)
+            db.update_email_status_by_message(message_id, email, status, timestamp)
+
+    ingestor = WebhookIngestor(db, max_queue=events, flush_interval=0.2)
+
+    def buffered():
+        for payload in payloads:
+            ingestor.submit({**payload, 'event': 'clicked'})
+        ingestor.stop()
+
+    _, sync_seconds = timed(synchronous)
+    _, buffered_seconds = timed(buffered)
+    metrics = ingestor.metrics()
+    db.close()
+
+    return {
+        'events': events,
+        'sync_events_per_sec': sample / sync_seconds,
+        'buffered_events_per_sec': events / buffered_seconds,
+        'flushes': metrics['flushes'],
+        'avg_flush_ms': metrics['avg_flush_ms']
+    }
+
+
+@scenario('recipient_stream', scale='contacts')
+def bench_recipient_stream(contacts: int = 200000, batch_size: int = 1000):
+    """Compara o pico de memória de carregar todos os contatos com o fluxo de lotes sob demanda"""
+    import tracemalloc
+
+    db = temp_database()
+    with db.connection() as conn:
+        conn.executemany(
+            'INSERT INTO contacts (email, name, company, position, source, status) VALUES (?, ?, ?, ?, ?, ?)',
+            ((f'contato{i}@exemplo.com', f'Contato {i}', 'Empresa', 'CEO', 'bench', 'active')
+             for i in range(contacts))
+        )
+
+    def recipient_vars(batch):
+        return {contact['email']: {'name': contact.get('name')} for contact in batch}
+
+    def load_all():
+        # Padrão antigo: lista completa de dicts, fatiada em lotes
+        rows = db.get_contacts(status='active')
+        for i in range(0, len(rows), batch_size):
+            recipient_vars(rows[i:i + batch_size])
+
+    def stream():
+        for batch in db.iter_recipient_batches(batch_size):
+            recipient_vars(batch)
+
+    result = {'contacts': contacts}
+    for name, func in (('load_all', load_all), ('stream', stream)):
+        tracemalloc.start()
+        _, seconds = timed(func)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result[f'{name}_seconds'] = seconds
+        result[f'{name}_peak_mb'] = peak / 1024 / 1024
+
+    db.close()
+    return result
+
+
+def synthetic_events(count: int, start: float, message_id: str = 'bench-message-id') -> list:
+    """Eventos no formato da API /events do Mailgun (mesma estrutura de uma fixture gravada)"""
+    kinds = ('delivered', 'opened', 'clicked', 'opened', 'delivered')
+    return [
+        {
+            'id': f'evt-{i}',
+            'event': kinds[i % len(kinds)],
+            'timestamp': start + i * 0.01,
+            'recipient': f'contato{i % (count // 2 or 1)}@exemplo.com',
+            'message': {'headers': {'message-id': message_id}}
+        }
+        for i in range(count)
+    ]
+
+
+@scenario('event_sync', scale='events')
+def bench_event_sync(events: int = 20000, page_size: int = 300):
+    """Mede a vazão da sincronização pela API /events contra uma fixture (EVENTS_FIXTURE=arquivo.json)"""
+    from event_sync import EventSync
+    from mailgun_client import MailgunClient
+
+    fixture_path = os.environ.get('EVENTS_FIXTURE')
+    if fixture_path:
+        with open(fixture_path) as fixture_file:
+            fixture = json.load(fixture_file)
+    else:
+        fixture = synthetic_events(events, time.time() - 7200)
+
+    db = temp_database()
+    campaign_id = db.create_campaign('Benchmark', 'Assunto', 'Corpo')
+    recipients = sorted({event['recipient'] for event in fixture})
+    db.log_emails_sent_bulk(
+        campaign_id, [{'id': i, 'email': email} for i, email in enumerate(recipients)], 'bench-message-id'
+    )
+    begin = min(event['timestamp'] for event in fixture)
+    end = max(event['timestamp'] for event in fixture) + 1
+
+    with bench_stub() as stub:
+        stub.load_events(fixture)
+        client = MailgunClient(api_key='bench', api_url=stub.url)
+        sync = EventSync(db, client, page_size=page_size, settle_seconds=0, interval=0)
+
+        first, first_seconds = timed(sync.backfill, begin, end)
+        # Segunda passada sobre a mesma janela: tudo é descartado pela deduplicação
+        second, second_seconds = timed(sync.backfill, begin, end)
+    db.close()
+
+    return {
+        'events': len(fixture),
+        'pages': first['pages'],
+        'applied': first['new'],
+        'events_per_sec': len(fixture) / first_seconds,
+        'replay_duplicates': second['duplicates'],
+        'replay_events_per_sec': len(fixture) / second_seconds
+    }
+
+
+@scenario('template_render')
+def bench_template_render(contacts: int = 100000, renders: int = 10000):
+    """Compara a conversão por str.replace a cada envio com o template compilado e em cache"""
+    from database import Recipient
+    from template_engine import CompiledCampaign, LEGACY_VARIABLES, TemplateCache, recipient_variables
+
+    subject = 'Olá {name|Cliente}, uma ideia para a {company}'
+    body = ('<p>Oi {name|Cliente},</p><p>Vi que você é {position} na {company} '
+            'e chegou até nós por {source}.</p>' * 20)
+    campaign = {'id': 1, 'updated_at': '2024-01-01 00:00:00', 'subject': subject, 'body_template': body}
+    tags = ('name', 'company', 'position', 'source')
+    rows = [
+        Recipient(i, f'contato{i}@exemplo.com', f'Contato {i}' if i % 10 else None,
+                  'Empresa', 'CEO', 'bench')
+        for i in range(contacts)
+    ]
+
+    def legacy_convert():
+        # Padrão antigo: cadeia de replace no assunto e no corpo a cada envio
+        for _ in range(renders):
+            for template in (subject, body):
+                for tag in tags:
+                    template = template.replace('{' + tag + '}', f'%recipient.{tag}%')
+
+    cache = TemplateCache()
+
+    def cached_compile():
+        for _ in range(renders):
+            compiled = cache.get(campaign)
+            compiled.subject.mailgun, compiled.body.mailgun
+
+    def legacy_render():
+        for contact in rows:
+            values = recipient_variables(contact, LEGACY_VARIABLES)
+            for template in (subject, body):
+                for tag in tags:
+                    template = template.replace('{' + tag + '}', str(values[tag]))
+
+    compiled = CompiledCampaign(subject, body)
+
+    def compiled_render():
+        for contact in rows:
+            compiled.render(contact)
+
+    _, legacy_convert_seconds = timed(legacy_convert)
+    _, cached_seconds = timed(cached_compile)
+    _, legacy_render_seconds = timed(legacy_render)
+    _, compiled_seconds = timed(compiled_render)
+
+    return {
+        'renders': renders,
+        'legacy_convert_per_sec': renders / legacy_convert_seconds,
+        'cached_compile_per_sec': renders / cached_seconds,
+        'contacts': contacts,
+        'legacy_render_per_sec': contacts / legacy_render_seconds,
+        'compiled_render_per_sec': contacts / compiled_seconds,
+        'cache_hits': cache.hits
+    }
+
+
+@scenario('payload_encode')
+def bench_payload_encode(recipients: int = 50000, batch_size: int = 1000):
+    """Tempo para serializar recipient-variables e o formulário do POST, por 1k destinatários"""
+    from urllib.parse import urlencode
+    from batch_payload import BatchBuilder
+    from database import Recipient
+    from template_engine import LEGACY_VARIABLES, recipient_variables
+
+    fields = {'from': 'Remetente <contato@exemplo.com>', 'subject': 'Olá %recipient.name%', 'text': 'Corpo ' * 200}
+    rows = [
+        Recipient(i, f'contato{i}@exemplo.com', f'Contato {i}', 'Empresa Exemplo Ltda', 'Diretora', 'csv_import')
+        for i in range(recipients)
+    ]
+
+    def legacy():
+        # Padrão antigo: dict por lote, json.dumps e codificação do formulário pelo requests
+        size = 0
+        for i in range(0, len(rows), batch_size):
+            batch = rows[i:i + batch_size]
+            data = dict(fields, to=[contact['email'] for contact in batch])
+            data['recipient-variables'] = json.dumps(
+                {contact['email']: recipient_variables(contact, LEGACY_VARIABLES) for contact in batch}
+            )
+            size += len(urlencode(data, doseq=True))
+        return size
+
+    builder = BatchBuilder(LEGACY_VARIABLES, batch_size, 10 * 1024 * 1024, fields=fields)
+
+    def packed():
+        # Multipart montado a partir dos fragmentos serializados uma vez por destinatário
+        return sum(len(builder.encode(batch)) for batch in builder.pack(rows))
+
+    def split_half():
+        # Reenvio após recusa pelo tamanho: as metades reaproveitam os fragmentos
+        size = 0
+        for batch in builder.pack(rows):
+            for half in batch.split():
+                size += len(builder.encode(half))
+        return size
+
+    legacy_bytes, legacy_seconds = timed(legacy)
+    packed_bytes, packed_seconds = timed(packed)
+    _, split_seconds = timed(split_half)
+    per_1k = 1000 / recipients * 1000
+
+    return {
+        'recipients': recipients,
+        'legacy_ms_per_1k': legacy_seconds * per_1k,
+        'builder_ms_per_1k': packed_seconds * per_1k,
+        'builder_with_split_ms_per_1k': split_seconds * per_1k,
+        'legacy_kb_per_1k': legacy_bytes / recipients,
+        'builder_kb_per_1k': packed_bytes / recipients
+    }
+
+
+@scenario('campaign_send', scale='contacts')
+def bench_campaign_send(contacts: int = 10000, batch_size: int = 1000, workers: int = 4,
+                        latency: float = 0.02):
+    """Campanha completa pelo despachante (fila persistente, retries) contra o Mailgun falso"""
+    from delivery import CircuitBreaker
+    from dispatch_scheduler import DispatchScheduler
+    from mailgun_client import MailgunClient
+
+    db = temp_database()
+    insert_contacts(db, contacts)
+    campaign_id = db.create_campaign('Benchmark', 'Olá {name}', 'Corpo')
+    payload = {'mailgun_subject': 'Olá %recipient.name%', 'mailgun_body': 'Corpo ' * 200,
+               'campaign_tag': 'bench'}
+
+    with bench_stub(latency=latency) as stub:
+        client = MailgunClient(api_key='bench', api_url=stub.url, max_concurrency=workers)
+        scheduler = DispatchScheduler(
+            db, lambda job: client.send_personalized_batch(job.contacts, **job.payload),
+            workers=workers, rate_per_minute=1e9, burst=1e9, batch_delay=0, poll_interval=0.05,
+            retry_base=0.05, retry_cap=1.0,
+            breaker=CircuitBreaker(db, 'bench', failure_threshold=1000, cooldown_seconds=0.1)
+        )
+        started = time.perf_counter()
+        dispatch = scheduler.submit(campaign_id, db.iter_recipient_batches(batch_size), payload)
+        enqueue_seconds = time.perf_counter() - started
+        dispatch.wait()
+        seconds = time.perf_counter() - started
+        scheduler.stop()
+        faults = stub.faults_returned
+
+    results = dispatch.ordered_results()
+    sent = sum(batch['recipients_count'] for batch in results if batch['success'])
+    dead_letters = sum(db.get_dead_letter_counts(campaign_id).values())
+    db.close()
+
+    return {
+        'contacts': contacts,
+        'batches': len(results),
+        'sent': sent,
+        'dead_letters': dead_letters,
+        'stub_faults': faults,
+        'enqueue_seconds': enqueue_seconds,
+        'seconds': seconds,
+        'msgs_per_sec': sent / seconds if seconds else 0
+    }
+
+
+@scenario('stats_queries', scale='rows')
+def bench_stats_queries(rows: int = 100000, repeats: int = 50):
+    """Latência das consultas do painel (dia, séries por dia e por hora, campanha) sobre o histórico"""
+    from stats_rollup import StatsRollup
+
+    db = temp_database()
+    campaign_id = db.create_campaign('Benchmark', 'Assunto', 'Corpo')
+    _, seed_seconds = timed(seed_send_history, db, campaign_id, rows)
+    stats = StatsRollup(db)
+    today = stats.today()
+
+    result = {
+        'rows': rows,
+        'seed_rows_per_sec': rows / seed_seconds if seed_seconds else 0,
+        'daily_ms': median_ms(stats.daily, repeats),
+        'series_30d_ms': median_ms(lambda: stats.series(today - timedelta(days=29), today), repeats),
+        'series_hourly_7d_ms': median_ms(
+            lambda: stats.series(today - timedelta(days=6), today, granularity='hour'), repeats
+        ),
+        'campaign_series_30d_ms': median_ms(
+            lambda: stats.series(today - timedelta(days=29), today, campaign_id=campaign_id), repeats
+        ),
+        'campaign_stats_ms': median_ms(lambda: db.get_campaign_stats(campaign_id), repeats)
+    }
+    db.close()
+    return result
+
+
+@scenario('batch_activation', scale='contacts')
+def bench_batch_activation(contacts: int = 100000, batches: int = 10, repeats: int = 20):
+    """Troca do lote ativo e contagem de contatos enviáveis com vários lotes importados"""
+    db = temp_database()
+    batch_ids, insert_seconds = timed(insert_contacts, db, contacts, batches)
+
+    def switch():
+        for batch_id in batch_ids:
+            db.activate_batch(batch_id)
+
+    result = {
+        'contacts': contacts,
+        'batches': batches,
+        'insert_rows_per_sec': contacts / insert_seconds if insert_seconds else 0,
+        'activate_ms': median_ms(switch, repeats) / batches,
+        'deactivate_ms': median_ms(lambda: db.deactivate_batch(batch_ids[0]), repeats),
+        'count_sendable_ms': median_ms(db.count_sendable_contacts, repeats),
+        'first_batch_page_ms': median_ms(lambda: next(db.iter_recipient_batches(1000)), repeats)
+    }
+    db.close()
+    return result
+
+
+def parse_size(value: str) -> int:
+    """'10k', '100k', '1m' ou um número de linhas"""
+    key = value.lower()
+    if key in SIZES:
+        return SIZES[key]
+    try:
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Tamanho inválido: {value} (use {", ".join(SIZES)} ou um número)')
+
+
+def git_revision() -> dict:
+    """Commit em que o benchmark rodou (e se havia alterações não commitadas)"""
+    def git(*args):
+        return subprocess.run(['git', *args], capture_output=True, text=True, timeout=10,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    try:
+        return {'commit': git('rev-parse', 'HEAD') or None, 'dirty': bool(git('status', '--porcelain', '-uno'))}
+    except (OSError, subprocess.SubprocessError):
+        return {'commit': None, 'dirty': None}
+
+
+def run_scenario(name: str, size: int = None, repeat: int = 1) -> dict:
+    """Executa o cenário (repeat vezes) e devolve a mediana de cada valor numérico"""
+    func = SCENARIOS[name]
+    kwargs = {func.scale: size} if size and func.scale else {}
+
+    def run_once():
+        try:
+            return func(**kwargs)
+        finally:
+            remove_temp_databases()
+
+    runs = [run_once() for _ in range(repeat)]
+    if repeat == 1:
+        return runs[0]
+    return {
+        key: statistics.median(run[key] for run in runs) if isinstance(value, (int, float)) else value
+        for key, value in runs[0].items()
+    }
+
+
+# Sufixos das métricas em que maior é melhor / menor é melhor (as demais são só contagens)
+HIGHER_IS_BETTER = ('_per_sec', 'speedup')
+LOWER_IS_BETTER = ('_ms', '_us', 'seconds', '_mb', '_per_1k', '_per_row')
+
+
+def compare_results(base: dict, new: dict, threshold: float = 10.0) -> list:
+    """Variação de cada métrica comum aos dois resultados: (cenário, métrica, antes, depois, %, veredito);
+    o veredito fica vazio nas contagens e quando o valor anterior é zero"""
+    rows = []
+    for name, metrics in new['results'].items():
+        for key, value in metrics.items():
+            before = base['results'].get(name, {}).get(key)
+            if not isinstance(value, (int, float)) or not isinstance(before, (int, float)):
+                continue
+            change = (value - before) / before * 100 if before else None
+            if change is None:
+                rows.append((name, key, before, value, change, ''))
+                continue
+            if key.endswith(HIGHER_IS_BETTER):
+                better = change
+            elif key.endswith(LOWER_IS_BETTER):
+                better = -change
+            else:
+                rows.append((name, key, before, value, change, ''))
+                continue
+            verdict = 'melhor' if better >= threshold else 'pior' if better <= -threshold else '='
+            rows.append((name, key, before, value, change, verdict))
+    return rows
+
+
+def compare_main(argv: list) -> int:
+    """Compara dois arquivos de resultado; sai com código 1 se alguma métrica piorou além do limite"""
+    parser = argparse.ArgumentParser(prog='benchmark.py compare', description='Compara dois resultados')
+    parser.add_argument('base')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=10.0, help='variação mínima em %% (padrão 10)')
+    args = parser.parse_args(argv)
+
+    with open(args.base) as base_file, open(args.new) as new_file:
+        base, new = json.load(base_file), json.load(new_file)
+
+    print(f"Base: {(base.get('commit') or '?')[:10]}  Novo: {(new.get('commit') or '?')[:10]}")
+    if base.get('size') != new.get('size') or base.get('stub') != new.get('stub'):
+        print("⚠️ Os resultados foram gerados com --size ou opções do Mailgun falso diferentes")
+
+    rows = compare_results(base, new, args.threshold)
+    icons = {'melhor': '✅', 'pior': '❌', '=': '  ', '': '  '}
+    for name, key, before, value, change, verdict in rows:
+        variation = f' ({change:+.1f}%)' if change is not None else ''
+        print(f"{icons[verdict]} {name}.{key}: {before:.2f} -> {value:.2f}{variation}")
+
+    regressions = sum(1 for row in rows if row[-1] == 'pior')
+    print(f"\nResultado: {regressions} métricas pioraram mais de {args.threshold:.0f}%")
+    return 1 if regressions else 0
+
+
+def main(argv: list = None):
+    """Executa os cenários selecionados, imprime e (com --output) grava os resultados em JSON"""
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ['compare']:
+        sys.exit(compare_main(argv[1:]))
+
+    parser = argparse.ArgumentParser(description='Benchmarks do sistema de Cold Emails')
+    parser.add_argument('scenarios', nargs='*', help=f'cenários ({", ".join(SCENARIOS)}); padrão: todos')
+    parser.add_argument('--size', type=parse_size, help='volume dos cenários de escala: 10k, 100k, 1m ou N')
+    parser.add_argument('--repeat', type=int, default=1, help='execuções por cenário (grava a mediana)')
+    parser.add_argument('--output', help='arquivo JSON com os resultados')
+    parser.add_argument('--latency', type=float, help='atraso do Mailgun falso por requisição (s)')
+    parser.add_argument('--error-rate', type=float, help='fração de envios com 503')
+    parser.add_argument('--throttle-rate', type=float, help='fração de envios com 429')
+    parser.add_argument('--retry-after', type=float, help='Retry-After dos 429 (s)')
+    args = parser.parse_args(argv)
+
+    STUB_OPTIONS.clear()
+    STUB_OPTIONS.update({
+        name: value for name, value in (
+            ('latency', args.latency), ('error_rate', args.error_rate),
+            ('throttle_rate', args.throttle_rate), ('retry_after', args.retry_after)
+        ) if value is not None
+    })
+
+    print("⏱️ Benchmarks - Sistema de Cold Emails")
+    print("=" * 50)
+
+    results = {}
+    for name in args.scenarios or list(SCENARIOS):
+        if name not in SCENARIOS:
+            print(f"❌ Cenário desconhecido: {name}")
+            continue
+
+        print(f"\n▶️ {name}")
+        result = results[name] = run_scenario(name, args.size, args.repeat)
+        for key, value in result.items():
+            if isinstance(value, float):
+                print(f"   {key}: {value:.2f}")
+            else:
+                print(f"   {key}: {value}")
+
+    if args.output:
+        report = {
+            **git_revision(),
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'sqlite': sqlite3.sqlite_version,
+            'size': args.size,
+            'repeat': args.repeat,
+            'stub': dict(STUB_OPTIONS),
+            'results': results
+        }
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+        print(f"\n💾 Resultados gravados em {args.output}")
+
+
+if __name__ == '__main__':
+    main()
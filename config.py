@@ -8,12 +8,76 @@ class Config:
     # Configurações do Mailgun
     MAILGUN_API_KEY = os.environ.get('MAILGUN_API_KEY')
     MAILGUN_DOMAIN = os.environ.get('MAILGUN_DOMAIN', 'auditor-simples.com')
-    BASE_URL = f'https://api.mailgun.net/v3/{MAILGUN_DOMAIN}'
+    MAILGUN_API_URL = os.environ.get('MAILGUN_API_URL', 'https://api.mailgun.net').rstrip('/')
+    BASE_URL = f'{MAILGUN_API_URL}/v3/{MAILGUN_DOMAIN}'
+    
+    # Transporte HTTP
+    MAILGUN_MAX_CONCURRENCY = int(os.environ.get('MAILGUN_MAX_CONCURRENCY', 4))
+    HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 10))
+    HTTP_TIMEOUT = float(os.environ.get('HTTP_TIMEOUT', 30))
     
     # Configurações de envio
     BATCH_SIZE = int(os.environ.get('BATCH_SIZE', 1000))
+    # Tamanho máximo de cada POST /messages (o Mailgun aceita até 25MB por mensagem)
+    MAILGUN_MAX_PAYLOAD_BYTES = int(os.environ.get('MAILGUN_MAX_PAYLOAD_BYTES', 10 * 1024 * 1024))
     DELAY_BETWEEN_BATCHES = int(os.environ.get('DELAY_BETWEEN_BATCHES', 60))
     MAX_EMAILS_PER_DAY = int(os.environ.get('MAX_EMAILS_PER_DAY', 10000))
+    # Fuso horário que define a virada do dia da cota e das estatísticas (padrão: UTC-3)
+    UTC_OFFSET_HOURS = float(os.environ.get('UTC_OFFSET_HOURS', -3))
+    
+    # Configurações do agendador de envios
+    DISPATCH_WORKERS = int(os.environ.get('DISPATCH_WORKERS', MAILGUN_MAX_CONCURRENCY))
+    SEND_RATE_PER_MINUTE = float(os.environ.get(
+        'SEND_RATE_PER_MINUTE', BATCH_SIZE * 60 / max(DELAY_BETWEEN_BATCHES, 1)
+    ))
+    SEND_BURST = int(os.environ.get('SEND_BURST', BATCH_SIZE))
+    SEND_JOB_LEASE_SECONDS = int(os.environ.get('SEND_JOB_LEASE_SECONDS', 600))
+    DISPATCH_POLL_INTERVAL = float(os.environ.get('DISPATCH_POLL_INTERVAL', 2))
+    # Novas tentativas de lotes com falha temporária (429, 5xx, rede)
+    SEND_MAX_ATTEMPTS = int(os.environ.get('SEND_MAX_ATTEMPTS', 5))
+    RETRY_BASE_SECONDS = float(os.environ.get('RETRY_BASE_SECONDS', 30))
+    RETRY_MAX_SECONDS = float(os.environ.get('RETRY_MAX_SECONDS', 1800))
+    # Falhas seguidas que abrem o circuito do domínio e quanto tempo ele fica aberto
+    CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', 5))
+    CIRCUIT_COOLDOWN_SECONDS = float(os.environ.get('CIRCUIT_COOLDOWN_SECONDS', 120))
+    
+    # Configurações de importação
+    IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 5000))
+    
+    # Validação de emails
+    VALIDATION_CONCURRENCY = int(os.environ.get('VALIDATION_CONCURRENCY', 4))
+    VALIDATION_RATE_PER_MINUTE = float(os.environ.get('VALIDATION_RATE_PER_MINUTE', 300))
+    VALIDATION_CACHE_TTL_DAYS = float(os.environ.get('VALIDATION_CACHE_TTL_DAYS', 30))
+    VALIDATION_DOMAIN_TTL_HOURS = float(os.environ.get('VALIDATION_DOMAIN_TTL_HOURS', 24))
+    
+    # Sincronização de supressões (bounces, descadastros e reclamações)
+    SUPPRESSION_PAGE_SIZE = int(os.environ.get('SUPPRESSION_PAGE_SIZE', 1000))
+    SUPPRESSION_REFRESH_SECONDS = float(os.environ.get('SUPPRESSION_REFRESH_SECONDS', 300))
+    
+    # Sincronização de eventos pela API /events (0 = desativada)
+    EVENT_SYNC_INTERVAL = float(os.environ.get('EVENT_SYNC_INTERVAL', 0))
+    EVENT_SYNC_PAGE_SIZE = int(os.environ.get('EVENT_SYNC_PAGE_SIZE', 300))
+    EVENT_SYNC_SETTLE_SECONDS = float(os.environ.get('EVENT_SYNC_SETTLE_SECONDS', 1800))
+    EVENT_SYNC_LOOKBACK_HOURS = float(os.environ.get('EVENT_SYNC_LOOKBACK_HOURS', 24))
+    EVENT_DEDUP_RETENTION_DAYS = float(os.environ.get('EVENT_DEDUP_RETENTION_DAYS', 7))
+    
+    # Ingestão de webhooks
+    WEBHOOK_QUEUE_SIZE = int(os.environ.get('WEBHOOK_QUEUE_SIZE', 10000))
+    WEBHOOK_BATCH_SIZE = int(os.environ.get('WEBHOOK_BATCH_SIZE', 500))
+    WEBHOOK_FLUSH_INTERVAL = float(os.environ.get('WEBHOOK_FLUSH_INTERVAL', 1.0))
+    WEBHOOK_ENQUEUE_TIMEOUT = float(os.environ.get('WEBHOOK_ENQUEUE_TIMEOUT', 0.5))
+    
+    # Cache de respostas dos endpoints de leitura do painel
+    RESPONSE_CACHE_TTL_SECONDS = float(os.environ.get('RESPONSE_CACHE_TTL_SECONDS', 30))
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 256))
+    
+    # Progresso dos envios em tempo real (Server-Sent Events)
+    PROGRESS_BUFFER_SIZE = int(os.environ.get('PROGRESS_BUFFER_SIZE', 100))
+    PROGRESS_HEARTBEAT_SECONDS = float(os.environ.get('PROGRESS_HEARTBEAT_SECONDS', 15))
+    
+    # Métricas (/metrics); com vários workers do gunicorn, METRICS_DIR é o diretório compartilhado
+    METRICS_DIR = os.environ.get('METRICS_DIR', '')
+    METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', 5))
     
     # Configurações da aplicação
     PORT = int(os.environ.get('PORT', 5000))
@@ -0,0 +1,119 @@
+import csv
+import re
+import time
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from config import Config
+from database import Database
+from metrics import IMPORT_ROWS, IMPORT_SECONDS
+
+# Validação sintática simples: algo@dominio.tld, sem espaços
+EMAIL_PATTERN = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+CONTACT_FIELDS = ('name', 'company', 'position')
+
+
+def normalize_email(value: Optional[str]) -> str:
+    """Remove espaços e padroniza o email em minúsculas"""
+    return (value or '').strip().lower()
+
+
+def is_valid_email(email: str) -> bool:
+    """Verifica se o email tem um formato aceitável"""
+    return bool(EMAIL_PATTERN.match(email))
+
+
+class ContactImporter:
+    """Importa contatos de CSV em streaming, em blocos de tamanho fixo"""
+
+    def __init__(self, db: Database, chunk_size: int = None,
+                 progress_callback: Callable[[Dict], None] = None):
+        self.db = db
+        self.chunk_size = chunk_size or Config.IMPORT_CHUNK_SIZE
+        self.progress_callback = progress_callback or self.print_progress
+
+    @staticmethod
+    def new_batch_id() -> str:
+        """Gera um ID único para um lote de importação"""
+        return f"batch_{uuid.uuid4().hex[:8]}_{int(datetime.now().timestamp())}"
+
+    @staticmethod
+    def print_progress(progress: Dict):
+        """Callback padrão: imprime o andamento de cada bloco"""
+        print(
+            f"Importação {progress['batch_id']}: {progress['rows_read']} linhas lidas, "
+            f"{progress['imported']} importadas, {progress['invalid']} inválidas "
+            f"({progress['chunk_rows_per_sec']:.0f} linhas/s no último bloco)"
+        )
+
+    def iter_chunks(self, csv_file_path: str, source: str,
+                    batch_id: str) -> Iterator[Tuple[List[tuple], int, int]]:
+        """Lê o CSV linha a linha e produz (linhas válidas, inválidas, lidas) por bloco"""
+        imported_at = datetime.now()
+        with open(csv_file_path, newline='', encoding='utf-8-sig') as csv_file:
+            reader = csv.DictReader(csv_file)
+            rows = []
+            invalid = 0
+            read = 0
+
+            for record in reader:
+                read += 1
+                email = normalize_email(record.get('email'))
+                if not is_valid_email(email):
+                    invalid += 1
+                    continue
+
+                rows.append((
+                    email,
+                    *((record.get(field) or '').strip() for field in CONTACT_FIELDS),
+                    source,
+                    batch_id,
+                    imported_at
+                ))
+
+                if len(rows) >= self.chunk_size:
+                    yield rows, invalid, read
+                    rows, invalid, read = [], 0, 0
+
+            if read:
+                yield rows, invalid, read
+
+    def import_file(self, csv_file_path: str, source: str = 'csv_import',
+                    batch_id: str = None) -> Dict:
+        """Importa o arquivo inteiro, um bloco por transação"""
+        batch_id = batch_id or self.new_batch_id()
+        progress = {
+            'batch_id': batch_id,
+            'rows_read': 0,
+            'imported': 0,
+            'invalid': 0,
+            'chunks': 0,
+            'chunk_rows_per_sec': 0.0,
+            'elapsed_seconds': 0.0
+        }
+        started = time.perf_counter()
+
+        # O novo lote passa a ser o único ativo (uma escrita no registro de lotes)
+        self.db.activate_batch(batch_id, create=True)
+
+        chunk_started = time.perf_counter()
+        for rows, invalid, read in self.iter_chunks(csv_file_path, source, batch_id):
+            if rows:
+                self.db.insert_contact_rows(rows)
+
+            chunk_seconds = time.perf_counter() - chunk_started
+            progress['rows_read'] += read
+            progress['imported'] += len(rows)
+            progress['invalid'] += invalid
+            progress['chunks'] += 1
+            IMPORT_ROWS.inc(len(rows), result='imported')
+            IMPORT_ROWS.inc(invalid, result='invalid')
+            progress['chunk_rows_per_sec'] = read / chunk_seconds if chunk_seconds else 0.0
+            progress['elapsed_seconds'] = time.perf_counter() - started
+            self.progress_callback(dict(progress))
+            chunk_started = time.perf_counter()
+
+        IMPORT_SECONDS.observe(time.perf_counter() - started)
+        return progress
@@ -1,24 +1,598 @@
 import sqlite3
 import json
+import queue
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import Iterable, Iterator, List, Dict, Optional, Tuple
 import os
+import time
 
 from dotenv import load_dotenv
 
+from metrics import DB_ERRORS, DB_QUERY_SECONDS, timed_methods
+
 load_dotenv()  # Load environment variables from .env file
 
+
+class ConnectionPool:
+    """Pool limitado de conexões SQLite de longa duração"""
+
+    # Aplicados uma vez por conexão, ao abri-la
+    PRAGMAS = (
+        'PRAGMA journal_mode = WAL',
+        'PRAGMA synchronous = NORMAL',
+        'PRAGMA cache_size = -20000',  # ~20 MB de cache de páginas
+        'PRAGMA mmap_size = 268435456',  # 256 MB mapeados em memória
+        'PRAGMA temp_store = MEMORY',
+        # Faz o INSERT OR REPLACE disparar os triggers de DELETE (contagem de contact_batches)
+        'PRAGMA recursive_triggers = ON',
+    )
+
+    def __init__(self, db_path: str, size: int = None, timeout: float = 30.0,
+                 cached_statements: int = 256):
+        self.db_path = db_path
+        self.size = size or int(os.getenv('DB_POOL_SIZE', 8))
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self._idle = queue.LifoQueue(maxsize=self.size)
+        self._pid = os.getpid()
+
+    def _open(self) -> sqlite3.Connection:
+        """Abre uma nova conexão já configurada"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.timeout,
+            check_same_thread=False,
+            cached_statements=self.cached_statements
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma in self.PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _check_fork(self):
+        """Descarta conexões herdadas de outro processo (ex: fork do gunicorn)"""
+        if os.getpid() != self._pid:
+            self._idle = queue.LifoQueue(maxsize=self.size)
+            self._pid = os.getpid()
+
+    def acquire(self) -> sqlite3.Connection:
+        """Retira uma conexão do pool, abrindo uma nova se nenhuma estiver livre"""
+        self._check_fork()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._open()
+
+    def release(self, conn: sqlite3.Connection):
+        """Devolve a conexão ao pool; o excedente é fechado"""
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    @contextmanager
+    def connection(self):
+        """Empresta uma conexão com commit ao final e rollback em caso de erro"""
+        conn = self.acquire()
+        try:
+            with conn:
+                yield conn
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        """Fecha todas as conexões ociosas"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class DataVersions:
+    """Versão de cada grupo de dados (contatos, campanhas...) na tabela data_versions, incrementada
+    na mesma transação de cada escrita; vale para todos os processos que usam o banco"""
+
+    def __init__(self, pool: ConnectionPool):
+        self.pool = pool
+
+    def get(self, *names: str) -> tuple:
+        """Versões atuais dos grupos informados (chave de cache), em uma leitura pela chave primária"""
+        with self.pool.connection() as conn:
+            rows = dict(conn.execute(
+                f"SELECT name, version FROM data_versions WHERE name IN ({', '.join('?' * len(names))})",
+                names
+            ).fetchall())
+        return tuple(rows.get(name, 0) for name in names)
+
+    def bump(self, conn: sqlite3.Connection, *names: str):
+        """Marca os grupos como alterados na transação da escrita"""
+        conn.executemany('''
+            INSERT INTO data_versions (name, version) VALUES (?, 1)
+            ON CONFLICT (name) DO UPDATE SET version = version + 1
+        ''', [(name,) for name in names])
+
+
+# Contatos que entram em campanhas: ativos e sem lote ou em um lote ativo no registro
+SENDABLE_CONTACTS_SQL = '''status = 'active' AND (
+    batch_id IS NULL OR batch_id IN (SELECT batch_id FROM contact_batches WHERE active = 1)
+)'''
+
+# Filtro das listagens para "quem recebe campanhas" ('active' é só o status do próprio contato)
+SENDABLE_STATUS = 'sendable'
+
+
+def _status_filter(status: str) -> Tuple[str, list]:
+    """Condição e parâmetros do filtro de status das listagens de contatos"""
+    if status == SENDABLE_STATUS:
+        return SENDABLE_CONTACTS_SQL, []
+    return 'status = ?', [status]
+
+# Eventos resumidos por hora em stats_hourly e a coluna de data de cada um em email_logs
+ROLLUP_EVENTS = (
+    ('sent', 'sent_at'),
+    ('delivered', 'delivered_at'),
+    ('opened', 'opened_at'),
+    ('clicked', 'clicked_at'),
+    ('bounced', 'bounced_at'),
+)
+
+# Hora cheia em UTC (as datas em email_logs estão no horário local do servidor)
+ROLLUP_HOUR_SQL = "strftime('%Y-%m-%d %H:00', {}, 'utc')"
+
+
+def _rollup_upsert(row: str, event: str, column: str, delta: int, condition: str = '') -> str:
+    """Soma delta no resumo horário do evento; datas vazias ou inválidas são ignoradas"""
+    return f'''
+               INSERT INTO stats_hourly (hour, campaign_id, event, count)
+               SELECT hour, COALESCE({row}.campaign_id, 0), '{event}', {delta}
+               FROM (SELECT {ROLLUP_HOUR_SQL.format(f'{row}.{column}')} AS hour)
+               WHERE hour IS NOT NULL{condition}
+               ON CONFLICT (hour, campaign_id, event) DO UPDATE SET count = count + excluded.count;'''
+
+
+# Condição de escrita em um job: só quem ainda detém a reserva (id, worker, claimed_at)
+CLAIM_HELD_SQL = "id = ? AND status = 'in_flight' AND worker = ? AND claimed_at = ?"
+
+
+def _sendable_row(row: str) -> str:
+    """SENDABLE_CONTACTS_SQL para uma linha de trigger (NEW ou OLD)"""
+    return f'''({row}.status = 'active' AND ({row}.batch_id IS NULL OR EXISTS (
+        SELECT 1 FROM contact_batches WHERE batch_id = {row}.batch_id AND active = 1
+    )))'''
+
+
+def _counter_update(name: str, delta: str) -> str:
+    return f"UPDATE stat_counters SET value = value + {delta} WHERE name = '{name}';"
+
+
+# Migrações versionadas do esquema (PRAGMA user_version).
+# A posição na tupla + 1 é a versão resultante; nunca altere uma migração já publicada.
+SCHEMA_MIGRATIONS = (
+    # 1: índices das consultas mais frequentes
+    (
+        'CREATE INDEX IF NOT EXISTS idx_contacts_batch_id ON contacts (batch_id)',
+        'CREATE INDEX IF NOT EXISTS idx_contacts_status ON contacts (status)',
+        'CREATE INDEX IF NOT EXISTS idx_email_logs_email ON email_logs (email)',
+        # Cobre get_campaign_stats sem acessar a tabela
+        '''CREATE INDEX IF NOT EXISTS idx_email_logs_campaign
+           ON email_logs (campaign_id, opened_at, clicked_at, bounced_at)''',
+        'CREATE INDEX IF NOT EXISTS idx_email_logs_sent_at ON email_logs (sent_at)',
+    ),
+    # 2: resumo incremental de estatísticas por campanha, mantido por triggers
+    (
+        '''CREATE TABLE IF NOT EXISTS campaign_stats (
+               campaign_id INTEGER PRIMARY KEY,
+               total_sent INTEGER NOT NULL DEFAULT 0,
+               total_opened INTEGER NOT NULL DEFAULT 0,
+               total_clicked INTEGER NOT NULL DEFAULT 0,
+               total_bounced INTEGER NOT NULL DEFAULT 0
+           )''',
+        '''INSERT OR REPLACE INTO campaign_stats
+               (campaign_id, total_sent, total_opened, total_clicked, total_bounced)
+           SELECT campaign_id, COUNT(*), COUNT(opened_at), COUNT(clicked_at), COUNT(bounced_at)
+           FROM email_logs WHERE campaign_id IS NOT NULL GROUP BY campaign_id''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_email_logs_stats_insert
+           AFTER INSERT ON email_logs
+           BEGIN
+               INSERT INTO campaign_stats
+                   (campaign_id, total_sent, total_opened, total_clicked, total_bounced)
+               VALUES (NEW.campaign_id, 1, NEW.opened_at IS NOT NULL,
+                       NEW.clicked_at IS NOT NULL, NEW.bounced_at IS NOT NULL)
+               ON CONFLICT (campaign_id) DO UPDATE SET
+                   total_sent = total_sent + 1,
+                   total_opened = total_opened + excluded.total_opened,
+                   total_clicked = total_clicked + excluded.total_clicked,
+                   total_bounced = total_bounced + excluded.total_bounced;
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_email_logs_stats_update
+           AFTER UPDATE OF opened_at, clicked_at, bounced_at ON email_logs
+           BEGIN
+               UPDATE campaign_stats SET
+                   total_opened = total_opened + (NEW.opened_at IS NOT NULL) - (OLD.opened_at IS NOT NULL),
+                   total_clicked = total_clicked + (NEW.clicked_at IS NOT NULL) - (OLD.clicked_at IS NOT NULL),
+                   total_bounced = total_bounced + (NEW.bounced_at IS NOT NULL) - (OLD.bounced_at IS NOT NULL)
+               WHERE campaign_id = NEW.campaign_id;
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_email_logs_stats_delete
+           AFTER DELETE ON email_logs
+           BEGIN
+               UPDATE campaign_stats SET
+                   total_sent = total_sent - 1,
+                   total_opened = total_opened - (OLD.opened_at IS NOT NULL),
+                   total_clicked = total_clicked - (OLD.clicked_at IS NOT NULL),
+                   total_bounced = total_bounced - (OLD.bounced_at IS NOT NULL)
+               WHERE campaign_id = OLD.campaign_id;
+           END''',
+    ),
+    # 3: atualizações de eventos por message_id
+    (
+        'ALTER TABLE email_logs ADD COLUMN delivered_at TIMESTAMP',
+        "UPDATE email_logs SET message_id = TRIM(message_id, '<>') WHERE message_id LIKE '<%'",
+        'CREATE INDEX IF NOT EXISTS idx_email_logs_message ON email_logs (message_id, email)',
+    ),
+    # 4: cota diária e limite de taxa compartilhados entre processos
+    (
+        '''CREATE TABLE IF NOT EXISTS send_quota (
+               day TEXT PRIMARY KEY,
+               sent INTEGER NOT NULL DEFAULT 0,
+               reserved INTEGER NOT NULL DEFAULT 0
+           )''',
+        '''CREATE TABLE IF NOT EXISTS send_quota_reservations (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               day TEXT NOT NULL,
+               amount INTEGER NOT NULL,
+               holder TEXT,
+               created_at REAL NOT NULL
+           )''',
+        '''CREATE INDEX IF NOT EXISTS idx_send_quota_reservations_created
+           ON send_quota_reservations (created_at)''',
+        '''CREATE TABLE IF NOT EXISTS rate_buckets (
+               name TEXT PRIMARY KEY,
+               tokens REAL NOT NULL,
+               updated REAL NOT NULL
+           )''',
+        # Parte dos envios já registrados para não zerar a cota do dia na atualização
+        '''INSERT OR IGNORE INTO send_quota (day, sent)
+           SELECT date(sent_at), COUNT(*) FROM email_logs
+           WHERE sent_at IS NOT NULL GROUP BY date(sent_at)''',
+    ),
+    # 5: cache de validação de emails e domínios
+    (
+        '''CREATE TABLE IF NOT EXISTS email_validations (
+               address TEXT PRIMARY KEY,
+               status TEXT NOT NULL,
+               reason TEXT,
+               checked_at REAL NOT NULL
+           )''',
+        '''CREATE TABLE IF NOT EXISTS domain_validations (
+               domain TEXT PRIMARY KEY,
+               has_mx INTEGER NOT NULL,
+               checked_at REAL NOT NULL
+           )''',
+    ),
+    # 6: supressões (bounces, descadastros e reclamações) e checkpoints de sincronização
+    (
+        '''CREATE TABLE IF NOT EXISTS suppressions (
+               email TEXT NOT NULL,
+               reason TEXT NOT NULL,
+               created_at REAL,
+               details TEXT,
+               synced_at REAL NOT NULL,
+               PRIMARY KEY (email, reason)
+           )''',
+        'CREATE INDEX IF NOT EXISTS idx_suppressions_synced_at ON suppressions (synced_at)',
+        '''CREATE TABLE IF NOT EXISTS sync_checkpoints (
+               name TEXT PRIMARY KEY,
+               cursor TEXT,
+               updated_at REAL NOT NULL
+           )''',
+    ),
+    # 7: ids de eventos já aplicados pela sincronização de eventos
+    (
+        '''CREATE TABLE IF NOT EXISTS processed_events (
+               event_id TEXT PRIMARY KEY,
+               seen_at REAL NOT NULL
+           )''',
+        'CREATE INDEX IF NOT EXISTS idx_processed_events_seen_at ON processed_events (seen_at)',
+    ),
+    # 8: registro de lotes de contatos (ativação sem reescrever a tabela contacts)
+    (
+        '''CREATE TABLE IF NOT EXISTS contact_batches (
+               batch_id TEXT PRIMARY KEY,
+               active INTEGER NOT NULL DEFAULT 0,
+               contact_count INTEGER NOT NULL DEFAULT 0,
+               first_import TIMESTAMP,
+               last_import TIMESTAMP,
+               activated_at TIMESTAMP
+           )''',
+        '''CREATE INDEX IF NOT EXISTS idx_contact_batches_active
+           ON contact_batches (batch_id) WHERE active = 1''',
+        '''INSERT OR IGNORE INTO contact_batches (batch_id, active, contact_count, first_import, last_import)
+           SELECT batch_id, MAX(status = 'active'), COUNT(*), MIN(created_at), MAX(created_at)
+           FROM contacts WHERE batch_id IS NOT NULL GROUP BY batch_id''',
+        # 'inactive' em lotes inativos vinha da ativação antiga, que gravava o mesmo updated_at em
+        # todo o lote; só essas linhas voltam a 'active' (contatos desativados depois, um a um,
+        # têm updated_at posterior e continuam inativos). Agora quem decide é o registro.
+        # O menor updated_at de cada lote é calculado uma vez (e não por linha, o que seria quadrático)
+        '''WITH first_update AS (
+               SELECT batch_id, MIN(updated_at) AS updated_at FROM contacts
+               WHERE batch_id IN (SELECT batch_id FROM contact_batches WHERE active = 0)
+               GROUP BY batch_id
+           )
+           UPDATE contacts SET status = 'active'
+           WHERE status = 'inactive'
+             AND (batch_id, updated_at) IN (SELECT batch_id, updated_at FROM first_update)''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_contacts_batch_insert
+           AFTER INSERT ON contacts WHEN NEW.batch_id IS NOT NULL
+           BEGIN
+               INSERT INTO contact_batches (batch_id, contact_count, first_import, last_import)
+               VALUES (NEW.batch_id, 1, NEW.created_at, NEW.created_at)
+               ON CONFLICT (batch_id) DO UPDATE SET
+                   contact_count = contact_count + 1,
+                   first_import = COALESCE(first_import, excluded.first_import),
+                   last_import = excluded.last_import;
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_contacts_batch_delete
+           AFTER DELETE ON contacts WHEN OLD.batch_id IS NOT NULL
+           BEGIN
+               UPDATE contact_batches SET contact_count = contact_count - 1
+               WHERE batch_id = OLD.batch_id;
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_contacts_batch_update
+           AFTER UPDATE OF batch_id ON contacts WHEN OLD.batch_id IS NOT NEW.batch_id
+           BEGIN
+               UPDATE contact_batches SET contact_count = contact_count - 1
+               WHERE batch_id = OLD.batch_id;
+               INSERT INTO contact_batches (batch_id, contact_count, first_import, last_import)
+               SELECT NEW.batch_id, 1, NEW.updated_at, NEW.updated_at WHERE NEW.batch_id IS NOT NULL
+               ON CONFLICT (batch_id) DO UPDATE SET
+                   contact_count = contact_count + 1,
+                   last_import = excluded.last_import;
+           END''',
+    ),
+    # 9: destinatários com falha definitiva de envio e circuit breaker compartilhado
+    (
+        '''CREATE TABLE IF NOT EXISTS dead_letters (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               campaign_id INTEGER NOT NULL,
+               contact_id INTEGER NOT NULL,
+               email TEXT NOT NULL,
+               job_id INTEGER,
+               error_class TEXT NOT NULL,
+               error TEXT,
+               attempts INTEGER DEFAULT 0,
+               created_at REAL NOT NULL,
+               requeued_at REAL
+           )''',
+        '''CREATE INDEX IF NOT EXISTS idx_dead_letters_pending
+           ON dead_letters (campaign_id, id) WHERE requeued_at IS NULL''',
+        '''CREATE TABLE IF NOT EXISTS circuit_breakers (
+               name TEXT PRIMARY KEY,
+               state TEXT NOT NULL DEFAULT 'closed',
+               failures INTEGER NOT NULL DEFAULT 0,
+               open_until REAL NOT NULL DEFAULT 0,
+               updated REAL NOT NULL
+           )''',
+    ),
+    # 10: resumos por hora (por campanha e evento) e contadores do painel, mantidos por triggers
+    (
+        '''CREATE TABLE IF NOT EXISTS stats_hourly (
+               hour TEXT NOT NULL,
+               campaign_id INTEGER NOT NULL,
+               event TEXT NOT NULL,
+               count INTEGER NOT NULL DEFAULT 0,
+               PRIMARY KEY (hour, campaign_id, event)
+           ) WITHOUT ROWID''',
+        'CREATE INDEX IF NOT EXISTS idx_stats_hourly_campaign ON stats_hourly (campaign_id, hour)',
+        '''INSERT INTO stats_hourly (hour, campaign_id, event, count)
+           SELECT hour, campaign_id, event, COUNT(*) FROM ({}) WHERE hour IS NOT NULL
+           GROUP BY hour, campaign_id, event'''.format(' UNION ALL '.join(
+            f"SELECT {ROLLUP_HOUR_SQL.format(column)} AS hour, COALESCE(campaign_id, 0) AS campaign_id, "
+            f"'{event}' AS event FROM email_logs WHERE {column} IS NOT NULL"
+            for event, column in ROLLUP_EVENTS
+        )),
+        '''CREATE TRIGGER IF NOT EXISTS trg_email_logs_rollup_insert
+           AFTER INSERT ON email_logs
+           BEGIN{}
+           END'''.format(''.join(_rollup_upsert('NEW', event, column, 1) for event, column in ROLLUP_EVENTS)),
+        '''CREATE TRIGGER IF NOT EXISTS trg_email_logs_rollup_update
+           AFTER UPDATE OF {} ON email_logs
+           BEGIN{}
+           END'''.format(', '.join(column for _, column in ROLLUP_EVENTS), ''.join(
+            _rollup_upsert('OLD', event, column, -1, f' AND OLD.{column} IS NOT NEW.{column}')
+            + _rollup_upsert('NEW', event, column, 1, f' AND OLD.{column} IS NOT NEW.{column}')
+            for event, column in ROLLUP_EVENTS
+        )),
+        '''CREATE TRIGGER IF NOT EXISTS trg_email_logs_rollup_delete
+           AFTER DELETE ON email_logs
+           BEGIN{}
+           END'''.format(''.join(_rollup_upsert('OLD', event, column, -1) for event, column in ROLLUP_EVENTS)),
+        '''CREATE TABLE IF NOT EXISTS stat_counters (
+               name TEXT PRIMARY KEY,
+               value INTEGER NOT NULL DEFAULT 0
+           )''',
+        f'''INSERT OR REPLACE INTO stat_counters (name, value)
+            SELECT 'sendable_contacts', COUNT(*) FROM contacts WHERE {SENDABLE_CONTACTS_SQL}
+            UNION ALL SELECT 'campaigns', COUNT(*) FROM campaigns''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_contacts_counter_insert
+            AFTER INSERT ON contacts
+            BEGIN
+                {_counter_update('sendable_contacts', _sendable_row('NEW'))}
+            END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_contacts_counter_delete
+            AFTER DELETE ON contacts
+            BEGIN
+                {_counter_update('sendable_contacts', '-' + _sendable_row('OLD'))}
+            END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_contacts_counter_update
+            AFTER UPDATE OF status, batch_id ON contacts
+            BEGIN
+                {_counter_update('sendable_contacts', _sendable_row('NEW') + ' - ' + _sendable_row('OLD'))}
+            END''',
+        # Ativar ou desativar um lote muda de uma vez todos os contatos ativos dele
+        f'''CREATE TRIGGER IF NOT EXISTS trg_contact_batches_counter_insert
+            AFTER INSERT ON contact_batches WHEN NEW.active = 1
+            BEGIN
+                {_counter_update('sendable_contacts', """(
+                    SELECT COUNT(*) FROM contacts WHERE batch_id = NEW.batch_id AND status = 'active'
+                )""")}
+            END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_contact_batches_counter_update
+            AFTER UPDATE OF active ON contact_batches WHEN OLD.active IS NOT NEW.active
+            BEGIN
+                {_counter_update('sendable_contacts', """(NEW.active - OLD.active) * (
+                    SELECT COUNT(*) FROM contacts WHERE batch_id = NEW.batch_id AND status = 'active'
+                )""")}
+            END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_campaigns_counter_insert
+            AFTER INSERT ON campaigns
+            BEGIN
+                {_counter_update('campaigns', '1')}
+            END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_campaigns_counter_delete
+            AFTER DELETE ON campaigns
+            BEGIN
+                {_counter_update('campaigns', '-1')}
+            END''',
+    ),
+    # 11: versões dos grupos de dados para o cache de respostas, compartilhadas entre processos
+    (
+        '''CREATE TABLE IF NOT EXISTS data_versions (
+               name TEXT PRIMARY KEY,
+               version INTEGER NOT NULL DEFAULT 0
+           ) WITHOUT ROWID''',
+    ),
+)
+
+# Limite de parâmetros por consulta IN (...)
+SQL_IN_CHUNK = 900
+
+RECIPIENT_COLUMNS = ('id', 'email', 'name', 'company', 'position', 'source')
+
+
+class Recipient:
+    """Destinatário de um lote: só as colunas usadas no envio, sem dict por linha"""
+
+    __slots__ = RECIPIENT_COLUMNS + ('extra',)
+
+    def __init__(self, id, email, name=None, company=None, position=None, source=None, extra=None):
+        self.id = id
+        self.email = email
+        self.name = name
+        self.company = company
+        self.position = position
+        self.source = source
+        # Outras colunas pedidas pelo template da campanha
+        self.extra = extra
+
+    @classmethod
+    def from_cursor(cls, cursor, row) -> 'Recipient':
+        """row_factory para consultas que selecionam RECIPIENT_COLUMNS"""
+        return cls(*row)
+
+    @classmethod
+    def row_factory(cls, extra_fields: List[str]):
+        """row_factory para RECIPIENT_COLUMNS seguidas das colunas extras informadas"""
+        if not extra_fields:
+            return cls.from_cursor
+        count = len(RECIPIENT_COLUMNS)
+
+        def build(cursor, row):
+            return cls(*row[:count], extra=dict(zip(extra_fields, row[count:])))
+        return build
+
+    # Acesso no estilo dict, como as linhas de contato usadas no resto do código
+    def __getitem__(self, key):
+        if key in RECIPIENT_COLUMNS:
+            return getattr(self, key)
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def as_dict(self) -> Dict:
+        data = {column: getattr(self, column) for column in RECIPIENT_COLUMNS}
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+SCHEMA_VERSION = len(SCHEMA_MIGRATIONS)
+
+# Campo de data preenchido por cada status vindo dos eventos do Mailgun
+EVENT_TIMESTAMP_FIELDS = {
+    'delivered': 'delivered_at',
+    'opened': 'opened_at',
+    'clicked': 'clicked_at',
+    'bounced': 'bounced_at'
+}
+
+# Precedência dos status: um evento atrasado nunca rebaixa o status (ex: delivered após opened)
+STATUS_RANK = {
+    'pending': 0,
+    'sent': 1,
+    'delivered': 2,
+    'opened': 3,
+    'clicked': 4,
+    'bounced': 5,
+    'complained': 5,
+    'unsubscribed': 5
+}
+
+STATUS_RANK_SQL = 'CASE status {} ELSE 0 END'.format(
+    ' '.join(f"WHEN '{status}' THEN {rank}" for status, rank in STATUS_RANK.items())
+)
+
+
+def normalize_message_id(message_id: Optional[str]) -> Optional[str]:
+    """Remove espaços e os sinais < > que o Mailgun usa no ID retornado pelo envio"""
+    if not message_id:
+        return None
+    return message_id.strip().strip('<>') or None
+
+
+# Duração de cada método público em db_query_duration_seconds{method}
+@timed_methods(DB_QUERY_SECONDS, DB_ERRORS, skip=('connection', 'close'))
 class Database:
     def __init__(self, db_path: str = os.getenv('DB_PATH', 'cold_emails.db')):
         self.db_path = db_path
+        self.pool = ConnectionPool(db_path)
+        self._contact_columns = None
+        # Versões dos dados escritos (invalidação do cache de respostas)
+        self.versions = DataVersions(self.pool)
         self.init_database()
     
+    def connection(self):
+        """Retorna uma conexão do pool para uso em bloco with"""
+        return self.pool.connection()
+    
+    @contextmanager
+    def changing(self, *names: str):
+        """Conexão de escrita: muda a versão dos grupos de dados alterados na mesma transação"""
+        with self.connection() as conn:
+            yield conn
+            self.versions.bump(conn, *names)
+    
+    def close(self):
+        """Fecha as conexões mantidas pelo pool"""
+        self.pool.close_all()
+    
     def init_database(self):
         """Inicializa o banco de dados com as tabelas necessárias"""
         # Certifique-se de que o diretório do banco existe
-        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
 
-        with sqlite3.connect(self.db_path) as conn:
+        with self.connection() as conn:
             cursor = conn.cursor()
             
             # Tabela de contatos - adicionando batch_id para controle de lotes
@@ -75,12 +649,63 @@ class Database:
                 )
             ''')
             
+            # Adiciona coluna message_id se não existir (para compatibilidade)
+            try:
+                cursor.execute('ALTER TABLE email_logs ADD COLUMN message_id TEXT')
+            except sqlite3.OperationalError:
+                # Coluna já existe
+                pass
+            
+            # Fila persistente de lotes de envio (um job por lote do Mailgun)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS send_jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    campaign_id INTEGER NOT NULL,
+                    batch_number INTEGER NOT NULL,
+                    contact_ids TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    recipients_count INTEGER NOT NULL,
+                    status TEXT DEFAULT 'pending',
+                    not_before REAL NOT NULL,
+                    attempts INTEGER DEFAULT 0,
+                    worker TEXT,
+                    claimed_at REAL,
+                    message_id TEXT,
+                    error TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (campaign_id) REFERENCES campaigns (id)
+                )
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_send_jobs_status
+                ON send_jobs (status, not_before)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_send_jobs_campaign
+                ON send_jobs (campaign_id, status)
+            ''')
+            
+            self._apply_migrations(conn)
             conn.commit()
     
+    def _apply_migrations(self, conn: sqlite3.Connection):
+        """Aplica as migrações pendentes e atualiza a versão do esquema"""
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        
+        for target, statements in enumerate(SCHEMA_MIGRATIONS[version:], start=version + 1):
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {target}')
+        
+        if version < SCHEMA_VERSION:
+            # Atualiza as estatísticas do otimizador para os novos índices
+            conn.execute('ANALYZE')
+    
     def add_contact(self, email: str, name: str = None, company: str = None, 
                    position: str = None, source: str = None, batch_id: str = None) -> int:
         """Adiciona um novo contato"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.changing('contacts') as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 INSERT OR REPLACE INTO contacts (email, name, company, position, source, batch_id, updated_at)
@@ -91,51 +716,45 @@ class Database:
     
     def add_contacts_bulk(self, contacts: List[Dict], batch_id: str = None) -> int:
         """Adiciona múltiplos contatos de uma vez com controle de lote"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            count = 0
-            
-            # Se um batch_id foi fornecido, desativa contatos antigos primeiro
-            if batch_id:
-                cursor.execute('''
-                    UPDATE contacts 
-                    SET status = 'inactive', updated_at = ? 
-                    WHERE batch_id IS NOT NULL AND batch_id != ?
-                ''', (datetime.now(), batch_id))
-            
-            for contact in contacts:
-                try:
-                    cursor.execute('''
-                        INSERT OR REPLACE INTO contacts (email, name, company, position, source, batch_id, updated_at)
-                        VALUES (?, ?, ?, ?, ?, ?, ?)
-                    ''', (
-                        contact['email'], 
-                        contact.get('name'), 
-                        contact.get('company'), 
-                        contact.get('position'), 
-                        contact.get('source'), 
-                        batch_id,
-                        datetime.now()
-                    ))
-                    count += 1
-                except Exception as e:
-                    print(f"Erro ao adicionar contato {contact['email']}: {e}")
-            
-            conn.commit()
-            return count
+        # Se um batch_id foi fornecido, ele passa a ser o lote ativo
+        if batch_id:
+            self.activate_batch(batch_id, create=True)
+        
+        now = datetime.now()
+        rows = [
+            (
+                contact['email'],
+                contact.get('name'),
+                contact.get('company'),
+                contact.get('position'),
+                contact.get('source'),
+                batch_id,
+                now
+            )
+            for contact in contacts
+            if contact.get('email')
+        ]
+        return self.insert_contact_rows(rows)
     
-    def get_contacts(self, status: str = 'active', limit: int = None, batch_id: str = None) -> List[Dict]:
-        """Busca contatos por status e opcionalmente por batch_id"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
+    def insert_contact_rows(self, rows: List[tuple]) -> int:
+        """Insere tuplas (email, name, company, position, source, batch_id, updated_at) em uma transação"""
+        with self.changing('contacts') as conn:
+            conn.executemany('''
+                INSERT OR REPLACE INTO contacts (email, name, company, position, source, batch_id, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+        return len(rows)
+    
+    def get_contacts(self, status: str = SENDABLE_STATUS, limit: int = None, batch_id: str = None) -> List[Dict]:
+        """Busca contatos por status ('sendable': os que entram em campanhas) e opcionalmente por batch_id"""
+        with self.connection() as conn:
             cursor = conn.cursor()
             
+            condition, params = _status_filter(status)
+            query = f"SELECT * FROM contacts WHERE {condition}"
             if batch_id:
-                query = "SELECT * FROM contacts WHERE status = ? AND batch_id = ?"
-                params = [status, batch_id]
-            else:
-                query = "SELECT * FROM contacts WHERE status = ?"
-                params = [status]
+                query += " AND batch_id = ?"
+                params.append(batch_id)
             
             if limit:
                 query += " LIMIT ?"
@@ -145,83 +764,87 @@ class Database:
             return [dict(row) for row in cursor.fetchall()]
     
     def get_active_batches(self) -> List[Dict]:
-        """Retorna todos os lotes ativos com contagem de contatos"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT 
-                    batch_id,
-                    COUNT(*) as contact_count,
-                    MIN(created_at) as first_import,
-                    MAX(created_at) as last_import,
-                    CASE 
-                        WHEN COUNT(CASE WHEN status = 'active' THEN 1 END) > 0 THEN 'active'
-                        ELSE 'inactive'
-                    END as batch_status
-                FROM contacts 
-                WHERE batch_id IS NOT NULL 
-                GROUP BY batch_id 
+        """Retorna todos os lotes com contagem de contatos (lidos do registro de lotes)"""
+        with self.connection() as conn:
+            cursor = conn.execute('''
+                SELECT batch_id, contact_count, first_import, last_import,
+                       CASE WHEN active = 1 THEN 'active' ELSE 'inactive' END AS batch_status
+                FROM contact_batches
+                WHERE contact_count > 0
                 ORDER BY last_import DESC
             ''')
-            
-            batches = []
-            for row in cursor.fetchall():
-                batches.append({
-                    'batch_id': row[0],
-                    'contact_count': row[1],
-                    'first_import': row[2],
-                    'last_import': row[3],
-                    'batch_status': row[4]
-                })
-            
-            return batches
+            return [dict(row) for row in cursor.fetchall()]
     
-    def activate_batch(self, batch_id: str) -> bool:
-        """Ativa um lote específico e desativa todos os outros"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            
-            # Desativa todos os contatos
-            cursor.execute('''
-                UPDATE contacts 
-                SET status = 'inactive', updated_at = ?
-            ''', (datetime.now(),))
-            
-            # Ativa apenas os contatos do lote especificado
-            cursor.execute('''
-                UPDATE contacts 
-                SET status = 'active', updated_at = ?
-                WHERE batch_id = ?
-            ''', (datetime.now(), batch_id))
+    def activate_batch(self, batch_id: str, create: bool = False) -> bool:
+        """Torna o lote o único ativo (escreve só no registro de lotes)"""
+        with self.changing('contacts') as conn:
+            if not create and not conn.execute(
+                'SELECT 1 FROM contact_batches WHERE batch_id = ?', (batch_id,)
+            ).fetchone():
+                return False
             
-            conn.commit()
+            now = datetime.now()
+            conn.execute(
+                'UPDATE contact_batches SET active = 0 WHERE active = 1 AND batch_id != ?', (batch_id,)
+            )
+            conn.execute('''
+                INSERT INTO contact_batches (batch_id, active, activated_at) VALUES (?, 1, ?)
+                ON CONFLICT (batch_id) DO UPDATE SET active = 1, activated_at = excluded.activated_at
+            ''', (batch_id, now))
             return True
     
     def deactivate_batch(self, batch_id: str) -> bool:
         """Desativa um lote específico"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                UPDATE contacts 
-                SET status = 'inactive', updated_at = ?
-                WHERE batch_id = ?
-            ''', (datetime.now(), batch_id))
-            conn.commit()
-            return True
+        with self.changing('contacts') as conn:
+            cursor = conn.execute(
+                'UPDATE contact_batches SET active = 0 WHERE batch_id = ?', (batch_id,)
+            )
+            return cursor.rowcount > 0
     
     def get_contacts_by_batch(self, batch_id: str) -> List[Dict]:
         """Retorna todos os contatos de um lote específico"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
+        with self.connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT * FROM contacts WHERE batch_id = ? ORDER BY created_at DESC
             ''', (batch_id,))
             return [dict(row) for row in cursor.fetchall()]
     
+    def get_contacts_page(self, status: str = None, batch_id: str = None,
+                          after_id: int = None, limit: int = 100) -> List[Dict]:
+        """Página de contatos ordenada por id (paginação por cursor: id > after_id)"""
+        conditions = ['id > ?']
+        params = [after_id or 0]
+        if status:
+            condition, status_params = _status_filter(status)
+            conditions.append(condition)
+            params.extend(status_params)
+        if batch_id:
+            conditions.append('batch_id = ?')
+            params.append(batch_id)
+        params.append(limit)
+        
+        with self.connection() as conn:
+            cursor = conn.execute(f'''
+                SELECT * FROM contacts WHERE {' AND '.join(conditions)}
+                ORDER BY id LIMIT ?
+            ''', params)
+            return [dict(row) for row in cursor.fetchall()]
+    
+    def iter_contacts(self, status: str = None, batch_id: str = None,
+                      chunk_size: int = 1000) -> Iterator[Dict]:
+        """Percorre os contatos em blocos, sem manter uma conexão ou transação aberta entre eles"""
+        after_id = 0
+        while True:
+            page = self.get_contacts_page(status, batch_id, after_id, chunk_size)
+            yield from page
+            if len(page) < chunk_size:
+                return
+            after_id = page[-1]['id']
+    
     def create_campaign(self, name: str, subject: str, body_template: str) -> int:
         """Cria uma nova campanha"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.changing('campaigns') as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 INSERT INTO campaigns (name, subject, body_template, created_at, updated_at)
@@ -233,7 +856,7 @@ class Database:
     def update_campaign(self, campaign_id: int, name: str, subject: str, body_template: str) -> bool:
         """Atualiza uma campanha existente"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.changing('campaigns', f'campaign:{campaign_id}') as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     UPDATE campaigns 
@@ -248,8 +871,7 @@ class Database:
     
     def get_campaign(self, campaign_id: int) -> Optional[Dict]:
         """Busca uma campanha específica"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
+        with self.connection() as conn:
             cursor = conn.cursor()
             cursor.execute('SELECT * FROM campaigns WHERE id = ?', (campaign_id,))
             row = cursor.fetchone()
@@ -257,19 +879,20 @@ class Database:
     
     def get_campaigns(self) -> List[Dict]:
         """Lista todas as campanhas"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
+        with self.connection() as conn:
             cursor = conn.cursor()
             cursor.execute('SELECT * FROM campaigns ORDER BY created_at DESC')
             return [dict(row) for row in cursor.fetchall()]
     
     def delete_campaign(self, campaign_id: int) -> bool:
         """Exclui uma campanha e todos os logs relacionados"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.changing('campaigns', 'sends', f'campaign:{campaign_id}') as conn:
             cursor = conn.cursor()
             
             # Primeiro, exclui todos os logs de email relacionados à campanha
             cursor.execute('DELETE FROM email_logs WHERE campaign_id = ?', (campaign_id,))
+            cursor.execute('DELETE FROM send_jobs WHERE campaign_id = ?', (campaign_id,))
+            cursor.execute('DELETE FROM campaign_stats WHERE campaign_id = ?', (campaign_id,))
             
             # Depois, exclui a campanha
             cursor.execute('DELETE FROM campaigns WHERE id = ?', (campaign_id,))
@@ -279,7 +902,7 @@ class Database:
     
     def log_email_sent(self, campaign_id: int, contact_id: int, email: str) -> int:
         """Registra um email enviado"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.changing('sends', 'campaigns', f'campaign:{campaign_id}') as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 INSERT INTO email_logs (campaign_id, contact_id, email, status, sent_at)
@@ -288,9 +911,40 @@ class Database:
             conn.commit()
             return cursor.lastrowid
     
+    def log_emails_sent_bulk(self, campaign_id: int, contacts: List[Dict],
+                             message_id: str = None) -> int:
+        """Registra os emails de um lote enviado em uma única transação"""
+        with self.changing('sends', 'campaigns', f'campaign:{campaign_id}') as conn:
+            return self._insert_send_logs(conn, campaign_id, contacts, message_id)
+    
+    def _insert_send_logs(self, conn: sqlite3.Connection, campaign_id: int,
+                          contacts: List[Dict], message_id: str = None,
+                          message_ids: Dict[str, str] = None) -> int:
+        """Insere os logs de envio de um lote usando a conexão informada"""
+        sent_at = datetime.now()
+        message_id = normalize_message_id(message_id)
+        if message_ids:
+            # Lote dividido em várias requisições: cada parte tem seu message_id
+            message_ids = {email: normalize_message_id(value) for email, value in message_ids.items()}
+            rows = [
+                (campaign_id, contact['id'], contact['email'], 'sent', sent_at,
+                 message_ids.get(contact['email'], message_id))
+                for contact in contacts
+            ]
+        else:
+            rows = [
+                (campaign_id, contact['id'], contact['email'], 'sent', sent_at, message_id)
+                for contact in contacts
+            ]
+        conn.executemany('''
+            INSERT INTO email_logs (campaign_id, contact_id, email, status, sent_at, message_id)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', rows)
+        return len(rows)
+    
     def update_email_status(self, email: str, status: str, **kwargs):
         """Atualiza o status de um email"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.changing('events') as conn:
             cursor = conn.cursor()
             
             # Constrói a query dinamicamente baseada nos kwargs
@@ -308,73 +962,802 @@ class Database:
                 cursor.execute(query, params)
                 conn.commit()
     
-    def get_campaign_stats(self, campaign_id: int) -> Dict:
-        """Retorna estatísticas de uma campanha"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
+    def update_email_status_by_message(self, message_id: Optional[str], email: str,
+                                       status: str, timestamp: datetime = None) -> int:
+        """Atualiza o log de um único envio, identificado pelo message_id do Mailgun e pelo email"""
+        query, params = self._email_event_update(message_id, email, status, timestamp)
+        
+        with self.changing('events') as conn:
+            return conn.execute(query, params).rowcount
+    
+    def apply_email_events(self, events: List[tuple]) -> int:
+        """Aplica eventos (message_id, email, status, timestamp) em uma única transação"""
+        with self.changing('events') as conn:
+            return self._apply_email_events(conn, events)
+    
+    def apply_new_events(self, events: List[tuple], checkpoint_name: str, cursor: str) -> Dict:
+        """Aplica só eventos (event_id, message_id, email, status, timestamp) ainda não vistos e grava o cursor, na mesma transação"""
+        now = time.time()
+        with self.changing('events') as conn:
+            new_ids = set()
+            # Dois parâmetros por evento
+            for start in range(0, len(events), SQL_IN_CHUNK // 2):
+                chunk = events[start:start + SQL_IN_CHUNK // 2]
+                placeholders = ','.join('(?, ?)' for _ in chunk)
+                params = [value for event in chunk for value in (event[0], now)]
+                new_ids.update(row[0] for row in conn.execute(
+                    f'INSERT OR IGNORE INTO processed_events (event_id, seen_at) VALUES {placeholders} RETURNING event_id',
+                    params
+                ))
             
-            # Total de emails enviados
-            cursor.execute('''
-                SELECT COUNT(*) FROM email_logs WHERE campaign_id = ?
-            ''', (campaign_id,))
-            total_sent = cursor.fetchone()[0]
+            fresh = [event[1:] for event in events if event[0] in new_ids]
+            updated = self._apply_email_events(conn, fresh)
+            self.save_sync_checkpoint(checkpoint_name, cursor, conn)
+            return {'new': len(fresh), 'duplicates': len(events) - len(fresh), 'updated': updated}
+    
+    def prune_processed_events(self, max_age: float) -> int:
+        """Esquece ids de eventos antigos usados na deduplicação"""
+        with self.connection() as conn:
+            cursor = conn.execute(
+                'DELETE FROM processed_events WHERE seen_at < ?', (time.time() - max_age,)
+            )
+            return cursor.rowcount
+    
+    def _apply_email_events(self, conn: sqlite3.Connection, events: List[tuple]) -> int:
+        # Agrupa por formato do UPDATE para usar um executemany por grupo
+        groups: Dict[str, List] = {}
+        for message_id, email, status, timestamp in events:
+            query, params = self._email_event_update(message_id, email, status, timestamp)
+            groups.setdefault(query, []).append(params)
+        
+        updated = 0
+        for query, params_list in groups.items():
+            updated += conn.executemany(query, params_list).rowcount
+        return updated
+    
+    @staticmethod
+    def _email_event_update(message_id: Optional[str], email: str, status: str,
+                            timestamp: datetime = None) -> tuple:
+        """Monta o UPDATE de um evento; sem message_id, atinge apenas o envio mais recente do email"""
+        assignments = [f'status = CASE WHEN {STATUS_RANK_SQL} <= ? THEN ? ELSE status END']
+        params = [STATUS_RANK.get(status, 0), status]
+        
+        field = EVENT_TIMESTAMP_FIELDS.get(status)
+        if field:
+            # Mantém a data do primeiro evento (ex: primeira abertura)
+            assignments.append(f'{field} = COALESCE({field}, ?)')
+            params.append(timestamp or datetime.now())
+        
+        message_id = normalize_message_id(message_id)
+        if message_id:
+            where = 'message_id = ? AND email = ?'
+            params.extend([message_id, email])
+        else:
+            where = 'id = (SELECT MAX(id) FROM email_logs WHERE email = ?)'
+            params.append(email)
+        
+        return f"UPDATE email_logs SET {', '.join(assignments)} WHERE {where}", params
+    
+    def get_campaign_stats(self, campaign_id: int, reconcile: bool = False) -> Dict:
+        """Retorna estatísticas de uma campanha a partir do resumo incremental"""
+        if reconcile:
+            return self.reconcile_campaign_stats(campaign_id)
+        
+        with self.connection() as conn:
+            row = conn.execute('''
+                SELECT total_sent, total_opened, total_clicked, total_bounced
+                FROM campaign_stats WHERE campaign_id = ?
+            ''', (campaign_id,)).fetchone()
+        
+        return self._format_campaign_stats(*(row or (0, 0, 0, 0)))
+    
+    def compute_campaign_stats(self, campaign_id: int) -> Dict:
+        """Calcula as estatísticas diretamente de email_logs em uma única passada"""
+        with self.connection() as conn:
+            row = conn.execute('''
+                SELECT COUNT(*),
+                       COUNT(opened_at),
+                       COUNT(clicked_at),
+                       COUNT(bounced_at)
+                FROM email_logs WHERE campaign_id = ?
+            ''', (campaign_id,)).fetchone()
+        
+        return self._format_campaign_stats(*row)
+    
+    def reconcile_campaign_stats(self, campaign_id: int) -> Dict:
+        """Recalcula o resumo de uma campanha a partir de email_logs e o corrige"""
+        with self.changing(f'campaign:{campaign_id}') as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO campaign_stats
+                    (campaign_id, total_sent, total_opened, total_clicked, total_bounced)
+                SELECT ?, COUNT(*), COUNT(opened_at), COUNT(clicked_at), COUNT(bounced_at)
+                FROM email_logs WHERE campaign_id = ?
+            ''', (campaign_id, campaign_id))
+        
+        return self.get_campaign_stats(campaign_id)
+    
+    @staticmethod
+    def _format_campaign_stats(total_sent: int, total_opened: int,
+                               total_clicked: int, total_bounced: int) -> Dict:
+        return {
+            'total_sent': total_sent,
+            'total_opened': total_opened,
+            'total_clicked': total_clicked,
+            'total_bounced': total_bounced,
+            'open_rate': (total_opened / total_sent * 100) if total_sent > 0 else 0,
+            'click_rate': (total_clicked / total_sent * 100) if total_sent > 0 else 0,
+            'bounce_rate': (total_bounced / total_sent * 100) if total_sent > 0 else 0
+        }
+    
+    def get_daily_stats(self, start_hour: str, end_hour: str) -> Dict:
+        """Retorna as estatísticas de um dia [start_hour, end_hour) a partir dos resumos"""
+        events = self.get_event_totals(start_hour, end_hour)
+        counters = self.get_stat_counters()
+        
+        return {
+            'emails_sent_today': events['sent'],
+            'events_today': events,
+            'total_contacts': counters.get('sendable_contacts', 0),
+            'total_campaigns': counters.get('campaigns', 0)
+        }
+    
+    def get_event_totals(self, start_hour: str, end_hour: str, campaign_id: int = None) -> Dict[str, int]:
+        """Total de cada evento entre duas horas cheias em UTC ('AAAA-MM-DD HH:00', fim exclusivo)"""
+        totals = {event: 0 for event, _ in ROLLUP_EVENTS}
+        for _, event, count in self.get_hourly_stats(start_hour, end_hour, campaign_id, by_hour=False):
+            totals[event] = count
+        return totals
+    
+    def get_hourly_stats(self, start_hour: str, end_hour: str, campaign_id: int = None,
+                         by_hour: bool = True) -> List[tuple]:
+        """Linhas (hora, evento, total) de stats_hourly no intervalo, de uma campanha ou de todas"""
+        where = 'hour >= ? AND hour < ?'
+        params = [start_hour, end_hour]
+        if campaign_id is not None:
+            where += ' AND campaign_id = ?'
+            params.append(campaign_id)
+        
+        group = 'hour, event' if by_hour else 'event'
+        with self.connection() as conn:
+            cursor = conn.execute(f'''
+                SELECT {'hour' if by_hour else 'NULL'}, event, SUM(count) FROM stats_hourly
+                WHERE {where} GROUP BY {group} ORDER BY {group}
+            ''', params)
+            return [tuple(row) for row in cursor.fetchall()]
+    
+    def get_stat_counters(self) -> Dict[str, int]:
+        """Contadores do painel mantidos por triggers (contatos enviáveis, campanhas)"""
+        with self.connection() as conn:
+            return dict(conn.execute('SELECT name, value FROM stat_counters').fetchall())
+    
+    def get_cached_validations(self, emails: List[str], min_checked_at: float) -> Dict[str, Dict]:
+        """Resultados de validação ainda válidos (checados depois de min_checked_at), por email"""
+        cached = {}
+        with self.connection() as conn:
+            for start in range(0, len(emails), SQL_IN_CHUNK):
+                chunk = emails[start:start + SQL_IN_CHUNK]
+                placeholders = ','.join('?' for _ in chunk)
+                cursor = conn.execute(f'''
+                    SELECT address, status, reason FROM email_validations
+                    WHERE address IN ({placeholders}) AND checked_at >= ?
+                ''', [*chunk, min_checked_at])
+                for row in cursor:
+                    cached[row['address']] = {'status': row['status'], 'reason': row['reason']}
+        return cached
+    
+    def save_validations(self, results: Dict[str, Dict], checked_at: float):
+        """Grava resultados de validação no cache"""
+        with self.connection() as conn:
+            conn.executemany('''
+                INSERT OR REPLACE INTO email_validations (address, status, reason, checked_at)
+                VALUES (?, ?, ?, ?)
+            ''', [
+                (email, result['status'], result.get('reason'), checked_at)
+                for email, result in results.items()
+            ])
+    
+    def get_cached_domains(self, domains: List[str], min_checked_at: float) -> Dict[str, bool]:
+        """Domínios com verificação de MX ainda válida: domínio -> possui MX"""
+        cached = {}
+        with self.connection() as conn:
+            for start in range(0, len(domains), SQL_IN_CHUNK):
+                chunk = domains[start:start + SQL_IN_CHUNK]
+                placeholders = ','.join('?' for _ in chunk)
+                cursor = conn.execute(f'''
+                    SELECT domain, has_mx FROM domain_validations
+                    WHERE domain IN ({placeholders}) AND checked_at >= ?
+                ''', [*chunk, min_checked_at])
+                cached.update({row['domain']: bool(row['has_mx']) for row in cursor})
+        return cached
+    
+    def save_domain_checks(self, domains: Dict[str, bool], checked_at: float):
+        """Grava o resultado das verificações de MX"""
+        with self.connection() as conn:
+            conn.executemany('''
+                INSERT OR REPLACE INTO domain_validations (domain, has_mx, checked_at)
+                VALUES (?, ?, ?)
+            ''', [(domain, int(has_mx), checked_at) for domain, has_mx in domains.items()])
+    
+    def set_contacts_status(self, contact_ids: List[int], status: str) -> int:
+        """Atualiza o status de vários contatos"""
+        with self.changing('contacts') as conn:
+            cursor = conn.executemany(
+                'UPDATE contacts SET status = ?, updated_at = ? WHERE id = ?',
+                [(status, datetime.now(), contact_id) for contact_id in contact_ids]
+            )
+            return cursor.rowcount
+    
+    def get_sync_checkpoint(self, name: str) -> Optional[str]:
+        """Último cursor gravado de uma sincronização"""
+        with self.connection() as conn:
+            row = conn.execute('SELECT cursor FROM sync_checkpoints WHERE name = ?', (name,)).fetchone()
+            return row['cursor'] if row else None
+    
+    def save_sync_checkpoint(self, name: str, cursor: str, conn: sqlite3.Connection = None):
+        """Grava o cursor de uma sincronização (na transação informada, se houver)"""
+        if conn is None:
+            with self.connection() as conn:
+                return self.save_sync_checkpoint(name, cursor, conn)
+        conn.execute('''
+            INSERT INTO sync_checkpoints (name, cursor, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET cursor = excluded.cursor, updated_at = excluded.updated_at
+        ''', (name, cursor, time.time()))
+    
+    def apply_suppressions(self, reason: str, status: str, entries: List[tuple],
+                           checkpoint_name: str, checkpoint: str) -> int:
+        """Grava supressões (email, created_at, details), atualiza os contatos e o checkpoint em uma transação"""
+        synced_at = time.time()
+        with self.changing('contacts') as conn:
+            conn.executemany('''
+                INSERT INTO suppressions (email, reason, created_at, details, synced_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (email, reason) DO UPDATE SET
+                    created_at = excluded.created_at,
+                    details = excluded.details,
+                    synced_at = excluded.synced_at
+            ''', [(email, reason, created_at, details, synced_at) for email, created_at, details in entries])
             
-            # Emails abertos
-            cursor.execute('''
-                SELECT COUNT(*) FROM email_logs 
-                WHERE campaign_id = ? AND opened_at IS NOT NULL
-            ''', (campaign_id,))
-            total_opened = cursor.fetchone()[0]
+            # Atualização em conjunto: só os contatos das supressões desta execução
+            cursor = conn.execute('''
+                UPDATE contacts SET status = ?, updated_at = ?
+                FROM suppressions
+                WHERE suppressions.synced_at = ? AND suppressions.reason = ?
+                  AND contacts.email = suppressions.email
+                  AND contacts.status IN ('active', 'inactive')
+            ''', (status, datetime.now(), synced_at, reason))
             
-            # Emails clicados
-            cursor.execute('''
-                SELECT COUNT(*) FROM email_logs 
-                WHERE campaign_id = ? AND clicked_at IS NOT NULL
-            ''', (campaign_id,))
-            total_clicked = cursor.fetchone()[0]
+            self.save_sync_checkpoint(checkpoint_name, checkpoint, conn)
+            return cursor.rowcount
+    
+    def get_suppressed_emails(self) -> set:
+        """Todos os emails suprimidos, para o índice em memória"""
+        with self.connection() as conn:
+            return {row[0] for row in conn.execute('SELECT DISTINCT email FROM suppressions')}
+    
+    def get_suppression_counts(self) -> Dict[str, int]:
+        """Quantidade de supressões por motivo"""
+        with self.connection() as conn:
+            rows = conn.execute('SELECT reason, COUNT(*) FROM suppressions GROUP BY reason').fetchall()
+            return {row[0]: row[1] for row in rows}
+    
+    def get_contacts_by_ids(self, contact_ids: List[int]) -> List[Dict]:
+        """Busca contatos pelos IDs, preservando a ordem informada"""
+        if not contact_ids:
+            return []
+        
+        with self.connection() as conn:
+            placeholders = ','.join('?' for _ in contact_ids)
+            cursor = conn.execute(
+                f'SELECT * FROM contacts WHERE id IN ({placeholders})', contact_ids
+            )
+            by_id = {row['id']: dict(row) for row in cursor.fetchall()}
+        
+        return [by_id[contact_id] for contact_id in contact_ids if contact_id in by_id]
+    
+    def count_sendable_contacts(self) -> int:
+        """Quantidade de contatos que entrariam em uma campanha agora"""
+        with self.connection() as conn:
+            return conn.execute(f'SELECT COUNT(*) FROM contacts WHERE {SENDABLE_CONTACTS_SQL}').fetchone()[0]
+    
+    def get_contact_columns(self) -> List[str]:
+        """Colunas da tabela contacts (campos disponíveis para os templates)"""
+        if self._contact_columns is None:
+            with self.connection() as conn:
+                rows = conn.execute('PRAGMA table_info(contacts)').fetchall()
+            self._contact_columns = [row['name'] for row in rows]
+        return self._contact_columns
+    
+    def _extra_recipient_fields(self, fields: Iterable[str]) -> List[str]:
+        """Campos além de RECIPIENT_COLUMNS, limitados às colunas existentes"""
+        columns = set(self.get_contact_columns())
+        return [field for field in dict.fromkeys(fields or ())
+                if field in columns and field not in RECIPIENT_COLUMNS]
+    
+    def count_missing_fields(self, fields: Iterable[str]) -> Dict[str, int]:
+        """Quantos contatos enviáveis têm cada campo vazio (uma única varredura)"""
+        columns = set(self.get_contact_columns())
+        fields = [field for field in dict.fromkeys(fields) if field in columns]
+        if not fields:
+            return {}
+        
+        sums = ', '.join(
+            f"SUM(CASE WHEN {field} IS NULL OR TRIM({field}) = '' THEN 1 ELSE 0 END)" for field in fields
+        )
+        with self.connection() as conn:
+            row = conn.execute(f'SELECT {sums} FROM contacts WHERE {SENDABLE_CONTACTS_SQL}').fetchone()
+        return {field: row[index] or 0 for index, field in enumerate(fields)}
+    
+    def iter_recipient_batches(self, batch_size: int, limit: int = None,
+                               fields: Iterable[str] = ()) -> Iterator[List[Recipient]]:
+        """Gera lotes de destinatários enviáveis direto do SQLite, um lote por consulta (paginação por id)"""
+        extra_fields = self._extra_recipient_fields(fields)
+        columns = ', '.join(RECIPIENT_COLUMNS + tuple(extra_fields))
+        after_id = 0
+        remaining = limit
+        
+        while remaining is None or remaining > 0:
+            size = batch_size if remaining is None else min(batch_size, remaining)
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.row_factory = Recipient.row_factory(extra_fields)
+                batch = cursor.execute(f'''
+                    SELECT {columns} FROM contacts
+                    WHERE {SENDABLE_CONTACTS_SQL} AND id > ?
+                    ORDER BY id LIMIT ?
+                ''', (after_id, size)).fetchall()
             
-            # Bounces
-            cursor.execute('''
-                SELECT COUNT(*) FROM email_logs 
-                WHERE campaign_id = ? AND bounced_at IS NOT NULL
-            ''', (campaign_id,))
-            total_bounced = cursor.fetchone()[0]
+            if not batch:
+                return
+            yield batch
             
-            return {
-                'total_sent': total_sent,
-                'total_opened': total_opened,
-                'total_clicked': total_clicked,
-                'total_bounced': total_bounced,
-                'open_rate': (total_opened / total_sent * 100) if total_sent > 0 else 0,
-                'click_rate': (total_clicked / total_sent * 100) if total_sent > 0 else 0,
-                'bounce_rate': (total_bounced / total_sent * 100) if total_sent > 0 else 0
-            }
-    
-    def get_daily_stats(self) -> Dict:
-        """Retorna estatísticas do dia atual"""
-        with sqlite3.connect(self.db_path) as conn:
+            if len(batch) < size:
+                return
+            after_id = batch[-1].id
+            if remaining is not None:
+                remaining -= len(batch)
+    
+    def get_recipients_by_ids(self, contact_ids: List[int], fields: Iterable[str] = ()) -> List[Recipient]:
+        """Destinatários compactos pelos IDs, preservando a ordem informada"""
+        extra_fields = self._extra_recipient_fields(fields)
+        columns = ', '.join(RECIPIENT_COLUMNS + tuple(extra_fields))
+        by_id = {}
+        with self.connection() as conn:
             cursor = conn.cursor()
+            cursor.row_factory = Recipient.row_factory(extra_fields)
+            for start in range(0, len(contact_ids), SQL_IN_CHUNK):
+                chunk = contact_ids[start:start + SQL_IN_CHUNK]
+                placeholders = ','.join('?' for _ in chunk)
+                cursor.execute(
+                    f"SELECT {columns} FROM contacts WHERE id IN ({placeholders})",
+                    chunk
+                )
+                by_id.update((recipient.id, recipient) for recipient in cursor.fetchall())
+        
+        return [by_id[contact_id] for contact_id in contact_ids if contact_id in by_id]
+    
+    def enqueue_send_jobs(self, campaign_id: int, batches: Iterable[List[Dict]],
+                          payload: Dict, start_at: float, batch_delay: float) -> List[int]:
+        """Grava os lotes de uma campanha como jobs pendentes e retorna seus IDs"""
+        payload_json = json.dumps(payload)
+        # Gerador: cada lote é lido, gravado e descartado antes do próximo
+        rows = (
+            (
+                campaign_id,
+                index + 1,
+                json.dumps([contact['id'] for contact in contacts]),
+                payload_json,
+                len(contacts),
+                start_at + index * batch_delay
+            )
+            for index, contacts in enumerate(batches)
+        )
+        
+        with self.changing('campaigns') as conn:
+            inserted = conn.executemany('''
+                INSERT INTO send_jobs (campaign_id, batch_number, contact_ids, payload,
+                                       recipients_count, not_before)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', rows).rowcount
+            # A transação mantém o lock de escrita, então os IDs são os últimos inseridos
+            job_ids = [row[0] for row in conn.execute('''
+                SELECT id FROM send_jobs WHERE campaign_id = ? ORDER BY id DESC LIMIT ?
+            ''', (campaign_id, inserted)).fetchall()]
+            if inserted:
+                conn.execute('''
+                    UPDATE campaigns SET status = 'queued', updated_at = ? WHERE id = ?
+                ''', (datetime.now(), campaign_id))
+        
+        return sorted(job_ids)
+    
+    def claim_send_job(self, worker: str, now: float) -> Optional[Dict]:
+        """Reserva atomicamente o próximo job pronto para envio"""
+        with self.connection() as conn:
+            row = conn.execute('''
+                UPDATE send_jobs
+                SET status = 'in_flight', worker = ?, claimed_at = ?,
+                    attempts = attempts + 1, updated_at = ?
+                WHERE id = (
+                    SELECT id FROM send_jobs
+                    WHERE status = 'pending' AND not_before <= ?
+                    ORDER BY not_before, id
+                    LIMIT 1
+                )
+                RETURNING *
+            ''', (worker, now, datetime.now(), now)).fetchone()
             
-            # Emails enviados hoje - usando fuso horário local (UTC-3)
-            cursor.execute('''
-                SELECT COUNT(*) FROM email_logs 
-                WHERE strftime('%Y-%m-%d', sent_at) = strftime('%Y-%m-%d', 'now', '-3 hours')
-            ''')
-            emails_sent_today = cursor.fetchone()[0]
+            if row:
+                conn.execute('''
+                    UPDATE campaigns SET status = 'sending', updated_at = ?
+                    WHERE id = ? AND status != 'sending'
+                ''', (datetime.now(), row['campaign_id']))
+                # Só invalida caches quando um job foi de fato reservado (a fila é consultada em loop)
+                self.versions.bump(conn, 'campaigns')
+        
+        return dict(row) if row else None
+    
+    def next_send_job_time(self) -> Optional[float]:
+        """Horário (epoch) do próximo job pendente"""
+        with self.connection() as conn:
+            row = conn.execute(
+                "SELECT MIN(not_before) FROM send_jobs WHERE status = 'pending'"
+            ).fetchone()
+            return row[0]
+    
+    def complete_send_job(self, job_id: int, worker: str, claimed_at: float, campaign_id: int,
+                          contacts: List[Dict], message_id: str = None,
+                          message_ids: Dict[str, str] = None) -> Optional[int]:
+        """Marca o job como enviado e registra os logs na mesma transação.
+        
+        Só vale para quem ainda detém a reserva (worker, claimed_at); se ela foi perdida,
+        retorna None e nada é gravado.
+        """
+        with self.changing('sends', 'campaigns', f'campaign:{campaign_id}') as conn:
+            if not conn.execute(f'''
+                UPDATE send_jobs
+                SET status = 'done', message_id = ?, error = NULL, updated_at = ?
+                WHERE {CLAIM_HELD_SQL}
+            ''', (message_id, datetime.now(), job_id, worker, claimed_at)).rowcount:
+                return None
+            logged = self._insert_send_logs(conn, campaign_id, contacts, message_id, message_ids)
+            self._refresh_campaign_status(conn, campaign_id)
+            return logged
+    
+    def fail_send_job(self, job_id: int, worker: str, claimed_at: float, campaign_id: int, error: str,
+                      sent_contacts: List[Dict] = None, message_ids: Dict[str, str] = None,
+                      dead_letters: List[Dict] = None, error_class: str = 'unknown',
+                      attempts: int = 0) -> bool:
+        """Marca o job como falho (registrando os contatos de partes que chegaram a sair);
+        False se a reserva foi perdida"""
+        with self.changing('sends', 'campaigns', f'campaign:{campaign_id}') as conn:
+            if not conn.execute(f'''
+                UPDATE send_jobs SET status = 'failed', error = ?, updated_at = ?
+                WHERE {CLAIM_HELD_SQL}
+            ''', (error, datetime.now(), job_id, worker, claimed_at)).rowcount:
+                return False
+            if sent_contacts:
+                self._insert_send_logs(conn, campaign_id, sent_contacts, message_ids=message_ids)
+            if dead_letters:
+                # Quem não recebeu fica guardado para ser reenfileirado depois
+                now = time.time()
+                conn.executemany('''
+                    INSERT INTO dead_letters
+                        (campaign_id, contact_id, email, job_id, error_class, error, attempts, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', [
+                    (campaign_id, contact['id'], contact['email'], job_id, error_class, error, attempts, now)
+                    for contact in dead_letters
+                ])
+            self._refresh_campaign_status(conn, campaign_id)
+            return True
+    
+    def retry_send_job(self, job_id: int, worker: str, claimed_at: float, campaign_id: int,
+                       not_before: float, error: str, remaining_ids: List[int],
+                       sent_contacts: List[Dict] = None, message_ids: Dict[str, str] = None) -> bool:
+        """Agenda nova tentativa só para os contatos que ainda não receberam;
+        False se a reserva foi perdida"""
+        with self.changing('sends', 'campaigns', f'campaign:{campaign_id}') as conn:
+            if not conn.execute(f'''
+                UPDATE send_jobs
+                SET status = 'pending', worker = NULL, claimed_at = NULL, not_before = ?,
+                    contact_ids = ?, recipients_count = ?, error = ?, updated_at = ?
+                WHERE {CLAIM_HELD_SQL}
+            ''', (not_before, json.dumps(remaining_ids), len(remaining_ids), error, datetime.now(),
+                  job_id, worker, claimed_at)).rowcount:
+                return False
+            if sent_contacts:
+                self._insert_send_logs(conn, campaign_id, sent_contacts, message_ids=message_ids)
+            self._refresh_campaign_status(conn, campaign_id)
+            return True
+    
+    def get_dead_letters(self, campaign_id: int, limit: int = 100) -> List[Dict]:
+        """Destinatários com falha definitiva ainda não reenfileirados"""
+        with self.connection() as conn:
+            rows = conn.execute('''
+                SELECT id, contact_id, email, job_id, error_class, error, attempts, created_at
+                FROM dead_letters
+                WHERE campaign_id = ? AND requeued_at IS NULL
+                ORDER BY id LIMIT ?
+            ''', (campaign_id, limit)).fetchall()
+            return [dict(row) for row in rows]
+    
+    def get_dead_letter_counts(self, campaign_id: int) -> Dict[str, int]:
+        """Falhas pendentes por classe de erro"""
+        with self.connection() as conn:
+            rows = conn.execute('''
+                SELECT error_class, COUNT(*) FROM dead_letters
+                WHERE campaign_id = ? AND requeued_at IS NULL
+                GROUP BY error_class
+            ''', (campaign_id,)).fetchall()
+            return {error_class: count for error_class, count in rows}
+    
+    def take_dead_letters(self, campaign_id: int, dead_letter_ids: List[int] = None) -> List[int]:
+        """Marca as falhas como reenfileiradas e retorna os IDs dos contatos (sem repetição)"""
+        query = '''
+            UPDATE dead_letters SET requeued_at = ?
+            WHERE campaign_id = ? AND requeued_at IS NULL
+        '''
+        params = [time.time(), campaign_id]
+        if dead_letter_ids:
+            query += f" AND id IN ({','.join('?' for _ in dead_letter_ids)})"
+            params.extend(dead_letter_ids)
+        
+        with self.connection() as conn:
+            rows = conn.execute(query + ' RETURNING contact_id', params).fetchall()
+        return sorted({row['contact_id'] for row in rows})
+    
+    def renew_send_job(self, job_id: int, worker: str, claimed_at: float, now: float,
+                       quota_reservation_id: int = None) -> bool:
+        """Renova a reserva de um job ainda não enviado e, junto, a da cota do lote;
+        False se ela já foi perdida"""
+        with self.connection() as conn:
+            renewed = conn.execute(f'''
+                UPDATE send_jobs SET claimed_at = ? WHERE {CLAIM_HELD_SQL}
+            ''', (now, job_id, worker, claimed_at)).rowcount > 0
+            if renewed and quota_reservation_id is not None:
+                # A reserva da cota vive enquanto o job estiver reservado
+                conn.execute(
+                    'UPDATE send_quota_reservations SET created_at = ? WHERE id = ?',
+                    (now, quota_reservation_id)
+                )
+            return renewed
+    
+    def release_send_job(self, job_id: int, worker: str, claimed_at: float, not_before: float = None):
+        """Devolve à fila um job reservado que não chegou a ser enviado (opcionalmente adiado)"""
+        with self.connection() as conn:
+            conn.execute(f'''
+                UPDATE send_jobs
+                SET status = 'pending', worker = NULL, claimed_at = NULL,
+                    attempts = attempts - 1, not_before = COALESCE(?, not_before), updated_at = ?
+                WHERE {CLAIM_HELD_SQL}
+            ''', (not_before, datetime.now(), job_id, worker, claimed_at))
+    
+    def reserve_send_quota(self, day: str, amount: int, limit: int, holder: str,
+                           now: float) -> Optional[int]:
+        """Reserva atomicamente envios na cota do dia; retorna o id da reserva ou None se não couber"""
+        with self.changing('quota') as conn:
+            conn.execute('INSERT OR IGNORE INTO send_quota (day) VALUES (?)', (day,))
+            row = conn.execute('''
+                UPDATE send_quota SET reserved = reserved + ?
+                WHERE day = ? AND sent + reserved + ? <= ?
+                RETURNING day
+            ''', (amount, day, amount, limit)).fetchone()
+            if row is None:
+                return None
             
-            # Total de contatos
-            cursor.execute('SELECT COUNT(*) FROM contacts WHERE status = "active"')
-            total_contacts = cursor.fetchone()[0]
+            cursor = conn.execute('''
+                INSERT INTO send_quota_reservations (day, amount, holder, created_at)
+                VALUES (?, ?, ?, ?)
+            ''', (day, amount, holder, now))
+            return cursor.lastrowid
+    
+    def settle_send_quota(self, reservation_id: int, day: str, used: int):
+        """Confirma os envios usados de uma reserva e devolve o restante à cota"""
+        with self.changing('quota') as conn:
+            row = conn.execute(
+                'DELETE FROM send_quota_reservations WHERE id = ? RETURNING amount',
+                (reservation_id,)
+            ).fetchone()
+            # Se a reserva já expirou, o valor reservado já foi devolvido
+            reserved = row['amount'] if row else 0
+            conn.execute('''
+                UPDATE send_quota SET sent = sent + ?, reserved = MAX(reserved - ?, 0)
+                WHERE day = ?
+            ''', (used, reserved, day))
+    
+    def expire_send_quota_reservations(self, max_age: float, now: float) -> int:
+        """Devolve à cota reservas antigas (ex: processo encerrado durante o envio)"""
+        with self.connection() as conn:
+            rows = conn.execute('''
+                DELETE FROM send_quota_reservations WHERE created_at < ?
+                RETURNING day, amount
+            ''', (now - max_age,)).fetchall()
             
-            # Total de campanhas
-            cursor.execute('SELECT COUNT(*) FROM campaigns')
-            total_campaigns = cursor.fetchone()[0]
+            released = {}
+            for row in rows:
+                released[row['day']] = released.get(row['day'], 0) + row['amount']
+            conn.executemany(
+                'UPDATE send_quota SET reserved = MAX(reserved - ?, 0) WHERE day = ?',
+                [(amount, day) for day, amount in released.items()]
+            )
+            if rows:
+                self.versions.bump(conn, 'quota')
+        
+        return len(rows)
+    
+    def get_send_quota(self, day: str) -> Dict:
+        """Envios confirmados e reservados no dia (uma leitura pela chave primária)"""
+        with self.connection() as conn:
+            row = conn.execute(
+                'SELECT sent, reserved FROM send_quota WHERE day = ?', (day,)
+            ).fetchone()
+            return dict(row) if row else {'sent': 0, 'reserved': 0}
+    
+    def take_rate_tokens(self, name: str, amount: float, rate: float, capacity: float,
+                         now: float) -> float:
+        """Reabastece e consome tokens de um limite de taxa compartilhado; retorna o saldo"""
+        with self.connection() as conn:
+            conn.execute(
+                'INSERT OR IGNORE INTO rate_buckets (name, tokens, updated) VALUES (?, ?, ?)',
+                (name, capacity, now)
+            )
+            row = conn.execute('''
+                UPDATE rate_buckets
+                SET tokens = MIN(?, tokens + MAX(? - updated, 0) * ?) - ?,
+                    updated = MAX(updated, ?)
+                WHERE name = ?
+                RETURNING tokens
+            ''', (capacity, now, rate, amount, now, name)).fetchone()
+            return row['tokens']
+    
+    def acquire_circuit(self, name: str, now: float, probe_timeout: float) -> float:
+        """0 se o envio pode seguir; senão, segundos até o circuito aceitar uma tentativa"""
+        with self.connection() as conn:
+            # Passado o tempo aberto, só um worker (de qualquer processo) faz a tentativa de teste
+            probe = conn.execute('''
+                UPDATE circuit_breakers SET state = 'half_open', open_until = ?, updated = ?
+                WHERE name = ? AND state != 'closed' AND open_until <= ?
+                RETURNING name
+            ''', (now + probe_timeout, now, name, now)).fetchone()
+            if probe:
+                return 0.0
             
-            return {
-                'emails_sent_today': emails_sent_today,
-                'total_contacts': total_contacts,
-                'total_campaigns': total_campaigns,
-                'daily_limit': 10000  # Limite padrão
-            }
-
-
+            row = conn.execute(
+                'SELECT state, open_until FROM circuit_breakers WHERE name = ?', (name,)
+            ).fetchone()
+            if row is None or row['state'] == 'closed':
+                return 0.0
+            return max(row['open_until'] - now, 0.01)
+    
+    def record_circuit_result(self, name: str, success: bool, threshold: int,
+                              cooldown: float, now: float) -> str:
+        """Registra o resultado de um envio e retorna o estado do circuito"""
+        with self.connection() as conn:
+            if success:
+                conn.execute('''
+                    UPDATE circuit_breakers SET state = 'closed', failures = 0, updated = ?
+                    WHERE name = ? AND (state != 'closed' OR failures > 0)
+                ''', (now, name))
+                return 'closed'
+            
+            # Falhas seguidas abrem o circuito; falha na tentativa de teste reabre
+            opens = threshold <= 1
+            row = conn.execute('''
+                INSERT INTO circuit_breakers (name, state, failures, open_until, updated)
+                VALUES (:name, :state, 1, :open_until, :now)
+                ON CONFLICT (name) DO UPDATE SET
+                    failures = failures + 1,
+                    state = CASE WHEN state = 'half_open' OR failures + 1 >= :threshold
+                                 THEN 'open' ELSE state END,
+                    open_until = CASE WHEN state = 'half_open'
+                                        OR (state = 'closed' AND failures + 1 >= :threshold)
+                                      THEN :now + :cooldown ELSE open_until END,
+                    updated = :now
+                RETURNING state
+            ''', {
+                'name': name, 'state': 'open' if opens else 'closed',
+                'open_until': now + cooldown if opens else 0, 'now': now,
+                'threshold': threshold, 'cooldown': cooldown
+            }).fetchone()
+            return row['state']
+    
+    def get_circuit_breaker(self, name: str) -> Optional[Dict]:
+        """Estado gravado de um circuit breaker"""
+        with self.connection() as conn:
+            row = conn.execute(
+                'SELECT state, failures, open_until, updated FROM circuit_breakers WHERE name = ?', (name,)
+            ).fetchone()
+            return dict(row) if row else None
+    
+    def get_rate_bucket(self, name: str) -> Optional[Dict]:
+        """Saldo gravado de um limite de taxa compartilhado"""
+        with self.connection() as conn:
+            row = conn.execute(
+                'SELECT tokens, updated FROM rate_buckets WHERE name = ?', (name,)
+            ).fetchone()
+            return dict(row) if row else None
+    
+    def requeue_stale_send_jobs(self, lease_seconds: float, now: float, live_worker: str = None) -> int:
+        """Devolve à fila jobs cuja reserva expirou (ex: processo reiniciado durante o envio),
+        exceto os de live_worker (o processo que chama, cujas threads ainda estão com eles)"""
+        with self.connection() as conn:
+            cursor = conn.execute('''
+                UPDATE send_jobs
+                SET status = 'pending', worker = NULL, claimed_at = NULL, updated_at = ?
+                WHERE status = 'in_flight' AND claimed_at < ? AND worker IS NOT ?
+            ''', (datetime.now(), now - lease_seconds, live_worker))
+            return cursor.rowcount
+    
+    def requeue_send_jobs(self, job_ids: List[int]) -> int:
+        """Devolve à fila os jobs reservados informados"""
+        if not job_ids:
+            return 0
+        
+        with self.connection() as conn:
+            cursor = conn.execute(f'''
+                UPDATE send_jobs
+                SET status = 'pending', worker = NULL, claimed_at = NULL, updated_at = ?
+                WHERE status = 'in_flight' AND id IN ({','.join('?' for _ in job_ids)})
+            ''', [datetime.now(), *job_ids])
+            return cursor.rowcount
+    
+    def _refresh_campaign_status(self, conn: sqlite3.Connection, campaign_id: int):
+        """Atualiza o status da campanha conforme o andamento dos jobs"""
+        conn.execute('''
+            UPDATE campaigns
+            SET status = CASE
+                    WHEN EXISTS (SELECT 1 FROM send_jobs
+                                 WHERE campaign_id = :id AND status IN ('pending', 'in_flight'))
+                        THEN 'sending'
+                    WHEN EXISTS (SELECT 1 FROM send_jobs
+                                 WHERE campaign_id = :id AND status = 'failed')
+                        THEN 'partial'
+                    ELSE 'sent'
+                END,
+                updated_at = :now
+            WHERE id = :id
+        ''', {'id': campaign_id, 'now': datetime.now()})
+    
+    def get_send_jobs(self, campaign_id: int = None, statuses: List[str] = None,
+                      limit: int = None, job_ids: List[int] = None) -> List[Dict]:
+        """Lista jobs de envio, opcionalmente filtrados por campanha, status ou IDs"""
+        query = '''
+            SELECT id, campaign_id, batch_number, recipients_count, status, not_before,
+                   attempts, worker, claimed_at, message_id, error
+            FROM send_jobs WHERE 1 = 1
+        '''
+        params = []
+        
+        if campaign_id is not None:
+            query += ' AND campaign_id = ?'
+            params.append(campaign_id)
+        
+        if statuses:
+            query += f" AND status IN ({','.join('?' for _ in statuses)})"
+            params.extend(statuses)
+        
+        if job_ids:
+            query += f" AND id IN ({','.join('?' for _ in job_ids)})"
+            params.extend(job_ids)
+        
+        query += ' ORDER BY not_before, id'
+        if limit:
+            query += ' LIMIT ?'
+            params.append(limit)
+        
+        with self.connection() as conn:
+            return [dict(row) for row in conn.execute(query, params).fetchall()]
+    
+    def get_send_job_counts(self, campaign_id: int = None) -> Dict:
+        """Quantidade de jobs por status"""
+        query = 'SELECT status, COUNT(*) FROM send_jobs'
+        params = []
+        if campaign_id is not None:
+            query += ' WHERE campaign_id = ?'
+            params.append(campaign_id)
+        query += ' GROUP BY status'
+        
+        counts = {'pending': 0, 'in_flight': 0, 'done': 0, 'failed': 0}
+        with self.connection() as conn:
+            for status, count in conn.execute(query, params).fetchall():
+                counts[status] = count
+        return counts
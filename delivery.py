@@ -0,0 +1,96 @@
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Optional
+
+from config import Config
+from database import Database
+
+# Classes de falha de um POST /messages
+RATE_LIMITED = 'rate_limited'
+SERVER_ERROR = 'server_error'
+NETWORK_ERROR = 'network_error'
+PAYLOAD_TOO_LARGE = 'payload_too_large'
+AUTH_ERROR = 'auth_error'
+REJECTED = 'rejected'
+INTERNAL_ERROR = 'internal_error'
+
+# Falhas temporárias: o lote volta para a fila com backoff
+RETRYABLE_ERRORS = (RATE_LIMITED, SERVER_ERROR, NETWORK_ERROR)
+
+# Falhas que indicam problema no domínio ou no serviço (contam para o circuit breaker)
+CIRCUIT_ERRORS = (RATE_LIMITED, SERVER_ERROR, NETWORK_ERROR, AUTH_ERROR)
+
+
+def classify_failure(status_code: Optional[int]) -> str:
+    """Classe de falha a partir do status HTTP (None: a requisição não chegou a ter resposta)"""
+    if status_code is None or status_code == 408:
+        return NETWORK_ERROR
+    if status_code == 429:
+        return RATE_LIMITED
+    if status_code >= 500:
+        return SERVER_ERROR
+    if status_code == 413:
+        return PAYLOAD_TOO_LARGE
+    if status_code in (401, 403):
+        return AUTH_ERROR
+    return REJECTED
+
+
+def classify_result(result: Dict) -> str:
+    """Classe de falha de um resultado de lote"""
+    return result.get('error_class') or classify_failure(result.get('status_code'))
+
+
+def parse_retry_after(value: Optional[str], now: float = None) -> Optional[float]:
+    """Segundos pedidos pelo cabeçalho Retry-After (em segundos ou data HTTP)"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - (now or time.time()), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, base: float, cap: float, retry_after: float = None,
+                  rand: Callable[[], float] = random.random) -> float:
+    """Backoff exponencial com jitter completo; nunca antes do Retry-After do servidor"""
+    delay = rand() * min(cap, base * 2 ** max(attempt - 1, 0))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+class CircuitBreaker:
+    """Circuit breaker por domínio de envio, com estado compartilhado entre processos via SQLite"""
+
+    def __init__(self, db: Database, name: str, failure_threshold: int = None,
+                 cooldown_seconds: float = None):
+        self.db = db
+        self.name = name
+        self.failure_threshold = failure_threshold or Config.CIRCUIT_FAILURE_THRESHOLD
+        self.cooldown = cooldown_seconds or Config.CIRCUIT_COOLDOWN_SECONDS
+
+    def acquire(self) -> float:
+        """0 se pode enviar; senão, segundos até a próxima tentativa de teste"""
+        return self.db.acquire_circuit(self.name, time.time(), self.cooldown)
+
+    def record(self, success: bool) -> str:
+        """Registra o resultado de um envio e retorna o estado do circuito"""
+        return self.db.record_circuit_result(
+            self.name, success, self.failure_threshold, self.cooldown, time.time()
+        )
+
+    def state(self) -> Dict:
+        """Estado atual: closed, open ou half_open"""
+        row = self.db.get_circuit_breaker(self.name)
+        if row is None:
+            return {'name': self.name, 'state': 'closed', 'failures': 0}
+        state = {'name': self.name, 'state': row['state'], 'failures': row['failures']}
+        if row['state'] != 'closed':
+            state['retry_in'] = max(row['open_until'] - time.time(), 0.0)
+        return state
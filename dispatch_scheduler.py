@@ -0,0 +1,447 @@
+import json
+import os
+import socket
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import requests
+
+from config import Config
+from database import Database
+from delivery import (
+    CIRCUIT_ERRORS, INTERNAL_ERROR, NETWORK_ERROR, RETRYABLE_ERRORS, CircuitBreaker,
+    backoff_delay, classify_result, parse_retry_after
+)
+from metrics import DISPATCH_BATCHES, ERRORS
+from progress_stream import ProgressBroker
+from quota import DailyQuota, QuotaReservation, SharedTokenBucket
+
+
+class BatchJob:
+    """Um lote de uma campanha reservado da fila persistente"""
+
+    __slots__ = ('job_id', 'campaign_id', 'batch_number', 'contacts', 'payload', 'attempts',
+                 'worker', 'claimed_at')
+
+    def __init__(self, job_id: int, campaign_id: int, batch_number: int,
+                 contacts: List[Dict], payload: Dict, attempts: int = 1,
+                 worker: str = None, claimed_at: float = None):
+        self.job_id = job_id
+        self.campaign_id = campaign_id
+        self.batch_number = batch_number
+        self.contacts = contacts
+        self.payload = payload
+        self.attempts = attempts
+        # Identificam a reserva: gravações do resultado só valem enquanto ela não for perdida
+        self.worker = worker
+        self.claimed_at = claimed_at
+
+    @classmethod
+    def from_row(cls, row: Dict, db: Database) -> 'BatchJob':
+        """Reconstrói o job a partir da linha de send_jobs"""
+        payload = json.loads(row['payload'])
+        # Só as colunas que o template da campanha usa
+        fields = [field for field, _ in (payload.get('variables') or {}).values()]
+        return cls(
+            job_id=row['id'],
+            campaign_id=row['campaign_id'],
+            batch_number=row['batch_number'],
+            contacts=db.get_recipients_by_ids(json.loads(row['contact_ids']), fields),
+            payload=payload,
+            attempts=row['attempts'],
+            worker=row['worker'],
+            claimed_at=row['claimed_at']
+        )
+
+
+def job_result(row: Dict) -> Dict:
+    """Converte uma linha de send_jobs no formato de resultado de lote"""
+    result = {
+        'batch_number': row['batch_number'],
+        'recipients_count': row['recipients_count'],
+        'success': row['status'] == 'done',
+        'status': row['status']
+    }
+    if row['message_id']:
+        result['message_id'] = row['message_id']
+    if row['error']:
+        result['error'] = row['error']
+    return result
+
+
+class CampaignDispatch:
+    """Acompanha os jobs de uma campanha submetida ao agendador"""
+
+    def __init__(self, db: Database, campaign_id: int, job_ids: List[int],
+                 poll_interval: float = 1.0):
+        self.db = db
+        self.campaign_id = campaign_id
+        self.job_ids = job_ids
+        self.total_batches = len(job_ids)
+        self.poll_interval = poll_interval
+        self.changed = threading.Event()
+
+    def pending_count(self) -> int:
+        """Jobs desta submissão ainda não finalizados"""
+        if not self.job_ids:
+            return 0
+        rows = self.db.get_send_jobs(job_ids=self.job_ids, statuses=['pending', 'in_flight'])
+        return len(rows)
+
+    @property
+    def done(self) -> bool:
+        return self.pending_count() == 0
+
+    def wait(self, timeout: float = None) -> bool:
+        """Aguarda todos os jobs (inclusive os enviados por outros processos)"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.pending_count():
+            remaining = self.poll_interval
+            if deadline is not None:
+                remaining = min(remaining, deadline - time.monotonic())
+                if remaining <= 0:
+                    return False
+            self.changed.wait(remaining)
+            self.changed.clear()
+        return True
+
+    def ordered_results(self) -> List[Dict]:
+        """Resultados dos lotes na ordem de envio"""
+        if not self.job_ids:
+            return []
+        rows = self.db.get_send_jobs(job_ids=self.job_ids)
+        return [job_result(row) for row in sorted(rows, key=lambda row: row['batch_number'])]
+
+
+class DispatchScheduler:
+    """Despacha lotes da fila persistente sob um limite de taxa comum"""
+
+    def __init__(self, db: Database, send_func: Callable[[BatchJob], Dict],
+                 on_result: Callable[[BatchJob, Dict], None] = None,
+                 workers: int = None, rate_per_minute: float = None,
+                 burst: float = None, batch_delay: float = None,
+                 lease_seconds: float = None, poll_interval: float = None,
+                 quota: DailyQuota = None, breaker: CircuitBreaker = None,
+                 max_attempts: int = None, retry_base: float = None, retry_cap: float = None,
+                 progress: ProgressBroker = None):
+        self.db = db
+        self.send_func = send_func
+        self.on_result = on_result
+        self.workers = workers or Config.DISPATCH_WORKERS
+        self.batch_delay = Config.DELAY_BETWEEN_BATCHES if batch_delay is None else batch_delay
+        self.lease_seconds = lease_seconds or Config.SEND_JOB_LEASE_SECONDS
+        self.poll_interval = poll_interval or Config.DISPATCH_POLL_INTERVAL
+        self.quota = quota
+        # Falhas temporárias voltam para a fila com backoff, sem prender um worker
+        self.max_attempts = max_attempts or Config.SEND_MAX_ATTEMPTS
+        self.retry_base = Config.RETRY_BASE_SECONDS if retry_base is None else retry_base
+        self.retry_cap = retry_cap or Config.RETRY_MAX_SECONDS
+        self.breaker = breaker or CircuitBreaker(db, f'mailgun:{Config.MAILGUN_DOMAIN}')
+        # Andamento publicado em memória para quem acompanha a campanha
+        self.progress = progress
+        # O saldo fica no banco: todos os processos dividem o mesmo limite de taxa
+        self.bucket = SharedTokenBucket(
+            db, 'dispatch',
+            (rate_per_minute or Config.SEND_RATE_PER_MINUTE) / 60.0,
+            burst or Config.SEND_BURST
+        )
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        self._in_flight: Dict[int, Dict] = {}
+        self._dispatches: Dict[int, CampaignDispatch] = {}
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._stopping = threading.Event()
+        self._last_requeue = 0.0
+
+    def start(self):
+        """Inicia as threads de envio (idempotente)"""
+        with self._cond:
+            if self._threads:
+                return
+            self._stopping.clear()
+            for index in range(self.workers):
+                thread = threading.Thread(
+                    target=self._worker, name=f'dispatch-{index}', daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout: float = None):
+        """Interrompe as threads; jobs pendentes permanecem na fila"""
+        self._stopping.set()
+        with self._cond:
+            self._cond.notify_all()
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            thread.join(timeout)
+
+    def _orphaned_job_ids(self) -> List[int]:
+        """Jobs reservados por processos desta máquina que não existem mais"""
+        hostname = socket.gethostname()
+        orphaned = []
+        for job in self.db.get_send_jobs(statuses=['in_flight']):
+            host, _, pid = (job['worker'] or '').rpartition(':')
+            if host != hostname or not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                orphaned.append(job['id'])
+            except PermissionError:
+                pass
+        return orphaned
+
+    def recover(self) -> int:
+        """Retoma a fila após um reinício: devolve reservas órfãs ou expiradas e volta a enviar"""
+        requeued = self.db.requeue_send_jobs(self._orphaned_job_ids())
+        requeued += self.db.requeue_stale_send_jobs(self.lease_seconds, time.time(), self.worker_id)
+        if self.quota:
+            self.quota.expire_stale(self.lease_seconds)
+        if requeued:
+            print(f"Fila de envio: {requeued} lotes interrompidos voltaram para a fila")
+
+        if self.db.get_send_job_counts()['pending']:
+            self.start()
+        return requeued
+
+    def submit(self, campaign_id: int, batches: Iterable[List[Dict]], payload: Dict) -> CampaignDispatch:
+        """Grava os lotes da campanha (lista ou gerador) como jobs espaçados no tempo"""
+        job_ids = self.db.enqueue_send_jobs(
+            campaign_id, batches, payload, time.time(), self.batch_delay
+        )
+        dispatch = CampaignDispatch(self.db, campaign_id, job_ids)
+        if self.progress and job_ids:
+            self.progress.batches_queued(campaign_id, len(job_ids))
+
+        with self._cond:
+            self._dispatches[campaign_id] = dispatch
+            self._cond.notify_all()
+
+        self.start()
+        return dispatch
+
+    def snapshot(self, limit: int = 100) -> Dict:
+        """Lotes na fila e em andamento (de todos os processos)"""
+        counts = self.db.get_send_job_counts()
+        queued = self.db.get_send_jobs(statuses=['pending'], limit=limit)
+        in_flight = self.db.get_send_jobs(statuses=['in_flight'], limit=limit)
+
+        for job in queued + in_flight:
+            job['scheduled_for'] = datetime.fromtimestamp(job.pop('not_before')).isoformat(timespec='seconds')
+            claimed_at = job.pop('claimed_at')
+            if claimed_at:
+                job['claimed_at'] = datetime.fromtimestamp(claimed_at).isoformat(timespec='seconds')
+            local = self._in_flight.get(job['id'])
+            if local:
+                job['state'] = local['state']
+
+        return {
+            'queued': queued,
+            'in_flight': in_flight,
+            'queued_count': counts['pending'],
+            'in_flight_count': counts['in_flight'],
+            'done_count': counts['done'],
+            'failed_count': counts['failed'],
+            'available_tokens': self.bucket.available(),
+            'circuit': self.breaker.state()
+        }
+
+    def _next_job(self) -> Optional[BatchJob]:
+        """Bloqueia até conseguir reservar um job pronto; o lock é liberado durante a espera"""
+        while not self._stopping.is_set():
+            now = time.time()
+            row = self.db.claim_send_job(self.worker_id, now)
+            if row:
+                with self._cond:
+                    self._in_flight[row['id']] = {'state': 'throttled'}
+                return BatchJob.from_row(row, self.db)
+
+            # Nada pronto: recupera reservas expiradas de processos que morreram
+            # (as deste processo estão com threads vivas, que renovam a reserva)
+            if now - self._last_requeue >= self.lease_seconds / 2:
+                self._last_requeue = now
+                self.db.requeue_stale_send_jobs(self.lease_seconds, now, self.worker_id)
+                if self.quota:
+                    self.quota.expire_stale(self.lease_seconds)
+
+            # e espera o próximo horário agendado ou um novo submit
+            next_time = self.db.next_send_job_time()
+            timeout = self.poll_interval
+            if next_time is not None:
+                timeout = min(timeout, max(next_time - now, 0.01))
+            with self._cond:
+                self._cond.wait(timeout)
+        return None
+
+    def _finish(self, job: BatchJob, result: Dict):
+        """Persiste o resultado do lote e notifica quem aguarda a campanha"""
+        message_ids = result.get('message_ids')
+        if result['success']:
+            held = self.db.complete_send_job(
+                job.job_id, job.worker, job.claimed_at, job.campaign_id, job.contacts,
+                result.get('message_id'), message_ids
+            ) is not None
+            if held and job.contacts:
+                self.breaker.record(True)
+            retry_in = None
+        else:
+            held, retry_in = self._handle_failure(job, result, message_ids)
+
+        if not held:
+            # A reserva expirou e o job foi reenfileirado: o resultado é descartado
+            with self._cond:
+                self._in_flight.pop(job.job_id, None)
+            DISPATCH_BATCHES.inc(result='discarded')
+            print(f"Lote {job.batch_number} da campanha {job.campaign_id}: reserva perdida, resultado descartado")
+            return
+        DISPATCH_BATCHES.inc(result='sent' if result['success'] else 'retry' if retry_in is not None else 'failed')
+
+        with self._cond:
+            self._in_flight.pop(job.job_id, None)
+            dispatch = self._dispatches.get(job.campaign_id)
+        if dispatch:
+            dispatch.changed.set()
+        if self.progress:
+            self.progress.batch_finished(job.campaign_id, job.batch_number, result, retry_in)
+
+        if self.on_result:
+            try:
+                self.on_result(job, result)
+            except Exception as e:
+                print(f"Erro ao processar lote {job.batch_number} da campanha {job.campaign_id}: {e}")
+                ERRORS.inc(component='dispatch')
+
+    def _handle_failure(self, job: BatchJob, result: Dict,
+                        message_ids: Optional[Dict]) -> Tuple[bool, Optional[float]]:
+        """Reagenda as falhas temporárias; as definitivas vão para dead_letters.
+        Retorna (reserva ainda válida, atraso da nova tentativa)"""
+        error_class = classify_result(result)
+        error = str(result.get('error'))
+        if error_class in CIRCUIT_ERRORS:
+            self.breaker.record(False)
+
+        # Lote dividido em que só parte das requisições foi aceita: só o resto é repetido
+        sent = [contact for contact in job.contacts if contact['email'] in message_ids] if message_ids else None
+        remaining = [contact for contact in job.contacts if not message_ids or contact['email'] not in message_ids]
+
+        if error_class in RETRYABLE_ERRORS and job.attempts < self.max_attempts:
+            delay = backoff_delay(
+                job.attempts, self.retry_base, self.retry_cap, parse_retry_after(result.get('retry_after'))
+            )
+            if not self.db.retry_send_job(
+                job.job_id, job.worker, job.claimed_at, job.campaign_id, time.time() + delay,
+                f'{error_class}: {error}', [contact['id'] for contact in remaining], sent, message_ids
+            ):
+                return False, None
+            print(f"Lote {job.batch_number} da campanha {job.campaign_id}: {error_class}, "
+                  f"nova tentativa em {delay:.0f}s ({job.attempts}/{self.max_attempts})")
+            return True, delay
+
+        held = self.db.fail_send_job(
+            job.job_id, job.worker, job.claimed_at, job.campaign_id, f'{error_class}: {error}',
+            sent, message_ids, dead_letters=remaining, error_class=error_class, attempts=job.attempts
+        )
+        return held, None
+
+    def _check_circuit(self, job: BatchJob) -> bool:
+        """Com o circuito do domínio aberto, o lote volta para a fila até a próxima tentativa de teste"""
+        wait = self.breaker.acquire()
+        if not wait:
+            return True
+        self.db.release_send_job(job.job_id, job.worker, job.claimed_at, not_before=time.time() + wait)
+        with self._cond:
+            self._in_flight.pop(job.job_id, None)
+        DISPATCH_BATCHES.inc(result='deferred')
+        if self.progress:
+            self.progress.batch_deferred(job.campaign_id, job.batch_number, 'circuit_open', wait)
+        return False
+
+    def _reserve_quota(self, job: BatchJob):
+        """Reserva a cota diária do lote; sem cota, adia o job para o próximo dia"""
+        if not self.quota or not job.contacts:
+            return None, True
+
+        reservation = self.quota.reserve(len(job.contacts), self.worker_id)
+        if reservation is None:
+            wait = self.quota.seconds_until_reset()
+            self.db.release_send_job(job.job_id, job.worker, job.claimed_at, not_before=time.time() + wait)
+            with self._cond:
+                self._in_flight.pop(job.job_id, None)
+            DISPATCH_BATCHES.inc(result='deferred')
+            if self.progress:
+                self.progress.batch_deferred(job.campaign_id, job.batch_number, 'quota', wait)
+            print(f"Cota diária esgotada: lote {job.batch_number} da campanha {job.campaign_id} adiado")
+            return None, False
+        return reservation, True
+
+    def _wait_holding(self, job: BatchJob, wait: float, reservation: QuotaReservation = None) -> bool:
+        """Espera o limite de taxa renovando a reserva do job (e a da cota), que não podem expirar
+        enquanto esta thread ainda vai enviá-lo; False se o despachante parou ou a reserva foi perdida"""
+        deadline = time.monotonic() + wait
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return True
+            if self._stopping.wait(min(remaining, self.lease_seconds / 3)):
+                return False
+            now = time.time()
+            if not self.db.renew_send_job(job.job_id, job.worker, job.claimed_at, now,
+                                          reservation.reservation_id if reservation else None):
+                return False
+            job.claimed_at = now
+
+    def _worker(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+
+            if job.contacts and not self._check_circuit(job):
+                continue
+
+            reservation, allowed = self._reserve_quota(job)
+            if not allowed:
+                continue
+
+            # Aguarda o orçamento de taxa sem segurar nenhum lock
+            wait = self.bucket.reserve(len(job.contacts))
+            if wait and not self._wait_holding(job, wait, reservation):
+                if reservation:
+                    self.quota.refund(reservation)
+                with self._cond:
+                    self._in_flight.pop(job.job_id, None)
+                if self._stopping.is_set():
+                    self.db.release_send_job(job.job_id, job.worker, job.claimed_at)
+                    return
+                print(f"Lote {job.batch_number} da campanha {job.campaign_id}: reserva perdida antes do envio")
+                continue
+
+            with self._cond:
+                self._in_flight[job.job_id] = {'state': 'sending'}
+            try:
+                if job.contacts:
+                    result = self.send_func(job)
+                else:
+                    # Todos os contatos do lote foram removidos desde o agendamento
+                    result = {'batch_number': job.batch_number, 'recipients_count': 0, 'success': True}
+            except Exception as e:
+                result = {
+                    'batch_number': job.batch_number,
+                    'recipients_count': len(job.contacts),
+                    'success': False,
+                    'error': str(e),
+                    'error_class': NETWORK_ERROR if isinstance(e, requests.RequestException) else INTERNAL_ERROR
+                }
+
+            try:
+                if reservation:
+                    # Confirma o que saiu; falhas devolvem a reserva (menos as partes aceitas)
+                    sent = result['recipients_count'] if result['success'] else len(result.get('message_ids') or ())
+                    self.quota.commit(reservation, sent)
+                self._finish(job, result)
+            except Exception as e:
+                # O job continua reservado por este processo e volta à fila no próximo recover()
+                print(f"Erro ao registrar lote {job.batch_number} da campanha {job.campaign_id}: {e}")
+                ERRORS.inc(component='dispatch')
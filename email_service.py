@@ -1,146 +1,297 @@
 import time
-import threading
-import sqlite3
-from datetime import datetime, timedelta
+from datetime import date
 from typing import List, Dict, Optional
-from database import Database
+from database import SENDABLE_STATUS, Database
+from contact_import import ContactImporter
 from mailgun_client import MailgunClient
+from dispatch_scheduler import BatchJob, DispatchScheduler
+from metrics import ERRORS, SEND_QUEUE_JOBS
+from progress_stream import ProgressBroker, Subscription
+from quota import DailyQuota
+from stats_rollup import StatsRollup
+from email_validation import EmailValidator
+from suppression_sync import SuppressionIndex, SuppressionSync
+from event_sync import EventSync
+from webhook_ingestor import WebhookIngestor, parse_webhook_event
+from template_engine import TemplateCache
 from config import Config
 
 class EmailService:
     def __init__(self):
         self.db = Database()
         self.mailgun = MailgunClient()
-        self.sending_lock = threading.Lock()
-        self.daily_sent_count = 0
-        self.last_reset_date = datetime.now().date()
+        # Templates compilados por campanha (recompilados quando a campanha é editada)
+        self.templates = TemplateCache()
+        # Cota diária compartilhada por todos os workers (gravada no banco)
+        self.quota = DailyQuota(self.db)
+        # Estatísticas por hora/dia mantidas na escrita (leitura sem varrer email_logs)
+        self.stats = StatsRollup(self.db)
+        # Progresso dos envios para o painel (SSE), alimentado pelo despachante
+        self.progress = ProgressBroker()
+        self.scheduler = DispatchScheduler(
+            db=self.db,
+            send_func=self._send_batch_job,
+            on_result=self._on_batch_result,
+            quota=self.quota,
+            progress=self.progress
+        )
+        
+        self.webhook_ingestor = WebhookIngestor(self.db)
+        self.validator = EmailValidator(self.db, self.mailgun)
+        self.suppressions = SuppressionIndex(self.db)
+        self.suppression_sync = SuppressionSync(self.db, self.mailgun, self.suppressions)
+        
+        # Alternativa aos webhooks: busca periódica na API /events (se configurada)
+        self.event_sync = EventSync(self.db, self.mailgun)
+        self.event_sync.start()
+        
+        # Retoma campanhas interrompidas por um reinício do processo
+        self.scheduler.recover()
     
-    def reset_daily_counter(self):
-        """Reseta o contador diário se necessário"""
-        current_date = datetime.now().date()
-        if current_date > self.last_reset_date:
-            self.daily_sent_count = 0
-            self.last_reset_date = current_date
+    @property
+    def daily_sent_count(self) -> int:
+        """Emails enviados hoje por todos os processos"""
+        return self.quota.usage()['sent']
     
     def can_send_more_emails(self) -> bool:
         """Verifica se ainda pode enviar mais emails hoje"""
-        self.reset_daily_counter()
-        return self.daily_sent_count < Config.MAX_EMAILS_PER_DAY
+        return self.quota.can_send()
     
     def add_contacts_from_csv(self, csv_file_path: str, source: str = 'csv_import') -> int:
         """Importa contatos de um arquivo CSV com controle de lote"""
-        import pandas as pd
-        import uuid
-        
+        result = self.import_contacts_csv(csv_file_path, source)
+        return result['imported']
+    
+    def import_contacts_csv(self, csv_file_path: str, source: str = 'csv_import',
+                            progress_callback=None) -> Dict:
+        """Importa contatos de um CSV em streaming e retorna o resumo da importação"""
         try:
-            df = pd.read_csv(csv_file_path)
-            contacts = []
+            importer = ContactImporter(self.db, progress_callback=progress_callback)
+            result = importer.import_file(csv_file_path, source)
             
-            # Gera um ID único para este lote de importação
-            batch_id = f"batch_{uuid.uuid4().hex[:8]}_{int(datetime.now().timestamp())}"
-            
-            for _, row in df.iterrows():
-                contact = {
-                    'email': row.get('email', '').strip(),
-                    'name': row.get('name', '').strip(),
-                    'company': row.get('company', '').strip(),
-                    'position': row.get('position', '').strip(),
-                    'source': source
-                }
-                
-                if contact['email']:  # Só adiciona se tiver email
-                    contacts.append(contact)
-            
-            # Adiciona contatos com o batch_id, que automaticamente desativa lotes antigos
-            count = self.db.add_contacts_bulk(contacts, batch_id)
-            
-            print(f"Importação concluída: {count} contatos importados no lote {batch_id}")
-            return count
+            print(f"Importação concluída: {result['imported']} contatos importados no lote {result['batch_id']}")
+            return result
         
         except Exception as e:
             print(f"Erro ao importar CSV: {e}")
-            return 0
+            ERRORS.inc(component='import')
+            return {'batch_id': None, 'imported': 0, 'invalid': 0, 'rows_read': 0, 'error': str(e)}
     
     def create_campaign(self, name: str, subject_template: str, body_template: str) -> int:
         """Cria uma nova campanha"""
         return self.db.create_campaign(name, subject_template, body_template)
     
+    def dispatch_campaign(self, campaign_id: int, contact_limit: int = None,
+                          test_mode: bool = False) -> Dict:
+        """Divide a campanha em lotes e os agenda no despachante, sem aguardar o envio"""
+        # Busca a campanha
+        campaign = self.db.get_campaign(campaign_id)
+        if not campaign:
+            return {'success': False, 'error': 'Campanha não encontrada'}
+        
+        # Verifica se há contatos ativos (contagem pelo índice, sem carregar a lista)
+        if not self.db.count_sendable_contacts():
+            return {'success': False, 'error': 'Nenhum contato ativo encontrado'}
+        
+        # Verifica limite diário
+        if not self.can_send_more_emails():
+            return {'success': False, 'error': 'Limite diário de emails atingido'}
+        
+        # Se for modo teste, envia apenas para os primeiros 5 contatos
+        if test_mode:
+            contact_limit = min(contact_limit or 5, 5)
+        
+        # Templates compilados uma única vez; tags sem campo correspondente barram o envio
+        compiled = self.templates.get(campaign)
+        unknown = compiled.unknown_fields(self.db.get_contact_columns())
+        if unknown:
+            return {'success': False, 'error': f"Variáveis desconhecidas no template: {', '.join(unknown)}"}
+        
+        payload = self._campaign_payload(campaign_id, compiled)
+        
+        # Os lotes saem do banco sob demanda (só um lote fica na memória por vez) e são
+        # reagrupados para que nenhuma requisição passe de MAILGUN_MAX_PAYLOAD_BYTES
+        builder = self.mailgun.batch_builder(**payload)
+        total_contacts = 0
+        
+        def batches():
+            nonlocal total_contacts
+            rows = self.db.iter_recipient_batches(Config.BATCH_SIZE, limit=contact_limit,
+                                                  fields=compiled.fields)
+            for batch in builder.pack_contacts(rows):
+                total_contacts += len(batch)
+                yield batch
+        
+        dispatch = self.scheduler.submit(campaign_id, batches(), payload)
+        
+        return {
+            'success': True,
+            'campaign_id': campaign_id,
+            'total_contacts': total_contacts,
+            'total_batches': dispatch.total_batches,
+            'dispatch': dispatch
+        }
+    
+    def _campaign_payload(self, campaign_id: int, compiled) -> Dict:
+        """Dados comuns a todos os lotes da campanha (gravados em cada job)"""
+        return {
+            'mailgun_subject': compiled.subject.mailgun,
+            'mailgun_body': compiled.body.mailgun,
+            'campaign_tag': f"campaign_{campaign_id}",
+            'variables': compiled.variables
+        }
+    
+    def get_dead_letters(self, campaign_id: int, limit: int = 100) -> Dict:
+        """Destinatários que falharam em definitivo, com a contagem por classe de erro"""
+        counts = self.db.get_dead_letter_counts(campaign_id)
+        return {
+            'campaign_id': campaign_id,
+            'total': sum(counts.values()),
+            'by_error': counts,
+            'dead_letters': self.db.get_dead_letters(campaign_id, limit)
+        }
+    
+    def requeue_dead_letters(self, campaign_id: int, dead_letter_ids: List[int] = None) -> Dict:
+        """Reagenda para envio os destinatários que falharam em definitivo"""
+        campaign = self.db.get_campaign(campaign_id)
+        if not campaign:
+            return {'success': False, 'error': 'Campanha não encontrada'}
+        
+        compiled = self.templates.get(campaign)
+        payload = self._campaign_payload(campaign_id, compiled)
+        contact_ids = self.db.take_dead_letters(campaign_id, dead_letter_ids)
+        if not contact_ids:
+            return {'success': True, 'campaign_id': campaign_id, 'requeued': 0, 'total_batches': 0}
+        
+        builder = self.mailgun.batch_builder(**payload)
+        
+        def batches():
+            for start in range(0, len(contact_ids), Config.BATCH_SIZE):
+                chunk = contact_ids[start:start + Config.BATCH_SIZE]
+                yield self.db.get_recipients_by_ids(chunk, compiled.fields)
+        
+        dispatch = self.scheduler.submit(campaign_id, builder.pack_contacts(batches()), payload)
+        return {
+            'success': True,
+            'campaign_id': campaign_id,
+            'requeued': len(contact_ids),
+            'total_batches': dispatch.total_batches
+        }
+    
+    def check_campaign_template(self, campaign_id: int) -> Dict:
+        """Campos usados pelo template, campos desconhecidos e contatos sem valor para cada campo"""
+        campaign = self.db.get_campaign(campaign_id)
+        if not campaign:
+            return {'success': False, 'error': 'Campanha não encontrada'}
+        
+        compiled = self.templates.get(campaign)
+        unknown = compiled.unknown_fields(self.db.get_contact_columns())
+        required = [field for field in compiled.required_fields() if field not in unknown]
+        
+        return {
+            'success': True,
+            'campaign_id': campaign_id,
+            'fields': compiled.fields,
+            'unknown_fields': unknown,
+            # Campos sem {campo|padrão}: esses contatos recebem a tag vazia
+            'missing_values': {
+                field: count for field, count in self.db.count_missing_fields(required).items() if count
+            }
+        }
+    
+    def preview_campaign(self, campaign_id: int, contact_ids: List[int] = None, limit: int = 3) -> Dict:
+        """Renderiza a campanha localmente para alguns contatos, sem chamar o Mailgun"""
+        result = self.check_campaign_template(campaign_id)
+        if not result['success']:
+            return result
+        
+        compiled = self.templates.get(self.db.get_campaign(campaign_id))
+        if contact_ids:
+            contacts = self.db.get_recipients_by_ids(contact_ids, compiled.fields)
+        else:
+            contacts = next(self.db.iter_recipient_batches(limit, limit=limit, fields=compiled.fields), [])
+        
+        result['previews'] = [
+            {'contact_id': contact.id, 'email': contact.email, **compiled.render(contact)}
+            for contact in contacts
+        ]
+        return result
+    
     def send_campaign(self, campaign_id: int, contact_limit: int = None, 
                      test_mode: bool = False) -> Dict:
-        """Envia uma campanha completa"""
-        with self.sending_lock:
-            # Busca a campanha
-            campaign = self.db.get_campaign(campaign_id)
-            if not campaign:
-                return {'success': False, 'error': 'Campanha não encontrada'}
-            
-            # Busca contatos ativos
-            contacts = self.db.get_contacts(status='active', limit=contact_limit)
-            if not contacts:
-                return {'success': False, 'error': 'Nenhum contato ativo encontrado'}
-            
-            # Verifica limite diário
-            if not self.can_send_more_emails():
-                return {'success': False, 'error': 'Limite diário de emails atingido'}
-            
-            # Se for modo teste, envia apenas para os primeiros 5 contatos
-            if test_mode:
-                contacts = contacts[:5]
-            
-            # Prepara templates
-            subject_template = campaign['subject']
-            body_template = campaign['body_template']
-            
-            # Envia emails
-            results = self.mailgun.send_personalized_emails(
-                contacts=contacts,
-                subject_template=subject_template,
-                body_template=body_template,
-                campaign_tag=f"campaign_{campaign_id}"
-            )
-            
-            # Registra envios no banco
-            successful_sends = 0
-            for result in results:
-                if result['success']:
-                    successful_sends += result['recipients_count']
-                    
-                    # Registra cada email enviado
-                    for contact in contacts:
-                        self.db.log_email_sent(
-                            campaign_id=campaign_id,
-                            contact_id=contact['id'],
-                            email=contact['email']
-                        )
-            
-            # Atualiza contador diário
-            self.daily_sent_count += successful_sends
-            
-            return {
-                'success': True,
-                'campaign_id': campaign_id,
-                'total_contacts': len(contacts),
-                'successful_sends': successful_sends,
-                'results': results
-            }
+        """Envia uma campanha completa e aguarda todos os lotes"""
+        result = self.dispatch_campaign(campaign_id, contact_limit, test_mode)
+        if not result['success']:
+            return result
+        
+        dispatch = result.pop('dispatch')
+        dispatch.wait()
+        
+        results = dispatch.ordered_results()
+        result['successful_sends'] = sum(
+            batch['recipients_count'] for batch in results if batch['success']
+        )
+        result['results'] = results
+        return result
     
     def send_campaign_async(self, campaign_id: int, contact_limit: int = None, 
-                          test_mode: bool = False):
-        """Envia uma campanha de forma assíncrona"""
-        def send_worker():
-            try:
-                result = self.send_campaign(campaign_id, contact_limit, test_mode)
-                print(f"Campanha {campaign_id} concluída: {result}")
-            except Exception as e:
-                print(f"Erro ao enviar campanha {campaign_id}: {e}")
-        
-        thread = threading.Thread(target=send_worker)
-        thread.start()
-        return thread
-    
-    def get_campaign_stats(self, campaign_id: int) -> Dict:
+                          test_mode: bool = False) -> Dict:
+        """Agenda uma campanha e retorna imediatamente"""
+        result = self.dispatch_campaign(campaign_id, contact_limit, test_mode)
+        result.pop('dispatch', None)
+        return result
+    
+    def get_dispatch_queue(self) -> Dict:
+        """Lotes aguardando envio e em andamento no despachante"""
+        return self.scheduler.snapshot()
+    
+    def get_campaign_progress(self, campaign_id: int) -> Dict:
+        """Andamento do envio de uma campanha a partir da fila persistente"""
+        campaign = self.db.get_campaign(campaign_id)
+        counts = self.db.get_send_job_counts(campaign_id)
+        total = sum(counts.values())
+        
+        return {
+            'campaign_id': campaign_id,
+            'status': campaign['status'] if campaign else None,
+            'batches_total': total,
+            'batches_pending': counts['pending'],
+            'batches_in_flight': counts['in_flight'],
+            'batches_done': counts['done'],
+            'batches_failed': counts['failed'],
+            'progress': (counts['done'] + counts['failed']) / total * 100 if total else 0
+        }
+    
+    def update_queue_metrics(self):
+        """Profundidade da fila persistente de envio (lida do banco na hora da coleta)"""
+        for status, count in self.db.get_send_job_counts().items():
+            SEND_QUEUE_JOBS.set(count, status=status)
+    
+    def subscribe_progress(self, campaign_id: int) -> Subscription:
+        """Assina o progresso da campanha; o banco é lido no início (se ela ainda não é acompanhada)
+        e a cada heartbeat, para acompanhar lotes enviados por outros processos"""
+        return self.progress.subscribe(campaign_id, lambda: self.get_campaign_progress(campaign_id))
+    
+    def _send_batch_job(self, job: BatchJob) -> Dict:
+        """Envia um lote agendado (executado pelas threads do despachante)"""
+        # Remove quem entrou na lista de supressão depois do agendamento
+        job.contacts = self.suppressions.filter_contacts(job.contacts)
+        if not job.contacts:
+            return {'batch_number': job.batch_number, 'recipients_count': 0, 'success': True}
+        
+        result = self.mailgun.send_personalized_batch(contacts=job.contacts, **job.payload)
+        result['batch_number'] = job.batch_number
+        return result
+    
+    def _on_batch_result(self, job: BatchJob, result: Dict):
+        """Registra falhas de lote (resultado e cota já gravados pelo despachante)"""
+        result.pop('recipients', None)
+        if not result['success']:
+            print(f"Falha no lote {job.batch_number} da campanha {job.campaign_id}: {result.get('error')}")
+    
+    def get_campaign_stats(self, campaign_id: int, reconcile: bool = False) -> Dict:
         """Retorna estatísticas detalhadas de uma campanha"""
-        stats = self.db.get_campaign_stats(campaign_id)
+        stats = self.db.get_campaign_stats(campaign_id, reconcile=reconcile)
         campaign = self.db.get_campaign(campaign_id)
         
         if campaign:
@@ -149,94 +300,74 @@ class EmailService:
         
         return stats
     
-    def update_email_status_from_webhook(self, event_data: Dict):
-        """Atualiza status de emails baseado em webhooks do Mailgun"""
-        email = event_data.get('recipient')
-        event = event_data.get('event')
-        
-        if not email or not event:
-            return
-        
-        # Mapeia eventos do Mailgun para status internos
-        status_mapping = {
-            'delivered': 'delivered',
-            'opened': 'opened',
-            'clicked': 'clicked',
-            'bounced': 'bounced',
-            'complained': 'complained',
-            'unsubscribed': 'unsubscribed'
-        }
+    def update_email_status_from_webhook(self, event_data: Dict) -> int:
+        """Atualiza de forma síncrona o log do envio correspondente a um webhook do Mailgun"""
+        event = parse_webhook_event(event_data)
+        if event is None:
+            return 0
         
-        if event in status_mapping:
-            timestamp = event_data.get('timestamp')
-            if timestamp:
-                timestamp = datetime.fromtimestamp(timestamp)
-            
-            # Determina qual campo de timestamp atualizar
-            timestamp_field = None
-            if event == 'opened':
-                timestamp_field = 'opened_at'
-            elif event == 'clicked':
-                timestamp_field = 'clicked_at'
-            elif event == 'bounced':
-                timestamp_field = 'bounced_at'
-            
-            self.db.update_email_status(
-                email=email,
-                status=status_mapping[event],
-                **{timestamp_field: timestamp} if timestamp_field else {}
-            )
-    
-    def cleanup_bounced_emails(self):
-        """Remove ou desativa emails que deram bounce"""
-        bounces = self.mailgun.get_bounces()
-        
-        for bounce in bounces:
-            email = bounce.get('address')
-            if email:
-                # Marca o contato como inativo
-                with sqlite3.connect(self.db.db_path) as conn:
-                    cursor = conn.cursor()
-                    cursor.execute(
-                        'UPDATE contacts SET status = ? WHERE email = ?',
-                        ('bounced', email)
-                    )
-                    conn.commit()
+        message_id, email, status, timestamp = event
+        return self.db.update_email_status_by_message(
+            message_id=message_id,
+            email=email,
+            status=status,
+            timestamp=timestamp
+        )
+    
+    def enqueue_webhook_event(self, event_data: Dict) -> str:
+        """Enfileira um webhook para gravação em lote: 'accepted', 'ignored' ou 'rejected'"""
+        return self.webhook_ingestor.submit(event_data)
+    
+    def sync_events(self, begin: float = None, end: float = None) -> Dict:
+        """Busca eventos na API do Mailgun: incremental a partir do cursor, ou backfill de [begin, end]"""
+        if begin is not None:
+            return self.event_sync.backfill(begin, end or time.time())
+        return self.event_sync.sync()
+    
+    def cleanup_bounced_emails(self, full: bool = False) -> Dict:
+        """Sincroniza bounces, descadastros e reclamações do Mailgun e desativa os contatos"""
+        return self.suppression_sync.sync(full=full)
     
     def validate_contacts(self, contacts: List[Dict]) -> Dict:
-        """Valida uma lista de contatos usando a API do Mailgun"""
-        results = {
-            'valid': [],
-            'invalid': [],
-            'disposable': [],
-            'unknown': []
-        }
+        """Valida uma lista de contatos (sintaxe, MX, cache e API do Mailgun em paralelo)"""
+        return self.validator.validate_contacts(contacts)
+    
+    def validate_batch(self, batch_id: str) -> Dict:
+        """Valida os contatos que recebem campanhas de um lote e marca os inválidos e descartáveis como 'invalid'"""
+        contacts = self.db.get_contacts(status=SENDABLE_STATUS, batch_id=batch_id)
+        results = self.validate_contacts(contacts)
         
-        for contact in contacts:
-            email = contact['email']
-            validation = self.mailgun.validate_email(email)
-            
-            if validation.get('valid'):
-                if validation.get('is_disposable_address'):
-                    results['disposable'].append(contact)
-                else:
-                    results['valid'].append(contact)
-            elif validation.get('error'):
-                results['invalid'].append(contact)
-            else:
-                results['unknown'].append(contact)
-        
-        return results
+        rejected = results['invalid'] + results['disposable']
+        self.db.set_contacts_status([contact['id'] for contact in rejected], 'invalid')
+        
+        summary = {status: len(group) for status, group in results.items()}
+        summary.update({'batch_id': batch_id, 'checked': len(contacts), 'deactivated': len(rejected)})
+        return summary
     
     def get_daily_stats(self) -> Dict:
         """Retorna estatísticas do dia atual"""
-        # Obtém estatísticas do banco de dados
-        db_stats = self.db.get_daily_stats()
+        # Lê os resumos do dia no fuso configurado
+        db_stats = self.stats.daily()
         
-        # Adiciona informações do contador diário
+        # Adiciona informações da cota diária compartilhada
+        quota = self.quota.usage()
         db_stats.update({
-            'remaining_quota': max(0, Config.MAX_EMAILS_PER_DAY - self.daily_sent_count),
-            'daily_sent_count': self.daily_sent_count
+            'daily_limit': quota['limit'],
+            'remaining_quota': quota['remaining'],
+            'daily_sent_count': quota['sent'],
+            'reserved_quota': quota['reserved']
         })
         
         return db_stats
+    
+    def get_stats_range(self, start: date, end: date, granularity: str = 'day',
+                        campaign_id: int = None) -> Dict:
+        """Série histórica de envios e eventos entre dois dias (por dia ou por hora)"""
+        return {
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'granularity': granularity,
+            'campaign_id': campaign_id,
+            'utc_offset_hours': Config.UTC_OFFSET_HOURS,
+            'series': self.stats.series(start, end, granularity, campaign_id)
+        }
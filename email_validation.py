@@ -0,0 +1,161 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+from config import Config
+from contact_import import is_valid_email, normalize_email
+from database import Database
+from mailgun_client import MailgunClient
+from quota import SharedTokenBucket
+
+try:
+    import dns.exception
+    import dns.resolver
+except ImportError:  # dnspython é opcional: sem ele a verificação de MX é ignorada
+    dns = None
+
+VALIDATION_STATUSES = ('valid', 'invalid', 'disposable', 'unknown')
+
+# Respostas da API que indicam falha temporária (não vão para o cache)
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+def classify_validation(response: Dict) -> Dict:
+    """Converte a resposta da API de validação em {'status', 'reason'}"""
+    if response.get('error'):
+        status_code = response.get('status_code')
+        if status_code is None or status_code in RETRYABLE_STATUS_CODES:
+            return {'status': 'unknown', 'reason': 'api_unavailable', 'retryable': True}
+        return {'status': 'invalid', 'reason': 'api_rejected'}
+
+    result = response.get('result')
+    if response.get('is_disposable_address'):
+        return {'status': 'disposable', 'reason': 'disposable_address'}
+    if response.get('valid') is True or result == 'deliverable':
+        return {'status': 'valid', 'reason': None}
+    if response.get('valid') is False or result in ('undeliverable', 'do_not_send'):
+        reason = response.get('reason')
+        if isinstance(reason, list):
+            reason = ','.join(reason)
+        return {'status': 'invalid', 'reason': reason or result or 'undeliverable'}
+    return {'status': 'unknown', 'reason': result}
+
+
+def resolve_mx(domain: str, timeout: float = 5.0) -> Optional[bool]:
+    """True se o domínio recebe email, False se não existe, None se não foi possível verificar"""
+    if dns is None:
+        return None
+
+    try:
+        dns.resolver.resolve(domain, 'MX', lifetime=timeout)
+        return True
+    except dns.resolver.NXDOMAIN:
+        return False
+    except dns.resolver.NoAnswer:
+        # Sem MX o servidor usa o registro A do domínio (RFC 5321)
+        try:
+            dns.resolver.resolve(domain, 'A', lifetime=timeout)
+            return True
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+            return False
+        except dns.exception.DNSException:
+            return None
+    except dns.exception.DNSException:
+        return None
+
+
+class EmailValidator:
+    """Valida emails em etapas: sintaxe, MX do domínio, cache e, por fim, a API do Mailgun"""
+
+    def __init__(self, db: Database, mailgun: MailgunClient, concurrency: int = None,
+                 rate_per_minute: float = None, ttl_days: float = None,
+                 domain_ttl_hours: float = None, check_mx: bool = True):
+        self.db = db
+        self.mailgun = mailgun
+        self.concurrency = concurrency or Config.VALIDATION_CONCURRENCY
+        self.ttl = (ttl_days or Config.VALIDATION_CACHE_TTL_DAYS) * 86400
+        self.domain_ttl = (domain_ttl_hours or Config.VALIDATION_DOMAIN_TTL_HOURS) * 3600
+        self.check_mx = check_mx
+        # Limite de chamadas compartilhado entre processos
+        self.bucket = SharedTokenBucket(
+            db, 'validation',
+            (rate_per_minute or Config.VALIDATION_RATE_PER_MINUTE) / 60.0,
+            self.concurrency
+        )
+
+    def _check_domains(self, domains: List[str]) -> Dict[str, Optional[bool]]:
+        """Verifica o MX de cada domínio, usando o cache quando possível"""
+        if not self.check_mx or dns is None or not domains:
+            return {}
+
+        now = time.time()
+        checked = self.db.get_cached_domains(domains, now - self.domain_ttl)
+        missing = [domain for domain in domains if domain not in checked]
+
+        if missing:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                resolved = dict(zip(missing, executor.map(resolve_mx, missing)))
+            # Falhas de DNS (None) não são gravadas
+            self.db.save_domain_checks(
+                {domain: has_mx for domain, has_mx in resolved.items() if has_mx is not None}, now
+            )
+            checked.update(resolved)
+
+        return checked
+
+    def _call_api(self, email: str) -> Dict:
+        wait = self.bucket.reserve(1)
+        if wait:
+            time.sleep(wait)
+        try:
+            response = self.mailgun.validate_email(email)
+        except Exception as e:
+            response = {'valid': False, 'error': str(e)}
+        return classify_validation(response)
+
+    def validate_many(self, emails: Iterable[str]) -> Dict[str, Dict]:
+        """Valida vários emails e retorna email normalizado -> {'status', 'reason', 'source'}"""
+        results = {}
+        pending = []
+
+        # 1. Sintaxe (local, sem custo)
+        for email in dict.fromkeys(normalize_email(email) for email in emails):
+            if not is_valid_email(email):
+                results[email] = {'status': 'invalid', 'reason': 'syntax', 'source': 'syntax'}
+            else:
+                pending.append(email)
+
+        # 2. Resultados já conhecidos
+        cached = self.db.get_cached_validations(pending, time.time() - self.ttl)
+        for email, result in cached.items():
+            results[email] = {**result, 'source': 'cache'}
+        pending = [email for email in pending if email not in cached]
+
+        # 3. Domínio sem MX
+        domains = self._check_domains(sorted({email.rsplit('@', 1)[1] for email in pending}))
+        no_mx = {}
+        for email in pending:
+            if domains.get(email.rsplit('@', 1)[1]) is False:
+                no_mx[email] = {'status': 'invalid', 'reason': 'no_mx'}
+                results[email] = {**no_mx[email], 'source': 'mx'}
+        pending = [email for email in pending if email not in no_mx]
+
+        # 4. API do Mailgun, em paralelo e sob limite de taxa
+        checked = {}
+        if pending:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                for email, result in zip(pending, executor.map(self._call_api, pending)):
+                    results[email] = {'status': result['status'], 'reason': result['reason'], 'source': 'api'}
+                    if not result.get('retryable'):
+                        checked[email] = result
+
+        self.db.save_validations({**no_mx, **checked}, time.time())
+        return results
+
+    def validate_contacts(self, contacts: List[Dict]) -> Dict[str, List[Dict]]:
+        """Agrupa os contatos por resultado: valid, invalid, disposable e unknown"""
+        results = self.validate_many(contact['email'] for contact in contacts)
+        grouped = {status: [] for status in VALIDATION_STATUSES}
+        for contact in contacts:
+            grouped[results[normalize_email(contact['email'])]['status']].append(contact)
+        return grouped
@@ -0,0 +1,135 @@
+import atexit
+import json
+import threading
+import time
+from typing import Dict, List, Optional
+
+from config import Config
+from database import Database
+from mailgun_client import MailgunClient
+from metrics import ERRORS
+from webhook_ingestor import flatten_event, parse_webhook_event
+
+
+def event_key(item: Dict, flat: Dict) -> str:
+    """Id do evento no Mailgun (ou uma chave equivalente, se ausente)"""
+    return item.get('id') or f"{flat['message-id']}:{flat['recipient']}:{flat['event']}:{flat['timestamp']}"
+
+
+class EventSync:
+    """Busca eventos pela API /events e aplica pelo mesmo caminho em lote dos webhooks"""
+
+    CHECKPOINT = 'events'
+
+    def __init__(self, db: Database, mailgun: MailgunClient, page_size: int = None,
+                 settle_seconds: float = None, lookback_seconds: float = None,
+                 interval: float = None):
+        self.db = db
+        self.mailgun = mailgun
+        self.page_size = page_size or Config.EVENT_SYNC_PAGE_SIZE
+        # Eventos muito recentes ainda podem aparecer fora de ordem na API
+        self.settle_seconds = Config.EVENT_SYNC_SETTLE_SECONDS if settle_seconds is None else settle_seconds
+        self.lookback_seconds = lookback_seconds or Config.EVENT_SYNC_LOOKBACK_HOURS * 3600
+        self.interval = Config.EVENT_SYNC_INTERVAL if interval is None else interval
+        self.retention = Config.EVENT_DEDUP_RETENTION_DAYS * 86400
+        self._thread = None
+        self._stopping = threading.Event()
+        self._run_lock = threading.Lock()
+        self.last_summary: Optional[Dict] = None
+        atexit.register(self.stop)
+
+    def load_cursor(self, name: str) -> Dict:
+        """Cursor gravado: {'begin', 'end', 'next'}"""
+        cursor = self.db.get_sync_checkpoint(name)
+        return json.loads(cursor) if cursor else {}
+
+    def _page_events(self, items: List[Dict]) -> List[tuple]:
+        events = []
+        for item in items:
+            flat = flatten_event(item)
+            parsed = parse_webhook_event(flat)
+            if parsed is not None:
+                events.append((event_key(item, flat),) + parsed)
+        return events
+
+    def sync_window(self, begin: float, end: float, checkpoint_name: str,
+                    resume_url: str = None) -> Dict:
+        """Percorre todas as páginas de [begin, end], gravando o cursor a cada página"""
+        summary = {'begin': begin, 'end': end, 'pages': 0, 'events': 0,
+                   'new': 0, 'duplicates': 0, 'updated': 0}
+
+        pages = self.mailgun.iter_events(begin, end, limit=self.page_size, start_url=resume_url)
+        for items, next_url in pages:
+            events = self._page_events(items)
+            cursor = json.dumps({'begin': begin, 'end': end, 'next': next_url})
+            applied = self.db.apply_new_events(events, checkpoint_name, cursor)
+
+            summary['pages'] += 1
+            summary['events'] += len(items)
+            for key in ('new', 'duplicates', 'updated'):
+                summary[key] += applied[key]
+
+            if self._stopping.is_set():
+                summary['interrupted'] = True
+                break
+
+        return summary
+
+    def sync(self, now: float = None) -> Dict:
+        """Sincroniza do cursor gravado até agora (menos a janela de acomodação)"""
+        with self._run_lock:
+            now = now or time.time()
+            cursor = self.load_cursor(self.CHECKPOINT)
+            begin = cursor.get('begin', now - self.lookback_seconds)
+            end = now - self.settle_seconds
+            resume_url = None
+
+            # Uma execução anterior parou no meio de uma janela: termina a mesma janela
+            if cursor.get('next') and cursor.get('end'):
+                end = cursor['end']
+                resume_url = cursor['next']
+
+            if begin >= end:
+                return {'begin': begin, 'end': end, 'pages': 0, 'events': 0}
+
+            summary = self.sync_window(begin, end, self.CHECKPOINT, resume_url)
+            if not summary.get('interrupted'):
+                self.db.save_sync_checkpoint(self.CHECKPOINT, json.dumps({'begin': end}))
+            self.db.prune_processed_events(self.retention)
+
+            self.last_summary = summary
+            return summary
+
+    def backfill(self, begin: float, end: float) -> Dict:
+        """Reprocessa uma janela de tempo (ex: período em que o webhook ficou fora do ar)"""
+        name = f'{self.CHECKPOINT}:backfill:{int(begin)}-{int(end)}'
+        cursor = self.load_cursor(name)
+        resume_url = None if cursor.get('done') else cursor.get('next')
+
+        summary = self.sync_window(begin, end, name, resume_url)
+        if not summary.get('interrupted'):
+            self.db.save_sync_checkpoint(name, json.dumps({'begin': begin, 'end': end, 'done': True}))
+        return summary
+
+    def start(self):
+        """Inicia a sincronização periódica (EVENT_SYNC_INTERVAL > 0)"""
+        if not self.interval or (self._thread and self._thread.is_alive()):
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='event-sync', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.sync()
+            except Exception as e:
+                # O cursor não avança: a próxima execução retoma do mesmo ponto
+                print(f"Erro ao sincronizar eventos do Mailgun: {e}")
+                ERRORS.inc(component='event_sync')
+            self._stopping.wait(self.interval)
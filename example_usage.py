@@ -88,9 +88,9 @@ contato@auditor-simples.com
     # 5. Verificar estatísticas diárias
     print("\n5. 📅 Estatísticas do dia...")
     daily_stats = email_service.get_daily_stats()
-    print(f"   📧 Enviados hoje: {daily_stats['sent_today']}")
-    print(f"   📖 Abertos hoje: {daily_stats['opened_today']}")
-    print(f"   🖱️  Clicados hoje: {daily_stats['clicked_today']}")
+    print(f"   📧 Enviados hoje: {daily_stats['emails_sent_today']}")
+    print(f"   📖 Abertos hoje: {daily_stats['events_today']['opened']}")
+    print(f"   🖱️  Clicados hoje: {daily_stats['events_today']['clicked']}")
     print(f"   📊 Quota restante: {daily_stats['remaining_quota']}")
     
     print("\n🎉 Exemplo concluído com sucesso!")
@@ -0,0 +1,11 @@
+# Configuração do gunicorn, lida automaticamente do diretório de trabalho (Procfile e Dockerfile)
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+
+# Workers com threads: cada stream de progresso (SSE) ocupa uma thread, não o worker inteiro
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# Sem o worker síncrono, o timeout só vale para workers travados, não para streams longos
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
@@ -1,17 +1,99 @@
 import requests
 import json
+import threading
 import time
-from typing import List, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Dict, Optional
+from urllib.parse import urlsplit
 from datetime import datetime
+from requests.adapters import HTTPAdapter
 from config import Config
+from batch_payload import (
+    CONTENT_TYPE as MULTIPART_CONTENT_TYPE, BatchBuilder, PayloadBatch, is_payload_rejected, merge_results
+)
+from metrics import MAILGUN_BATCH_RECIPIENTS, MAILGUN_REQUEST_SECONDS
+from template_engine import CompiledCampaign, LEGACY_VARIABLES, compile_template
+
+
+class MeteredSession(requests.Session):
+    """Sessão que mede cada requisição em mailgun_request_duration_seconds{endpoint, status}"""
+    
+    def __init__(self, base_url: str):
+        super().__init__()
+        self.base_url = base_url
+    
+    def endpoint(self, url: str) -> str:
+        """Recurso chamado (messages, events, bounces, address...), sem IDs nem cursores de página"""
+        path = urlsplit(url).path
+        base_path = urlsplit(self.base_url).path
+        # /v3/<domínio>/events/<cursor> -> events; /v4/address/validate -> address
+        rest = path[len(base_path):] if path.startswith(base_path) else path.strip('/').partition('/')[2]
+        return rest.strip('/').split('/', 1)[0] or 'domain'
+    
+    def request(self, method, url, *args, **kwargs):
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            response = super().request(method, url, *args, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            MAILGUN_REQUEST_SECONDS.observe(
+                time.perf_counter() - started, endpoint=self.endpoint(url), status=status
+            )
 
 class MailgunClient:
-    def __init__(self):
-        self.api_key = Config.MAILGUN_API_KEY
+    def __init__(self, api_key: str = None, api_url: str = None,
+                 max_concurrency: int = None, pool_size: int = None):
+        self.api_key = api_key or Config.MAILGUN_API_KEY
         self.domain = Config.MAILGUN_DOMAIN
-        self.base_url = Config.BASE_URL
-        self.session = requests.Session()
+        self.api_url = (api_url or Config.MAILGUN_API_URL).rstrip('/')
+        self.base_url = f'{self.api_url}/v3/{self.domain}'
+        self.timeout = Config.HTTP_TIMEOUT
+        self.max_concurrency = max_concurrency or Config.MAILGUN_MAX_CONCURRENCY
+        
+        # Sessão com pool de conexões keep-alive dimensionado para a concorrência
+        pool_size = pool_size or max(Config.HTTP_POOL_SIZE, self.max_concurrency)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session = MeteredSession(self.base_url)
         self.session.auth = ('api', self.api_key)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        
+        # Limita quantos POSTs ficam em andamento ao mesmo tempo
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+    
+    def _post_message(self, data) -> requests.Response:
+        """Envia um POST para /messages respeitando o limite de concorrência"""
+        # data pode ser um dict ou o corpo multipart já montado (bytes)
+        headers = {'Content-Type': MULTIPART_CONTENT_TYPE} if isinstance(data, bytes) else None
+        with self._slots:
+            return self.session.post(f'{self.base_url}/messages', data=data, headers=headers,
+                                     timeout=self.timeout)
+    
+    def _message_fields(self, subject: str, body_template: str, campaign_tag: str = None) -> Dict:
+        """Campos comuns a todos os destinatários de um envio em lote"""
+        data = {
+            'from': Config.FROM_EMAIL,
+            'subject': subject,
+            'text': body_template,
+            'o:tracking': 'yes' if Config.TRACKING_ENABLED else 'no',
+            'h:Reply-To': Config.REPLY_TO,
+            'h:X-Mailer': 'Auditor Simples Email System'
+        }
+        if campaign_tag:
+            data['o:tag'] = f"{Config.TAG_PREFIX}-{campaign_tag}"
+        return data
+    
+    def batch_builder(self, mailgun_subject: str, mailgun_body: str, campaign_tag: str = None,
+                      variables: Dict = None, max_recipients: int = None) -> BatchBuilder:
+        """Montador de lotes que respeita BATCH_SIZE e o tamanho máximo da requisição"""
+        return BatchBuilder(
+            variables if variables is not None else LEGACY_VARIABLES,
+            max_recipients or Config.BATCH_SIZE,
+            Config.MAILGUN_MAX_PAYLOAD_BYTES,
+            fields=self._message_fields(mailgun_subject, mailgun_body, campaign_tag)
+        )
     
     def send_single_email(self, to_email: str, subject: str, body: str, 
                          from_email: str = None, reply_to: str = None,
@@ -32,7 +114,7 @@ class MailgunClient:
         if tag:
             data['o:tag'] = tag
         
-        response = self.session.post(f'{self.base_url}/messages', data=data)
+        response = self._post_message(data)
         
         if response.status_code == 200:
             return {
@@ -58,29 +140,25 @@ class MailgunClient:
         # Divide os destinatários em lotes
         for i in range(0, len(recipients), batch_size):
             batch_recipients = recipients[i:i + batch_size]
+            MAILGUN_BATCH_RECIPIENTS.observe(len(batch_recipients))
             
             # Prepara os dados para o lote
-            data = {
-                'from': Config.FROM_EMAIL,
-                'to': batch_recipients,
-                'subject': subject,
-                'text': body_template,
-                'o:tracking': 'yes' if Config.TRACKING_ENABLED else 'no',
-                'h:Reply-To': Config.REPLY_TO,
-                'h:X-Mailer': 'Auditor Simples Email System'
-            }
+            data = self._message_fields(subject, body_template, campaign_tag)
+            data['to'] = batch_recipients
             
             if recipient_vars:
-                data['recipient-variables'] = json.dumps(recipient_vars)
-            
-            if campaign_tag:
-                data['o:tag'] = f"{Config.TAG_PREFIX}-{campaign_tag}"
+                # Só as variáveis dos destinatários deste lote
+                data['recipient-variables'] = json.dumps(
+                    {email: recipient_vars[email] for email in batch_recipients if email in recipient_vars},
+                    separators=(',', ':')
+                )
             
             # Envia o lote
-            response = self.session.post(f'{self.base_url}/messages', data=data)
+            response = self._post_message(data)
             
             batch_result = {
                 'batch_number': i // batch_size + 1,
+                'recipients': batch_recipients,
                 'recipients_count': len(batch_recipients),
                 'status_code': response.status_code,
                 'success': response.status_code == 200
@@ -91,6 +169,7 @@ class MailgunClient:
                 batch_result['message'] = response.json().get('message')
             else:
                 batch_result['error'] = response.text
+                batch_result['retry_after'] = response.headers.get('Retry-After')
             
             results.append(batch_result)
             
@@ -101,19 +180,8 @@ class MailgunClient:
         return results
     
     def convert_template_tags(self, template: str) -> str:
-        """Converte tags do formato {name} para o formato %recipient.name% do Mailgun"""
-        replacements = {
-            '{name}': '%recipient.name%',
-            '{company}': '%recipient.company%',
-            '{position}': '%recipient.position%',
-            '{source}': '%recipient.source%'
-        }
-        
-        converted_template = template
-        for old_tag, new_tag in replacements.items():
-            converted_template = converted_template.replace(old_tag, new_tag)
-        
-        return converted_template
+        """Converte tags do formato {name} (ou {name|padrão}) para o formato %recipient.name% do Mailgun"""
+        return compile_template(template).mailgun
 
     def send_personalized_emails(self, contacts: List[Dict], subject_template: str, 
                                body_template: str, batch_size: int = None,
@@ -123,38 +191,24 @@ class MailgunClient:
         delay = delay or Config.DELAY_BETWEEN_BATCHES
         results = []
         
-        # Converte as tags dos templates para o formato do Mailgun
-        mailgun_subject = self.convert_template_tags(subject_template)
-        mailgun_body = self.convert_template_tags(body_template)
+        # Compila os templates uma vez para o formato do Mailgun
+        compiled = CompiledCampaign(subject_template, body_template)
         
         # Divide em lotes
         for i in range(0, len(contacts), batch_size):
             batch_contacts = contacts[i:i + batch_size]
-            batch_emails = [contact['email'] for contact in batch_contacts]
-            
-            # Prepara variáveis dos destinatários APENAS para este lote
-            batch_recipient_vars = {}
-            for contact in batch_contacts:
-                email = contact['email']
-                batch_recipient_vars[email] = {
-                    'name': contact.get('name', 'Cliente'),
-                    'company': contact.get('company', ''),
-                    'position': contact.get('position', ''),
-                    'source': contact.get('source', '')
-                }
             
             # Envia o lote com templates convertidos para o formato do Mailgun
-            batch_result = self.send_bulk_emails(
-                recipients=batch_emails,
-                subject=mailgun_subject,  # Template convertido
-                body_template=mailgun_body,  # Template convertido
-                recipient_vars=batch_recipient_vars,  # Apenas para este lote
-                batch_size=len(batch_emails),
-                delay=0,  # Sem delay entre sub-lotes
-                campaign_tag=campaign_tag
+            batch_result = self.send_personalized_batch(
+                contacts=batch_contacts,
+                mailgun_subject=compiled.subject.mailgun,
+                mailgun_body=compiled.body.mailgun,
+                campaign_tag=campaign_tag,
+                variables=compiled.variables
             )
+            batch_result['batch_number'] = i // batch_size + 1
             
-            results.extend(batch_result)
+            results.append(batch_result)
             
             # Aguarda antes do próximo lote (exceto no último)
             if i + batch_size < len(contacts):
@@ -162,6 +216,58 @@ class MailgunClient:
         
         return results
     
+    def send_personalized_batch(self, contacts: List[Dict], mailgun_subject: str,
+                                mailgun_body: str, campaign_tag: str = None,
+                                variables: Dict = None) -> Dict:
+        """Envia um único lote personalizado, sem espera (templates já convertidos)"""
+        builder = self.batch_builder(mailgun_subject, mailgun_body, campaign_tag, variables,
+                                     max_recipients=max(len(contacts), 1))
+        MAILGUN_BATCH_RECIPIENTS.observe(len(contacts))
+        
+        # Cada destinatário é serializado uma vez; o lote só vira mais de uma
+        # requisição se passar de MAILGUN_MAX_PAYLOAD_BYTES ou for recusado pelo tamanho
+        parts = []
+        for batch in builder.pack(contacts):
+            parts.extend(self._send_payload_batch(batch, builder))
+        
+        return merge_results(parts)
+    
+    def _send_payload_batch(self, batch: PayloadBatch, builder: BatchBuilder) -> List[tuple]:
+        """Envia o lote; se o Mailgun recusar pelo tamanho, divide ao meio e tenta as metades"""
+        try:
+            response = self._post_message(builder.encode(batch))
+        except requests.RequestException as e:
+            # Sem resposta (timeout, conexão recusada): falha de rede, tratada pelo despachante
+            return [(batch, None, None, str(e), None)]
+        
+        if is_payload_rejected(response.status_code, response.text) and len(batch) > 1:
+            left, right = batch.split()
+            return self._send_payload_batch(left, builder) + self._send_payload_batch(right, builder)
+        
+        body = response.json() if response.status_code == 200 else None
+        return [(batch, response.status_code, body, response.text, response.headers.get('Retry-After'))]
+    
+    def send_batches_concurrent(self, batches: List[List[Dict]], mailgun_subject: str,
+                                mailgun_body: str, campaign_tag: str = None,
+                                variables: Dict = None) -> List[Dict]:
+        """Envia vários lotes com até max_concurrency POSTs simultâneos"""
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            futures = [
+                executor.submit(
+                    self.send_personalized_batch, batch, mailgun_subject, mailgun_body,
+                    campaign_tag, variables
+                )
+                for batch in batches
+            ]
+            
+            results = []
+            for batch_number, future in enumerate(futures, start=1):
+                batch_result = future.result()
+                batch_result['batch_number'] = batch_number
+                results.append(batch_result)
+        
+        return results
+    
     def get_events(self, event_type: str = None, limit: int = 100) -> List[Dict]:
         """Busca eventos do Mailgun (opens, clicks, bounces, etc.)"""
         params = {'limit': limit}
@@ -175,6 +281,30 @@ class MailgunClient:
         else:
             return []
     
+    def iter_events(self, begin: float, end: float = None, limit: int = 300,
+                    start_url: str = None) -> Iterator[tuple]:
+        """Percorre /events em ordem crescente, gerando (itens da página, URL da próxima página)"""
+        if start_url:
+            url, params = start_url, None
+        else:
+            url = f'{self.base_url}/events'
+            params = {'begin': begin, 'ascending': 'yes', 'limit': limit}
+            if end is not None:
+                params['end'] = end
+        
+        while url:
+            response = self.session.get(url, params=params, timeout=self.timeout)
+            response.raise_for_status()
+            
+            page = response.json()
+            items = page.get('items', [])
+            if not items:
+                return
+            
+            next_url = page.get('paging', {}).get('next')
+            yield items, next_url
+            url, params = next_url, None
+    
     def get_bounces(self, limit: int = 100) -> List[Dict]:
         """Busca emails que deram bounce"""
         response = self.session.get(f'{self.base_url}/bounces', params={'limit': limit})
@@ -193,17 +323,37 @@ class MailgunClient:
         else:
             return []
     
+    def iter_suppressions(self, kind: str, limit: int = 1000) -> Iterator[List[Dict]]:
+        """Percorre uma lista de supressão (bounces, unsubscribes, complaints) página a página"""
+        url = f'{self.base_url}/{kind}'
+        params = {'limit': limit}
+        
+        while url:
+            response = self.session.get(url, params=params, timeout=self.timeout)
+            response.raise_for_status()
+            
+            page = response.json()
+            items = page.get('items', [])
+            if not items:
+                return
+            yield items
+            
+            # O cursor da próxima página já vem com os parâmetros na URL
+            url = page.get('paging', {}).get('next')
+            params = None
+    
     def validate_email(self, email: str) -> Dict:
         """Valida um endereço de email usando a API do Mailgun"""
         response = self.session.get(
-            f'https://api.mailgun.net/v4/address/validate',
-            params={'address': email}
+            f'{self.api_url}/v4/address/validate',
+            params={'address': email},
+            timeout=self.timeout
         )
         
         if response.status_code == 200:
             return response.json()
         else:
-            return {'valid': False, 'error': response.text}
+            return {'valid': False, 'error': response.text, 'status_code': response.status_code}
     
     def get_domain_stats(self, start_date: str = None, end_date: str = None) -> Dict:
         """Busca estatísticas do domínio"""
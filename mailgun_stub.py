@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Servidor HTTP local que imita a API do Mailgun.
+
+Usado por benchmarks e testes para medir o sistema sem enviar emails reais.
+
+Uso:
+    python mailgun_stub.py --port 8025 --latency 0.05
+    python mailgun_stub.py --error-rate 0.02 --throttle-rate 0.05 --retry-after 2
+    MAILGUN_API_URL=http://127.0.0.1:8025 python app.py
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from email.parser import BytesParser
+from email.policy import HTTP
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+
+class MailgunStubHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 para permitir conexões keep-alive
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def stub(self) -> 'MailgunStub':
+        return self.server.stub
+
+    def log_message(self, format, *args):
+        # Silencia o log padrão de cada requisição
+        pass
+
+    def _read_form(self) -> dict:
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        self.body_size = length
+
+        content_type = self.headers.get('Content-Type', '')
+        if content_type.startswith('multipart/form-data'):
+            # O mesmo formato {campo: [valores]} do parse_qs
+            message = BytesParser(policy=HTTP).parsebytes(
+                f'Content-Type: {content_type}\r\n\r\n'.encode('utf-8') + body
+            )
+            form = {}
+            for part in message.iter_parts():
+                name = part.get_param('name', header='content-disposition')
+                form.setdefault(name, []).append(part.get_payload(decode=True).decode('utf-8'))
+            return form
+        return parse_qs(body.decode('utf-8'))
+
+    def _send_json(self, status: int, payload: dict, headers: dict = None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        form = self._read_form()
+
+        if self.stub.latency:
+            time.sleep(self.stub.latency)
+
+        if path.endswith('/messages'):
+            if self.stub.max_payload_bytes and self.body_size > self.stub.max_payload_bytes:
+                self.stub.record_rejection()
+                self._send_json(413, {'message': 'Request entity too large'})
+                return
+            # 'to' pode vir repetido ou com vários endereços separados por vírgula
+            fault = self.stub.next_fault() or self.stub.random_fault()
+            if fault:
+                status, retry_after = fault
+                headers = {'Retry-After': str(retry_after)} if retry_after is not None else None
+                self._send_json(status, {'message': f'Falha injetada ({status})'}, headers)
+                return
+            recipients = [address.strip() for value in form.get('to', []) for address in value.split(',')]
+            self.stub.record_message(recipients, form)
+            self._send_json(200, {
+                'id': f'<{uuid.uuid4().hex}@stub.mailgun>',
+                'message': 'Queued. Thank you.'
+            })
+            return
+
+        self._send_json(404, {'message': 'Not found'})
+
+    def _send_events(self, url):
+        """Página de eventos filtrada por begin/end, com o cursor da próxima página"""
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        limit = int(query.get('limit', 100))
+        offset = int(query.pop('page', 0))
+        begin = float(query.get('begin', 0))
+        end = float(query.get('end', float('inf')))
+
+        matching = [event for event in self.stub.events if begin <= event['timestamp'] <= end]
+        if query.get('ascending') != 'yes':
+            matching.reverse()
+        items = matching[offset:offset + limit]
+
+        next_query = urlencode({**query, 'page': offset + limit})
+        self._send_json(200, {
+            'items': items,
+            'paging': {'next': f'{self.stub.url}{url.path}?{next_query}'}
+        })
+
+    def do_GET(self):
+        url = urlparse(self.path)
+
+        if self.stub.latency:
+            time.sleep(self.stub.latency)
+
+        if url.path.endswith('/events'):
+            self._send_events(url)
+            return
+
+        kind = url.path.rsplit('/', 1)[-1]
+        if kind in self.stub.suppressions:
+            query = parse_qs(url.query)
+            limit = int(query.get('limit', ['100'])[0])
+            offset = int(query.get('offset', ['0'])[0])
+            items = self.stub.suppressions[kind][offset:offset + limit]
+            base = f'{self.stub.url}{url.path}'
+            self._send_json(200, {
+                'items': items,
+                'paging': {
+                    'first': f'{base}?limit={limit}',
+                    'next': f'{base}?limit={limit}&offset={offset + limit}',
+                    'last': f'{base}?page=last&limit={limit}'
+                }
+            })
+            return
+
+        if url.path.endswith('/address/validate'):
+            address = parse_qs(url.query).get('address', [''])[0]
+            self._send_json(200, self.stub.record_validation(address))
+            return
+
+        self._send_json(404, {'message': 'Not found'})
+
+
+class MailgunStub:
+    """Controla o servidor falso do Mailgun em uma thread de fundo"""
+
+    DISPOSABLE_DOMAINS = ('mailinator.com', 'yopmail.com')
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0,
+                 max_payload_bytes: int = None, error_rate: float = 0.0, throttle_rate: float = 0.0,
+                 retry_after: float = None, seed: int = None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        # Fração dos POST /messages respondidos com 503 e com 429 (+ Retry-After), sorteados
+        # com semente fixa para que duas execuções vejam a mesma sequência de falhas
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        # POSTs maiores que isso são recusados com 413, como faz o Mailgun
+        self.max_payload_bytes = max_payload_bytes
+        self.payloads_rejected = 0
+        # Falhas a devolver nos próximos POST /messages: (status, Retry-After)
+        self.faults = deque()
+        self.faults_returned = 0
+        self.messages_received = 0
+        self.requests_received = 0
+        self.validations_received = 0
+        # Listas de supressão servidas em páginas, da entrada mais recente para a mais antiga
+        self.suppressions = {'bounces': [], 'unsubscribes': [], 'complaints': []}
+        # Eventos servidos por GET /events (ordem crescente de timestamp)
+        self.events = []
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """URL base a ser usada como MAILGUN_API_URL"""
+        return f'http://{self.host}:{self.port}'
+
+    def record_message(self, recipients: list, form: dict):
+        """Contabiliza um POST /messages recebido"""
+        with self._lock:
+            self.requests_received += 1
+            self.messages_received += len(recipients)
+
+    def inject_faults(self, *faults):
+        """Enfileira falhas para os próximos POST /messages (status ou (status, retry_after))"""
+        with self._lock:
+            for fault in faults:
+                self.faults.append(fault if isinstance(fault, tuple) else (fault, None))
+
+    def next_fault(self):
+        """Próxima falha injetada, se houver"""
+        with self._lock:
+            if not self.faults:
+                return None
+            self.requests_received += 1
+            self.faults_returned += 1
+            return self.faults.popleft()
+
+    def random_fault(self):
+        """Falha sorteada conforme error_rate e throttle_rate, se houver"""
+        if not self.error_rate and not self.throttle_rate:
+            return None
+        with self._lock:
+            draw = self._random.random()
+            if draw < self.throttle_rate:
+                fault = (429, self.retry_after)
+            elif draw < self.throttle_rate + self.error_rate:
+                fault = (503, None)
+            else:
+                return None
+            self.requests_received += 1
+            self.faults_returned += 1
+            return fault
+
+    def record_rejection(self):
+        """Contabiliza um POST /messages recusado pelo tamanho"""
+        with self._lock:
+            self.requests_received += 1
+            self.payloads_rejected += 1
+
+    def add_suppression(self, kind: str, address: str, created_at: float = None, **fields):
+        """Inclui um endereço no topo de uma lista de supressão"""
+        created = formatdate(created_at or time.time(), usegmt=True)
+        with self._lock:
+            self.suppressions[kind].insert(0, {'address': address, 'created_at': created, **fields})
+
+    def load_events(self, events: list):
+        """Carrega eventos no formato da API (ex: uma fixture gravada)"""
+        with self._lock:
+            self.events = sorted(self.events + list(events), key=lambda event: event['timestamp'])
+
+    def record_validation(self, address: str) -> dict:
+        """Responde a uma validação: 'invalid*' é inválido e DISPOSABLE_DOMAINS são descartáveis"""
+        with self._lock:
+            self.validations_received += 1
+
+        local, _, domain = address.partition('@')
+        undeliverable = local.startswith('invalid')
+        return {
+            'address': address,
+            'is_disposable_address': domain in self.DISPOSABLE_DOMAINS,
+            'is_role_address': local in ('admin', 'info', 'contato'),
+            'reason': ['mailbox_does_not_exist'] if undeliverable else [],
+            'result': 'undeliverable' if undeliverable else 'deliverable',
+            'risk': 'high' if undeliverable else 'low'
+        }
+
+    def start(self) -> str:
+        """Inicia o servidor e retorna sua URL"""
+        self._server = ThreadingHTTPServer((self.host, self.port), MailgunStubHandler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        """Encerra o servidor"""
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidor falso da API do Mailgun')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8025)
+    parser.add_argument('--latency', type=float, default=0.0, help='atraso por requisição (s)')
+    parser.add_argument('--max-payload', type=int, default=None, help='tamanho máximo do POST (bytes)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fração de envios com 503')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='fração de envios com 429')
+    parser.add_argument('--retry-after', type=float, default=None, help='Retry-After dos 429 (s)')
+    parser.add_argument('--seed', type=int, default=None, help='semente do sorteio das falhas')
+    args = parser.parse_args()
+
+    stub = MailgunStub(args.host, args.port, args.latency, args.max_payload,
+                       args.error_rate, args.throttle_rate, args.retry_after, args.seed)
+    print(f"📭 Mailgun falso rodando em {stub.start()}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stub.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,350 @@
+import bisect
+import inspect
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, Iterable, List, Optional
+
+from config import Config
+
+# Limites (em segundos) dos histogramas de latência
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 5000)
+
+
+class Metric:
+    """Valores de uma métrica neste processo, por combinação de labels"""
+
+    kind = None
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[tuple, object] = {}
+        # Um lock por métrica, segurado só durante a atualização de um número
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self) -> Dict[tuple, object]:
+        with self._lock:
+            return {key: list(value) if isinstance(value, list) else value
+                    for key, value in self._values.items()}
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def describe(self) -> Dict:
+        return {'kind': self.kind, 'help': self.help, 'labels': list(self.labels)}
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Valor instantâneo; shared=False para valores lidos do banco só pelo processo que responde /metrics"""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), shared: bool = True):
+        super().__init__(name, help, labels)
+        self.shared = shared
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (),
+                 buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        # Contagens por faixa (não acumuladas), a faixa +Inf e a soma no fim
+        index = bisect.bisect_left(self.buckets, value)
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Mede a duração do bloco"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def describe(self) -> Dict:
+        return {**super().describe(), 'buckets': list(self.buckets)}
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [
+        '{}="{}"'.format(name, str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"'))
+        for name, value in zip(names, values)
+    ]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class MetricsRegistry:
+    """Métricas do serviço no formato de texto do Prometheus.
+
+    Com METRICS_DIR definido (vários workers do gunicorn), cada processo grava periodicamente
+    os seus valores em um arquivo próprio e /metrics soma os arquivos de todos os processos.
+    """
+
+    def __init__(self, directory: str = None, flush_interval: float = None):
+        self.directory = Config.METRICS_DIR if directory is None else directory
+        self.flush_interval = flush_interval or Config.METRICS_FLUSH_SECONDS
+        self._metrics: Dict[str, Metric] = {}
+        self._flusher: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f'Métrica duplicada: {metric.name}')
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Iterable[str] = (), shared: bool = True) -> Gauge:
+        return self.register(Gauge(name, help, labels, shared))
+
+    def histogram(self, name: str, help: str, labels: Iterable[str] = (),
+                  buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def _path(self, pid: int) -> str:
+        return os.path.join(self.directory, f'metrics_{pid}.json')
+
+    def _state(self, shared_only: bool = False) -> Dict:
+        """Valores deste processo, serializáveis em JSON"""
+        state = {}
+        for metric in self._metrics.values():
+            if shared_only and isinstance(metric, Gauge) and not metric.shared:
+                continue
+            state[metric.name] = {
+                **metric.describe(),
+                'samples': [[list(key), value] for key, value in metric.samples().items()]
+            }
+        return state
+
+    def flush(self):
+        """Grava os valores deste processo no diretório compartilhado (escrita atômica)"""
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        pid = os.getpid()
+        path = self._path(pid)
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w') as state_file:
+            json.dump({'pid': pid, 'metrics': self._state(shared_only=True)}, state_file)
+        os.replace(temp_path, path)
+
+    def start(self):
+        """Inicia a gravação periódica (idempotente; sem METRICS_DIR não há o que gravar)"""
+        if not self.directory or (self._flusher and self._flusher.is_alive()):
+            return
+        self._stopping.clear()
+        self._flusher = threading.Thread(target=self._run, name='metrics-flush', daemon=True)
+        self._flusher.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._flusher:
+            self._flusher.join(self.flush_interval)
+            self._flusher = None
+        self.flush()
+
+    def _run(self):
+        while not self._stopping.wait(self.flush_interval):
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"Erro ao gravar métricas: {e}")
+
+    def _after_fork(self):
+        """No processo filho (worker do gunicorn) as contagens começam do zero"""
+        running = self._flusher is not None
+        self._flusher = None
+        for metric in self._metrics.values():
+            metric.reset()
+        if running:
+            self.start()
+
+    def _read_states(self) -> List[Dict]:
+        """Estados gravados pelos processos (o deste processo é lido da memória)"""
+        states = []
+        pid = os.getpid()
+        for name in os.listdir(self.directory):
+            if not name.startswith('metrics_') or not name.endswith('.json') or name == f'metrics_{pid}.json':
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as state_file:
+                    states.append(json.load(state_file))
+            except (OSError, ValueError):
+                # Arquivo removido ou sendo substituído no momento da leitura
+                continue
+        return states
+
+    def collect(self) -> Dict:
+        """Valores agregados de todos os processos: contadores e histogramas somados,
+        gauges compartilhados somados apenas entre os processos vivos"""
+        merged = self._state()
+        if not self.directory or not os.path.isdir(self.directory):
+            return merged
+
+        for state in self._read_states():
+            alive = _process_alive(state['pid'])
+            for name, metric in state['metrics'].items():
+                if metric['kind'] == 'gauge' and not alive:
+                    continue
+                target = merged.setdefault(name, {**metric, 'samples': []})
+                samples = {tuple(key): value for key, value in target['samples']}
+                for key, value in metric['samples']:
+                    key = tuple(key)
+                    if key not in samples:
+                        samples[key] = value
+                    elif isinstance(value, list):
+                        samples[key] = [a + b for a, b in zip(samples[key], value)]
+                    else:
+                        samples[key] += value
+                target['samples'] = [[list(key), value] for key, value in samples.items()]
+        return merged
+
+    def render(self) -> str:
+        """Texto no formato de exposição do Prometheus (text/plain; version=0.0.4)"""
+        lines = []
+        for name, metric in sorted(self.collect().items()):
+            lines.append(f'# HELP {name} {metric["help"]}')
+            lines.append(f'# TYPE {name} {metric["kind"]}')
+            for key, value in sorted(metric['samples']):
+                if metric['kind'] != 'histogram':
+                    lines.append(f'{name}{_format_labels(metric["labels"], key)} {_format_value(value)}')
+                    continue
+
+                cumulative = 0
+                bounds = [*metric['buckets'], math.inf]
+                for bound, count in zip(bounds, value):
+                    cumulative += count
+                    labels = _format_labels([*metric['labels'], 'le'], [*key, _format_value(float(bound))])
+                    lines.append(f'{name}_bucket{labels} {cumulative}')
+                labels = _format_labels(metric['labels'], key)
+                lines.append(f'{name}_sum{labels} {_format_value(value[-1])}')
+                lines.append(f'{name}_count{labels} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+def timed_methods(histogram: Histogram, errors: Counter, skip: Iterable[str] = ()):
+    """Decorador de classe: mede a duração e conta os erros de cada método público (label method)"""
+    def decorator(cls):
+        for name, member in list(vars(cls).items()):
+            if name.startswith('_') or name in skip or not inspect.isfunction(member):
+                continue
+            # Geradores e context managers só seriam medidos até o primeiro yield
+            if inspect.isgeneratorfunction(inspect.unwrap(member)):
+                continue
+            setattr(cls, name, _timed(member, histogram, errors))
+        return cls
+    return decorator
+
+
+def _timed(func, histogram: Histogram, errors: Counter):
+    method = func.__name__
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            errors.inc(method=method)
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - started, method=method)
+    return wrapper
+
+
+REGISTRY = MetricsRegistry()
+os.register_at_fork(after_in_child=REGISTRY._after_fork)
+
+MAILGUN_REQUEST_SECONDS = REGISTRY.histogram(
+    'mailgun_request_duration_seconds', 'Duração das requisições à API do Mailgun', ('endpoint', 'status')
+)
+MAILGUN_BATCH_RECIPIENTS = REGISTRY.histogram(
+    'mailgun_batch_recipients', 'Destinatários por lote enviado ao Mailgun', buckets=SIZE_BUCKETS
+)
+DISPATCH_BATCHES = REGISTRY.counter(
+    'dispatch_batches_total', 'Lotes processados pelo despachante por resultado', ('result',)
+)
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    'db_query_duration_seconds', 'Duração dos métodos de Database', ('method',)
+)
+DB_ERRORS = REGISTRY.counter(
+    'db_errors_total', 'Exceções nos métodos de Database', ('method',)
+)
+WEBHOOK_EVENTS = REGISTRY.counter(
+    'webhook_events_total', 'Eventos de webhook recebidos por resultado', ('outcome',)
+)
+WEBHOOK_FLUSH_SECONDS = REGISTRY.histogram(
+    'webhook_flush_duration_seconds', 'Duração da gravação de cada lote de eventos de webhook'
+)
+WEBHOOK_QUEUE_DEPTH = REGISTRY.gauge(
+    'webhook_queue_depth', 'Eventos de webhook aguardando gravação (soma dos processos)'
+)
+IMPORT_ROWS = REGISTRY.counter(
+    'contact_import_rows_total', 'Linhas de CSV importadas por resultado', ('result',)
+)
+IMPORT_SECONDS = REGISTRY.histogram(
+    'contact_import_duration_seconds', 'Duração das importações de CSV',
+    buckets=(0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+)
+SEND_QUEUE_JOBS = REGISTRY.gauge(
+    'send_queue_jobs', 'Lotes na fila persistente de envio por status', ('status',), shared=False
+)
+ERRORS = REGISTRY.counter(
+    'errors_total', 'Erros registrados pelos componentes em segundo plano', ('component',)
+)
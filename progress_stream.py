@@ -0,0 +1,311 @@
+import json
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Iterator, List, Optional
+
+from config import Config
+
+
+def sse_message(event: str, data: Dict) -> str:
+    """Formata um evento no protocolo Server-Sent Events"""
+    return f'event: {event}\ndata: {json.dumps(data, default=str)}\n\n'
+
+
+class CampaignProgress:
+    """Andamento de uma campanha mantido em memória a partir dos resultados dos lotes"""
+
+    # Peso da última medição na média móvel da vazão
+    RATE_SMOOTHING = 0.3
+
+    def __init__(self, campaign_id: int, batches_total: int = 0, batches_done: int = 0,
+                 batches_failed: int = 0):
+        self.campaign_id = campaign_id
+        self.batches_total = batches_total
+        self.batches_done = batches_done
+        self.batches_failed = batches_failed
+        self.recipients_sent = 0
+        self.recipients_failed = 0
+        self.started = time.monotonic()
+        self._last_batch = None
+        self._batch_rate = None  # lotes por segundo (média móvel)
+        self._recipient_rate = None
+
+    @property
+    def finished(self) -> bool:
+        return self.batches_total > 0 and self.batches_done + self.batches_failed >= self.batches_total
+
+    def reseed(self, batches_total: int, batches_done: int, batches_failed: int) -> bool:
+        """Adota as contagens da fila persistente (que incluem lotes de outros processos); True se mudaram"""
+        counts = (batches_total, batches_done, batches_failed)
+        if counts == (self.batches_total, self.batches_done, self.batches_failed):
+            return False
+        self.batches_total, self.batches_done, self.batches_failed = counts
+        return True
+
+    def record(self, recipients: int, success: bool):
+        """Conta um lote finalizado e atualiza a vazão"""
+        if success:
+            self.batches_done += 1
+            self.recipients_sent += recipients
+        else:
+            self.batches_failed += 1
+            self.recipients_failed += recipients
+
+        now = time.monotonic()
+        elapsed = now - (self._last_batch or self.started)
+        self._last_batch = now
+        if elapsed > 0:
+            self._batch_rate = self._smooth(self._batch_rate, 1 / elapsed)
+            self._recipient_rate = self._smooth(self._recipient_rate, recipients / elapsed)
+
+    def _smooth(self, current: Optional[float], sample: float) -> float:
+        if current is None:
+            return sample
+        return current + self.RATE_SMOOTHING * (sample - current)
+
+    def snapshot(self) -> Dict:
+        """Contagens, vazão (emails por minuto) e estimativa de término"""
+        finished = self.batches_done + self.batches_failed
+        remaining = max(self.batches_total - finished, 0)
+        if not remaining:
+            eta = 0
+        else:
+            eta = remaining / self._batch_rate if self._batch_rate else None
+        return {
+            'campaign_id': self.campaign_id,
+            'batches_total': self.batches_total,
+            'batches_done': self.batches_done,
+            'batches_failed': self.batches_failed,
+            'batches_remaining': remaining,
+            'recipients_sent': self.recipients_sent,
+            'recipients_failed': self.recipients_failed,
+            'progress': finished / self.batches_total * 100 if self.batches_total else 0,
+            'throughput_per_minute': round(self._recipient_rate * 60, 1) if self._recipient_rate else 0,
+            'eta_seconds': round(eta, 1) if eta is not None else None
+        }
+
+
+class Subscription:
+    """Assinante de uma campanha, com buffer limitado; quem não consome a tempo é desconectado"""
+
+    def __init__(self, broker: 'ProgressBroker', campaign_id: int, max_buffer: int):
+        self.broker = broker
+        self.campaign_id = campaign_id
+        self.max_buffer = max_buffer
+        self.dropped = False
+        self.closed = False
+        self._messages = deque()
+        self._cond = threading.Condition()
+
+    def push(self, message: str) -> bool:
+        """Enfileira um evento; False se o buffer encheu (o assinante é descartado)"""
+        with self._cond:
+            if self.closed:
+                return False
+            if len(self._messages) >= self.max_buffer:
+                self.dropped = True
+                self.closed = True
+                self._messages.clear()
+                self._cond.notify()
+                return False
+            self._messages.append(message)
+            self._cond.notify()
+            return True
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+
+    def stream(self, heartbeat: float = None) -> Iterator[str]:
+        """Gera as mensagens SSE até a campanha terminar, o assinante ser descartado ou o cliente sair"""
+        heartbeat = heartbeat or Config.PROGRESS_HEARTBEAT_SECONDS
+        try:
+            while True:
+                with self._cond:
+                    if not self._messages and not self.closed:
+                        self._cond.wait(heartbeat)
+                    messages = list(self._messages)
+                    self._messages.clear()
+                    closed, dropped = self.closed, self.dropped
+
+                if not messages and not closed:
+                    # Parado: relê o andamento do banco, que pode ter avançado em outro processo
+                    self.broker.refresh(self.campaign_id, heartbeat)
+                for message in messages:
+                    yield message
+                if dropped:
+                    # O EventSource reconecta sozinho e recebe um novo snapshot
+                    yield sse_message('dropped', {'reason': 'slow_consumer'})
+                    return
+                if closed:
+                    return
+                if not messages:
+                    # Comentário SSE: mantém a conexão viva e detecta clientes desconectados
+                    yield ': keepalive\n\n'
+        finally:
+            self.broker.unsubscribe(self)
+
+
+class ProgressBroker:
+    """Publica o andamento dos envios para os assinantes de cada campanha; os eventos de lote saem
+    deste processo e as contagens são conferidas na fila persistente a cada heartbeat"""
+
+    def __init__(self, max_buffer: int = None):
+        self.max_buffer = max_buffer or Config.PROGRESS_BUFFER_SIZE
+        self._subscribers: Dict[int, List[Subscription]] = {}
+        self._progress: Dict[int, CampaignProgress] = {}
+        self._loaders: Dict[int, Callable[[], Dict]] = {}
+        self._refreshed: Dict[int, float] = {}
+        self._lock = threading.Lock()
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, campaign_id: int, load_snapshot: Callable[[], Dict] = None) -> Subscription:
+        """Novo assinante; recebe primeiro o estado atual (lido do banco só se a campanha ainda não é acompanhada)"""
+        subscription = Subscription(self, campaign_id, self.max_buffer)
+        with self._lock:
+            progress = self._progress.get(campaign_id)
+
+        if progress is None and load_snapshot is not None:
+            snapshot = load_snapshot()
+            loaded = CampaignProgress(
+                campaign_id, snapshot['batches_total'], snapshot['batches_done'], snapshot['batches_failed']
+            )
+            with self._lock:
+                progress = self._progress.setdefault(campaign_id, loaded)
+
+        with self._lock:
+            self._subscribers.setdefault(campaign_id, []).append(subscription)
+            if load_snapshot is not None:
+                self._loaders[campaign_id] = load_snapshot
+
+        state = progress.snapshot() if progress else {'campaign_id': campaign_id}
+        subscription.push(sse_message('snapshot', state))
+        if progress and progress.finished:
+            subscription.push(sse_message('completed', state))
+            subscription.close()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.campaign_id, [])
+            if subscription in subscribers:
+                subscribers.remove(subscription)
+            if not subscribers:
+                self._subscribers.pop(subscription.campaign_id, None)
+                self._loaders.pop(subscription.campaign_id, None)
+                self._refreshed.pop(subscription.campaign_id, None)
+
+    def subscriber_count(self, campaign_id: int = None) -> int:
+        with self._lock:
+            if campaign_id is not None:
+                return len(self._subscribers.get(campaign_id, ()))
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def publish(self, campaign_id: int, event: str, data: Dict):
+        """Entrega o evento a todos os assinantes da campanha sem bloquear o envio"""
+        with self._lock:
+            subscribers = list(self._subscribers.get(campaign_id, ()))
+        if not subscribers:
+            return
+
+        message = sse_message(event, data)
+        for subscription in subscribers:
+            if not subscription.push(message):
+                if subscription.dropped:
+                    self.dropped += 1
+                self.unsubscribe(subscription)
+        self.published += 1
+
+    def batches_queued(self, campaign_id: int, count: int):
+        """Lotes agendados para a campanha (novo envio ou reenvio de dead letters)"""
+        with self._lock:
+            progress = self._progress.get(campaign_id)
+            if progress is None or progress.finished:
+                progress = self._progress[campaign_id] = CampaignProgress(campaign_id)
+            progress.batches_total += count
+            state = progress.snapshot()
+        self.publish(campaign_id, 'queued', {'batches_queued': count, **state})
+
+    def batch_finished(self, campaign_id: int, batch_number: int, result: Dict, retry_in: float = None):
+        """Resultado de um lote: enviado, reagendado ou com falha definitiva"""
+        recipients = result.get('recipients_count', 0)
+        event = {'batch_number': batch_number, 'recipients': recipients}
+        if result['success']:
+            name = 'batch_dispatched'
+            event['message_id'] = result.get('message_id')
+        else:
+            name = 'batch_failed'
+            event.update({
+                'error_class': result.get('error_class'),
+                'error': result.get('error'),
+                'retry_in': retry_in
+            })
+
+        with self._lock:
+            progress = self._progress.setdefault(campaign_id, CampaignProgress(campaign_id))
+            # Um lote reagendado ainda não terminou
+            if retry_in is None:
+                progress.record(recipients, result['success'])
+            state = progress.snapshot()
+            finished = progress.finished
+            load_snapshot = self._loaders.get(campaign_id)
+
+        if finished and load_snapshot is not None:
+            # As contagens em memória podem estar à frente do banco por um lote: confirma o fim na fila
+            state, finished, _ = self._reseed(campaign_id, load_snapshot())
+
+        self.publish(campaign_id, name, event)
+        self.publish(campaign_id, 'progress', state)
+        if finished:
+            self._complete(campaign_id, state)
+
+    def refresh(self, campaign_id: int, interval: float):
+        """Relê o andamento da fila persistente (no máximo uma vez por intervalo por campanha);
+        publica progress se mudou e completed quando todos os jobs da campanha terminaram"""
+        now = time.monotonic()
+        with self._lock:
+            load_snapshot = self._loaders.get(campaign_id)
+            last = self._refreshed.get(campaign_id)
+            if load_snapshot is None or (last is not None and now - last < interval / 2):
+                return
+            self._refreshed[campaign_id] = now
+
+        state, finished, changed = self._reseed(campaign_id, load_snapshot())
+        if changed:
+            self.publish(campaign_id, 'progress', state)
+        if finished:
+            self._complete(campaign_id, state)
+
+    def _reseed(self, campaign_id: int, snapshot: Dict):
+        """Aplica as contagens lidas do banco; retorna (estado, terminou, mudou)"""
+        with self._lock:
+            progress = self._progress.setdefault(campaign_id, CampaignProgress(campaign_id))
+            changed = progress.reseed(
+                snapshot['batches_total'], snapshot['batches_done'], snapshot['batches_failed']
+            )
+            return progress.snapshot(), progress.finished, changed
+
+    def _complete(self, campaign_id: int, state: Dict):
+        """Fim do envio: encerra os streams (o cliente fecha o EventSource ao receber completed)"""
+        self.publish(campaign_id, 'completed', state)
+        with self._lock:
+            subscribers = self._subscribers.pop(campaign_id, [])
+            self._loaders.pop(campaign_id, None)
+            self._refreshed.pop(campaign_id, None)
+        for subscription in subscribers:
+            subscription.close()
+
+    def batch_deferred(self, campaign_id: int, batch_number: int, reason: str, retry_in: float):
+        """Lote devolvido à fila sem envio (circuito aberto ou cota do dia esgotada)"""
+        self.publish(campaign_id, 'batch_deferred', {
+            'batch_number': batch_number, 'reason': reason, 'retry_in': round(retry_in, 1)
+        })
+
+    def progress(self, campaign_id: int) -> Optional[Dict]:
+        """Andamento em memória da campanha (None se não acompanhada por este processo)"""
+        with self._lock:
+            progress = self._progress.get(campaign_id)
+            return progress.snapshot() if progress else None
@@ -0,0 +1,103 @@
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from config import Config
+from database import Database
+
+
+class QuotaReservation:
+    """Envios reservados na cota diária, pendentes de confirmação"""
+
+    __slots__ = ('reservation_id', 'day', 'amount')
+
+    def __init__(self, reservation_id: int, day: str, amount: int):
+        self.reservation_id = reservation_id
+        self.day = day
+        self.amount = amount
+
+
+class DailyQuota:
+    """Cota diária de envios compartilhada entre processos via SQLite"""
+
+    def __init__(self, db: Database, daily_limit: int = None, utc_offset_hours: float = None):
+        self.db = db
+        self.daily_limit = daily_limit or Config.MAX_EMAILS_PER_DAY
+        self.utc_offset = timedelta(hours=(
+            Config.UTC_OFFSET_HOURS if utc_offset_hours is None else utc_offset_hours
+        ))
+
+    def _local_now(self) -> datetime:
+        return datetime.utcnow() + self.utc_offset
+
+    def today(self) -> str:
+        """Dia corrente da cota (no fuso configurado)"""
+        return self._local_now().date().isoformat()
+
+    def seconds_until_reset(self) -> float:
+        """Segundos até a virada do dia da cota"""
+        now = self._local_now()
+        tomorrow = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+        return (tomorrow - now).total_seconds()
+
+    def reserve(self, amount: int, holder: str = None) -> Optional[QuotaReservation]:
+        """Reserva envios antes de um lote sair; None se a cota do dia não comporta"""
+        day = self.today()
+        reservation_id = self.db.reserve_send_quota(day, amount, self.daily_limit, holder, time.time())
+        if reservation_id is None:
+            return None
+        return QuotaReservation(reservation_id, day, amount)
+
+    def commit(self, reservation: QuotaReservation, used: int = None):
+        """Confirma os envios realizados; a parte não usada volta para a cota"""
+        used = reservation.amount if used is None else min(used, reservation.amount)
+        self.db.settle_send_quota(reservation.reservation_id, reservation.day, used)
+
+    def refund(self, reservation: QuotaReservation):
+        """Devolve toda a reserva (lote falhou ou não foi enviado)"""
+        self.commit(reservation, 0)
+
+    def expire_stale(self, max_age: float) -> int:
+        """Libera reservas de processos que não as confirmaram a tempo"""
+        return self.db.expire_send_quota_reservations(max_age, time.time())
+
+    def usage(self) -> Dict:
+        """Uso da cota do dia"""
+        day = self.today()
+        quota = self.db.get_send_quota(day)
+        return {
+            'day': day,
+            'sent': quota['sent'],
+            'reserved': quota['reserved'],
+            'limit': self.daily_limit,
+            'remaining': max(0, self.daily_limit - quota['sent'] - quota['reserved'])
+        }
+
+    def can_send(self) -> bool:
+        """Verifica se ainda resta cota no dia"""
+        return self.usage()['remaining'] > 0
+
+
+class SharedTokenBucket:
+    """Limite de taxa no formato token bucket, com saldo compartilhado entre processos"""
+
+    def __init__(self, db: Database, name: str, rate_per_sec: float, capacity: float):
+        self.db = db
+        self.name = name
+        self.rate = rate_per_sec
+        self.capacity = capacity
+
+    def reserve(self, amount: float) -> float:
+        """Reserva tokens e retorna quantos segundos esperar antes de usá-los"""
+        tokens = self.db.take_rate_tokens(self.name, amount, self.rate, self.capacity, time.time())
+        if tokens >= 0:
+            return 0.0
+        return -tokens / self.rate
+
+    def available(self) -> float:
+        """Tokens disponíveis no momento"""
+        bucket = self.db.get_rate_bucket(self.name)
+        if bucket is None:
+            return self.capacity
+        elapsed = max(time.time() - bucket['updated'], 0)
+        return min(self.capacity, bucket['tokens'] + elapsed * self.rate)
@@ -0,0 +1,111 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Callable, Dict, Optional, Union
+
+from flask import Response, make_response, request
+
+from config import Config
+from database import DataVersions
+
+
+class CachedResponse:
+    """Corpo de uma resposta já serializada e o seu ETag"""
+
+    __slots__ = ('body', 'mimetype', 'etag', 'expires')
+
+    def __init__(self, body: bytes, mimetype: str, expires: float):
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = hashlib.blake2b(body, digest_size=8).hexdigest()
+        self.expires = expires
+
+
+class ResponseCache:
+    """Cache em memória das respostas dos endpoints de leitura, com ETag, TTL e descarte LRU.
+
+    A chave inclui a versão dos grupos de dados de que a resposta depende (DataVersions):
+    uma escrita muda a versão e as entradas antigas deixam de ser encontradas.
+    """
+
+    def __init__(self, versions: DataVersions, ttl: float = None, max_entries: int = None):
+        self.versions = versions
+        self.ttl = Config.RESPONSE_CACHE_TTL_SECONDS if ttl is None else ttl
+        self.max_entries = max_entries or Config.RESPONSE_CACHE_MAX_ENTRIES
+        self._entries: 'OrderedDict[tuple, CachedResponse]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def get(self, key: tuple) -> Optional[CachedResponse]:
+        """Entrada ainda válida para a chave (e a marca como usada recentemente)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires <= time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: tuple, body: bytes, mimetype: str) -> CachedResponse:
+        """Guarda a resposta, descartando as menos usadas além do limite"""
+        entry = CachedResponse(body, mimetype, time.monotonic() + self.ttl)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        """Tamanho e taxa de acertos do cache"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'not_modified': self.not_modified
+            }
+
+    def cached(self, *groups: Union[str, Callable[..., str]]):
+        """Decorador de rota GET; groups são os grupos de dados da resposta (ou funções dos argumentos da rota)"""
+        def decorator(view):
+            @wraps(view)
+            def wrapper(**kwargs):
+                if self.ttl <= 0:
+                    return view(**kwargs)
+
+                names = [group(**kwargs) if callable(group) else group for group in groups]
+                key = (request.full_path, self.versions.get(*names))
+                entry = self.get(key)
+                if entry is None:
+                    response = make_response(view(**kwargs))
+                    # Erros e respostas em streaming não entram no cache
+                    if response.status_code != 200 or response.is_streamed:
+                        return response
+                    entry = self.put(key, response.get_data(), response.mimetype)
+
+                response = Response(entry.body, mimetype=entry.mimetype)
+                response.set_etag(entry.etag)
+                # O navegador guarda a resposta, mas sempre revalida com If-None-Match
+                response.headers['Cache-Control'] = 'no-cache'
+                response = response.make_conditional(request)
+                if response.status_code == 304:
+                    self.not_modified += 1
+                return response
+            return wrapper
+        return decorator
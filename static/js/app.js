@@ -152,6 +152,9 @@ document.getElementById('send-form').addEventListener('submit', async (e) => {
         
         if (result.success) {
             showAlert('send-alert', result.message, 'success');
+            if (result.events_url) {
+                watchSendProgress(result.events_url);
+            }
             document.getElementById('send-form').reset();
             document.getElementById('send-campaign').innerHTML = '<option value="">Selecione uma campanha...</option>';
             loadCampaignsForSend();
@@ -165,6 +168,40 @@ document.getElementById('send-form').addEventListener('submit', async (e) => {
     }
 });
 
+// Acompanhar o envio em tempo real (Server-Sent Events)
+let sendProgressSource = null;
+
+function watchSendProgress(eventsUrl) {
+    if (sendProgressSource) {
+        sendProgressSource.close();
+    }
+    
+    const container = document.getElementById('send-progress');
+    const source = new EventSource(eventsUrl);
+    sendProgressSource = source;
+    
+    const render = (event) => {
+        const state = JSON.parse(event.data);
+        if (state.batches_total === undefined) {
+            return;
+        }
+        const eta = state.eta_seconds === null ? '—' : `${Math.ceil(state.eta_seconds / 60)} min`;
+        container.innerHTML = `
+            <p><strong>Progresso:</strong> ${state.progress.toFixed(1)}%
+                (${state.batches_done + state.batches_failed}/${state.batches_total} lotes, ${state.batches_failed} com falha)</p>
+            <p><strong>Vazão:</strong> ${state.throughput_per_minute} emails/min | <strong>Término estimado:</strong> ${eta}</p>
+        `;
+    };
+    
+    // Se o servidor descartar a conexão (cliente lento), o EventSource reconecta e recebe um novo snapshot
+    ['snapshot', 'queued', 'progress'].forEach(name => source.addEventListener(name, render));
+    source.addEventListener('completed', (event) => {
+        render(event);
+        source.close();
+        loadStats();
+    });
+}
+
 // Carregar campanhas
 async function loadCampaigns() {
     try {
@@ -309,39 +346,55 @@ async function deactivateBatch(batchId) {
     }
 }
 
+// Linha da tabela de contatos de um lote
+function contactRow(contact) {
+    let html = '<tr>';
+    html += '<td>' + contact.id + '</td>';
+    html += '<td>' + (contact.name || '-') + '</td>';
+    html += '<td>' + contact.email + '</td>';
+    html += '<td>' + (contact.company || '-') + '</td>';
+    html += '<td>' + contact.status + '</td>';
+    html += '<td>';
+    if (contact.status !== 'active') {
+        html += '<button class="btn btn-secondary" onclick="updateContactStatus(' + contact.id + ', \'active\')">Ativo</button> ';
+    }
+    if (contact.status !== 'inactive') {
+        html += '<button class="btn btn-warning" onclick="updateContactStatus(' + contact.id + ', \'inactive\')">Inativo</button> ';
+    }
+    html += '<button class="btn btn-danger" onclick="deleteContact(' + contact.id + ')">Excluir</button>';
+    html += '</td>';
+    html += '</tr>';
+    return html;
+}
+
+const CONTACTS_PAGE_SIZE = 100;
+
+// Busca uma página de contatos do lote (paginação por cursor)
+async function fetchContactsPage(batchId, cursor) {
+    const params = new URLSearchParams({ limit: CONTACTS_PAGE_SIZE });
+    if (cursor) {
+        params.set('after', cursor);
+    }
+    const response = await fetch(`/contacts/batches/${batchId}?${params}`);
+    return response.json();
+}
+
 // Função para visualizar contatos de um lote
 async function viewContacts(batchId) {
     document.getElementById('batches-loading').style.display = 'block';
     try {
-        const response = await fetch(`/contacts/batches/${batchId}`);
-        const result = await response.json();
+        const result = await fetchContactsPage(batchId, null);
         if (result.success) {
             const contacts = result.contacts;
             let html = '<h3>Contatos do Lote ' + batchId + '</h3>';
             html += '<div style="margin-bottom: 20px;">';
-            html += '<button class="btn btn-primary" onclick="showAddContactForm(\'' + batchId + '\')">➕ Adicionar Contato</button>';
+            html += '<button class="btn btn-primary" onclick="showAddContactForm(\'' + batchId + '\')">➕ Adicionar Contato</button> ';
+            html += '<a class="btn btn-secondary" href="/contacts/batches/' + batchId + '?format=csv">⬇️ Exportar CSV</a>';
             html += '</div>';
             if (contacts.length > 0) {
-                html += '<table>';
+                html += '<table id="batch-contacts-table">';
                 html += '<tr><th>ID</th><th>Nome</th><th>Email</th><th>Empresa</th><th>Status</th><th>Ações</th></tr>';
-                contacts.forEach(contact => {
-                    html += '<tr>';
-                    html += '<td>' + contact.id + '</td>';
-                    html += '<td>' + (contact.name || '-') + '</td>';
-                    html += '<td>' + contact.email + '</td>';
-                    html += '<td>' + (contact.company || '-') + '</td>';
-                    html += '<td>' + contact.status + '</td>';
-                    html += '<td>';
-                    if (contact.status !== 'active') {
-                        html += '<button class="btn btn-secondary" onclick="updateContactStatus(' + contact.id + ', \'active\')">Ativo</button> ';
-                    }
-                    if (contact.status !== 'inactive') {
-                        html += '<button class="btn btn-warning" onclick="updateContactStatus(' + contact.id + ', \'inactive\')">Inativo</button> ';
-                    }
-                    html += '<button class="btn btn-danger" onclick="deleteContact(' + contact.id + ')">Excluir</button>';
-                    html += '</td>';
-                    html += '</tr>';
-                });
+                html += contacts.map(contactRow).join('');
                 html += '</table>';
             } else {
                 html += '<p>Nenhum contato encontrado neste lote.</p>';
@@ -355,12 +408,40 @@ async function viewContacts(batchId) {
             modalContent.className = 'modal-content';
             modalContent.innerHTML = html;
             
+            // Carrega as próximas páginas sob demanda
+            let nextCursor = result.next_cursor;
+            const moreBtn = document.createElement('button');
+            moreBtn.textContent = 'Carregar mais';
+            moreBtn.className = 'btn';
+            moreBtn.style.marginTop = '20px';
+            moreBtn.style.display = nextCursor ? 'inline-block' : 'none';
+            moreBtn.onclick = async () => {
+                moreBtn.disabled = true;
+                try {
+                    const page = await fetchContactsPage(batchId, nextCursor);
+                    if (!page.success) {
+                        showAlert('batches-alert', 'Erro ao carregar contatos: ' + page.error, 'error');
+                        return;
+                    }
+                    modalContent.querySelector('#batch-contacts-table')
+                        .insertAdjacentHTML('beforeend', page.contacts.map(contactRow).join(''));
+                    nextCursor = page.next_cursor;
+                    moreBtn.style.display = nextCursor ? 'inline-block' : 'none';
+                } catch (error) {
+                    showAlert('batches-alert', 'Erro de conexão ao carregar contatos: ' + error.message, 'error');
+                } finally {
+                    moreBtn.disabled = false;
+                }
+            };
+            
             const closeBtn = document.createElement('button');
             closeBtn.textContent = 'Fechar';
             closeBtn.className = 'btn btn-secondary';
             closeBtn.style.marginTop = '20px';
+            closeBtn.style.marginLeft = '10px';
             closeBtn.onclick = () => document.body.removeChild(modal);
             
+            modalContent.appendChild(moreBtn);
             modalContent.appendChild(closeBtn);
             modal.appendChild(modalContent);
             document.body.appendChild(modal);
@@ -539,7 +620,7 @@ async function loadStats() {
         
         if (result.success) {
             document.getElementById('daily-sent').textContent = result.stats.emails_sent_today || 0;
-            document.getElementById('daily-limit').textContent = result.stats.daily_limit || 10000;
+            document.getElementById('daily-limit').textContent = result.stats.daily_limit;
             document.getElementById('total-contacts').textContent = result.stats.total_contacts || 0;
             document.getElementById('total-campaigns').textContent = result.stats.total_campaigns || 0;
         }
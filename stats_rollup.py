@@ -0,0 +1,82 @@
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Tuple
+
+from config import Config
+from database import Database, ROLLUP_EVENTS
+
+HOUR_FORMAT = '%Y-%m-%d %H:00'
+
+# Maior intervalo aceito por consulta, em dias, para cada granularidade
+MAX_RANGE_DAYS = {'day': 366, 'hour': 31}
+
+
+class StatsRollup:
+    """Estatísticas por hora e por dia no fuso configurado, lidas dos resumos de stats_hourly"""
+
+    def __init__(self, db: Database, utc_offset_hours: float = None):
+        self.db = db
+        self.utc_offset = timedelta(hours=(
+            Config.UTC_OFFSET_HOURS if utc_offset_hours is None else utc_offset_hours
+        ))
+
+    def today(self) -> date:
+        """Dia corrente no fuso configurado"""
+        return (datetime.utcnow() + self.utc_offset).date()
+
+    def _utc_hour(self, day: date) -> datetime:
+        """Primeira hora cheia em UTC que pertence ao dia local (fusos de meia hora arredondam para cima)"""
+        start = datetime.combine(day, datetime.min.time()) - self.utc_offset
+        if start.minute or start.second or start.microsecond:
+            start = start.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+        return start
+
+    def window(self, start: date, end: date) -> Tuple[str, str]:
+        """Intervalo [início, fim) de horas em UTC que cobre os dias locais de start a end"""
+        return (
+            self._utc_hour(start).strftime(HOUR_FORMAT),
+            self._utc_hour(end + timedelta(days=1)).strftime(HOUR_FORMAT)
+        )
+
+    def daily(self, day: date = None) -> Dict:
+        """Envios e eventos do dia (hoje por padrão) e os contadores do painel"""
+        day = day or self.today()
+        stats = self.db.get_daily_stats(*self.window(day, day))
+        stats['day'] = day.isoformat()
+        return stats
+
+    def series(self, start: date, end: date, granularity: str = 'day', campaign_id: int = None) -> List[Dict]:
+        """Série contínua (buckets sem eventos aparecem zerados) entre dois dias locais"""
+        if granularity not in MAX_RANGE_DAYS:
+            raise ValueError('Granularidade inválida (use day ou hour)')
+        if end < start:
+            raise ValueError('A data final é anterior à inicial')
+        if (end - start).days + 1 > MAX_RANGE_DAYS[granularity]:
+            raise ValueError(f'Intervalo maior que {MAX_RANGE_DAYS[granularity]} dias')
+
+        start_hour, end_hour = self.window(start, end)
+        buckets = {}
+        if granularity == 'day':
+            for offset in range((end - start).days + 1):
+                buckets[(start + timedelta(days=offset)).isoformat()] = {}
+        else:
+            hour = datetime.strptime(start_hour, HOUR_FORMAT)
+            while hour.strftime(HOUR_FORMAT) < end_hour:
+                buckets[self._label(hour, granularity)] = {}
+                hour += timedelta(hours=1)
+
+        for hour, event, count in self.db.get_hourly_stats(start_hour, end_hour, campaign_id):
+            label = self._label(datetime.strptime(hour, HOUR_FORMAT), granularity)
+            counts = buckets[label]
+            counts[event] = counts.get(event, 0) + count
+
+        return [
+            {'bucket': label, **{event: counts.get(event, 0) for event, _ in ROLLUP_EVENTS}}
+            for label, counts in buckets.items()
+        ]
+
+    def _label(self, utc_hour: datetime, granularity: str) -> str:
+        """Rótulo do bucket no horário local: o dia ou a hora"""
+        local = utc_hour + self.utc_offset
+        if granularity == 'day':
+            return local.date().isoformat()
+        return local.isoformat(timespec='minutes')
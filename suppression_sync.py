@@ -0,0 +1,152 @@
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterable, List, Optional
+
+from config import Config
+from contact_import import normalize_email
+from database import Database
+from mailgun_client import MailgunClient
+from metrics import ERRORS
+
+# Lista de supressão do Mailgun -> (motivo gravado, status aplicado ao contato)
+SUPPRESSION_LISTS = {
+    'bounces': ('bounce', 'bounced'),
+    'unsubscribes': ('unsubscribe', 'unsubscribed'),
+    'complaints': ('complaint', 'complained')
+}
+
+
+def parse_created_at(value: Optional[str]) -> Optional[float]:
+    """Converte o created_at do Mailgun ('Fri, 21 Oct 2011 11:02:55 UTC') em epoch"""
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+class SuppressionIndex:
+    """Conjunto em memória dos emails suprimidos, para consulta O(1) no envio"""
+
+    def __init__(self, db: Database, refresh_seconds: float = None):
+        self.db = db
+        self.refresh_seconds = refresh_seconds or Config.SUPPRESSION_REFRESH_SECONDS
+        self._emails = frozenset()
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Recarrega o índice do banco (inclui supressões gravadas por outros processos)"""
+        emails = frozenset(self.db.get_suppressed_emails())
+        with self._lock:
+            self._emails = emails
+            self._loaded_at = time.monotonic()
+
+    def _ensure_fresh(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.refresh_seconds:
+            self.refresh()
+
+    def __contains__(self, email: str) -> bool:
+        self._ensure_fresh()
+        return normalize_email(email) in self._emails
+
+    def __len__(self) -> int:
+        self._ensure_fresh()
+        return len(self._emails)
+
+    def filter_contacts(self, contacts: List[Dict]) -> List[Dict]:
+        """Remove os contatos suprimidos de uma lista"""
+        self._ensure_fresh()
+        emails = self._emails
+        return [contact for contact in contacts if normalize_email(contact['email']) not in emails]
+
+
+class SuppressionSync:
+    """Sincroniza incrementalmente as listas de supressão do Mailgun com os contatos.
+
+    A parada antecipada supõe que o Mailgun lista cada supressão da entrada mais recente para a
+    mais antiga: a primeira entrada anterior ao checkpoint encerra a leitura das páginas.
+    """
+
+    def __init__(self, db: Database, mailgun: MailgunClient, index: SuppressionIndex = None,
+                 page_size: int = None):
+        self.db = db
+        self.mailgun = mailgun
+        self.index = index
+        self.page_size = page_size or Config.SUPPRESSION_PAGE_SIZE
+
+    @staticmethod
+    def checkpoint_name(kind: str) -> str:
+        return f'suppressions:{kind}'
+
+    def _fetch_new(self, kind: str, since: Optional[float], full: bool) -> Dict:
+        """Percorre as páginas até alcançar entradas já sincronizadas"""
+        entries = {}
+        pages = 0
+        fetched = 0
+        newest = since
+
+        for items in self.mailgun.iter_suppressions(kind, limit=self.page_size):
+            pages += 1
+            fetched += len(items)
+            reached_checkpoint = False
+
+            for item in items:
+                email = normalize_email(item.get('address'))
+                created_at = parse_created_at(item.get('created_at'))
+                if not email:
+                    continue
+                # Entradas do mesmo segundo do checkpoint são regravadas (upsert)
+                if since is not None and created_at is not None and created_at < since:
+                    reached_checkpoint = True
+                    continue
+
+                details = item.get('error') or item.get('code') or ','.join(item.get('tags') or [])
+                entries[email] = (email, created_at, str(details) if details else None)
+                if created_at is not None and (newest is None or created_at > newest):
+                    newest = created_at
+
+            # As listas vêm da entrada mais recente para a mais antiga
+            if reached_checkpoint and not full:
+                break
+
+        return {'entries': list(entries.values()), 'pages': pages, 'fetched': fetched, 'newest': newest}
+
+    def sync_list(self, kind: str, full: bool = False) -> Dict:
+        """Sincroniza uma lista de supressão e aplica as mudanças aos contatos"""
+        reason, status = SUPPRESSION_LISTS[kind]
+        name = self.checkpoint_name(kind)
+        checkpoint = None if full else self.db.get_sync_checkpoint(name)
+        since = float(checkpoint) if checkpoint else None
+
+        result = self._fetch_new(kind, since, full)
+        newest = result['newest']
+        updated = self.db.apply_suppressions(
+            reason, status, result['entries'], name,
+            str(newest) if newest is not None else checkpoint
+        )
+
+        return {
+            'pages': result['pages'],
+            'fetched': result['fetched'],
+            'new_entries': len(result['entries']),
+            'contacts_updated': updated
+        }
+
+    def sync(self, kinds: Iterable[str] = None, full: bool = False) -> Dict:
+        """Sincroniza as listas informadas (padrão: todas) e atualiza o índice em memória"""
+        summary = {}
+        for kind in kinds or SUPPRESSION_LISTS:
+            try:
+                summary[kind] = self.sync_list(kind, full)
+            except Exception as e:
+                # O checkpoint não avança: a próxima execução retoma do mesmo ponto
+                print(f"Erro ao sincronizar supressões ({kind}): {e}")
+                ERRORS.inc(component='suppression_sync')
+                summary[kind] = {'error': str(e)}
+
+        if self.index is not None:
+            self.index.refresh()
+        return summary
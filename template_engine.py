@@ -0,0 +1,167 @@
+import re
+import threading
+from collections import OrderedDict
+from operator import itemgetter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Tags no formato {campo} ou {campo|padrão}; chaves sem um identificador dentro (CSS, JSON) ficam como texto
+TAG_PATTERN = re.compile(r'\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*(?:\|([^{}]*))?\}')
+
+# Variáveis enviadas quando o lote não informa as do template (jobs gravados antes do compilador)
+LEGACY_VARIABLES = {
+    'name': ('name', 'Cliente'),
+    'company': ('company', ''),
+    'position': ('position', ''),
+    'source': ('source', '')
+}
+
+
+class CompiledTemplate:
+    """Template analisado uma única vez: versão do Mailgun, versão com %s e variáveis presentes nele"""
+
+    __slots__ = ('source', 'mailgun', 'placeholders', 'pattern', 'indexes', '_pick')
+
+    def __init__(self, source: str, mailgun: str, names: Iterable[str],
+                 pattern: str = '', indexes: Sequence[int] = ()):
+        self.source = source
+        self.mailgun = mailgun
+        self.placeholders = tuple((f'%recipient.{name}%', name) for name in dict.fromkeys(names))
+        # Texto com um %s por tag e, para cada %s, a posição da variável na campanha
+        self.pattern = pattern
+        self.indexes = tuple(indexes)
+        if len(self.indexes) > 1:
+            self._pick = itemgetter(*self.indexes)
+        else:
+            self._pick = lambda values: tuple(values[index] for index in self.indexes)
+
+    def render(self, values: Dict) -> str:
+        """Renderiza como o Mailgun: cada variável distinta é substituída uma vez no texto todo"""
+        text = self.mailgun
+        for placeholder, name in self.placeholders:
+            text = text.replace(placeholder, str(values[name]))
+        return text
+
+    def fill(self, values: Sequence) -> str:
+        """Renderiza com os valores na ordem das variáveis da campanha, numa única formatação"""
+        return self.pattern % self._pick(values)
+
+
+def compile_template(source: str, variables: Dict[str, Tuple[str, Optional[str]]] = None) -> CompiledTemplate:
+    """Compila um template, registrando em variables cada par (campo, padrão) usado"""
+    variables = {} if variables is None else variables
+    names = {pair: name for name, pair in variables.items()}
+    positions = {name: index for index, name in enumerate(variables)}
+    mailgun_parts = []
+    pattern_parts = []
+    used = []
+    indexes = []
+    position = 0
+
+    for match in TAG_PATTERN.finditer(source or ''):
+        text = source[position:match.start()]
+        mailgun_parts.append(text)
+        pattern_parts.append(text.replace('%', '%%'))
+        position = match.end()
+
+        field = match.group(1)
+        default = match.group(2).strip() if match.group(2) is not None else None
+        name = names.get((field, default))
+        if name is None:
+            # O mesmo campo com padrões diferentes vira variáveis diferentes no Mailgun
+            name = field if field not in variables else f'{field}__{len(variables)}'
+            variables[name] = (field, default)
+            names[(field, default)] = name
+            positions[name] = len(variables) - 1
+
+        mailgun_parts.append(f'%recipient.{name}%')
+        pattern_parts.append('%s')
+        used.append(name)
+        indexes.append(positions[name])
+
+    text = (source or '')[position:]
+    mailgun_parts.append(text)
+    pattern_parts.append(text.replace('%', '%%'))
+    return CompiledTemplate(source, ''.join(mailgun_parts), used, ''.join(pattern_parts), indexes)
+
+
+def recipient_variables(contact, variables: Dict[str, Tuple[str, Optional[str]]]) -> Dict:
+    """Valores das variáveis de um contato, com o padrão no lugar de campos vazios"""
+    values = {}
+    for name, (field, default) in variables.items():
+        value = contact.get(field)
+        if value is None or value == '':
+            value = default or ''
+        values[name] = value
+    return values
+
+
+class CompiledCampaign:
+    """Assunto e corpo de uma campanha compilados com um conjunto único de variáveis"""
+
+    __slots__ = ('subject', 'body', 'variables', '_defaults')
+
+    def __init__(self, subject: str, body: str):
+        self.variables = {}
+        self.subject = compile_template(subject, self.variables)
+        self.body = compile_template(body, self.variables)
+        # (campo, padrão) na ordem das posições usadas em fill
+        self._defaults = tuple((field, default or '') for field, default in self.variables.values())
+
+    @property
+    def fields(self) -> List[str]:
+        """Campos do contato usados pelo template, sem repetição"""
+        return list(dict.fromkeys(field for field, _ in self.variables.values()))
+
+    def unknown_fields(self, known: Iterable[str]) -> List[str]:
+        """Campos que não existem no contato (a tag iria vazia para todos)"""
+        known = set(known)
+        return [field for field in self.fields if field not in known]
+
+    def required_fields(self) -> List[str]:
+        """Campos usados sem valor padrão em alguma tag"""
+        return list(dict.fromkeys(field for field, default in self.variables.values() if not default))
+
+    def render(self, contact) -> Dict:
+        """Renderiza localmente assunto e corpo para um contato (prévia e benchmarks)"""
+        # Cada campo é lido uma vez por contato; assunto e corpo saem de uma formatação cada
+        get = contact.get
+        values = []
+        for field, default in self._defaults:
+            value = get(field)
+            values.append(default if value is None or value == '' else value)
+        return {'subject': self.subject.fill(values), 'body': self.body.fill(values)}
+
+
+class TemplateCache:
+    """Campanhas compiladas por (id, updated_at): editar a campanha invalida a entrada"""
+
+    def __init__(self, max_size: int = 128):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, campaign: Dict) -> CompiledCampaign:
+        key = (campaign['id'], str(campaign.get('updated_at')))
+        with self._lock:
+            compiled = self._entries.get(key)
+            if compiled is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return compiled
+
+        compiled = CompiledCampaign(campaign['subject'], campaign['body_template'])
+        with self._lock:
+            self.misses += 1
+            # Versões anteriores da mesma campanha não serão mais usadas
+            for stale in [k for k in self._entries if k[0] == key[0]]:
+                del self._entries[stale]
+            self._entries[key] = compiled
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return compiled
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
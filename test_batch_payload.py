@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Verifica a montagem dos lotes de recipient-variables (batch_payload.py).
+
+Execute com: python -m pytest test_batch_payload.py  (ou python test_batch_payload.py)
+"""
+
+import json
+from email.parser import BytesParser
+from email.policy import HTTP
+
+from batch_payload import CONTENT_TYPE, RECIPIENT_OVERHEAD, BatchBuilder, is_payload_rejected
+from mailgun_client import MailgunClient
+from mailgun_stub import MailgunStub
+
+VARIABLES = {'name': ('name', 'Cliente'), 'company': ('company', None)}
+
+
+def make_contacts(count: int, note_size: int = 0) -> list:
+    """Contatos de teste, opcionalmente com um campo grande"""
+    return [
+        {'id': i, 'email': f'contato{i}@exemplo.com', 'name': f'Contato {i}' if i % 2 else None,
+         'company': 'Empresa & Cia' + 'x' * note_size}
+        for i in range(count)
+    ]
+
+
+def test_encoded_body_matches_recipient_variables():
+    builder = BatchBuilder(VARIABLES, 100, 10 ** 6, fields={'subject': 'Olá %recipient.name%'})
+    batch = next(builder.pack(make_contacts(3)))
+
+    body = builder.encode(batch)
+    message = BytesParser(policy=HTTP).parsebytes(f'Content-Type: {CONTENT_TYPE}\r\n\r\n'.encode() + body)
+    form = {part.get_param('name', header='content-disposition'): part.get_payload(decode=True).decode()
+            for part in message.iter_parts()}
+
+    # A estimativa de tamanho é exata (a última vírgula de cada lista não existe)
+    assert len(body) == builder.base_bytes + batch.size - RECIPIENT_OVERHEAD
+    assert form['subject'] == 'Olá %recipient.name%'
+    assert form['to'] == 'contato0@exemplo.com, contato1@exemplo.com, contato2@exemplo.com'
+    assert json.loads(form['recipient-variables'])['contato0@exemplo.com'] == {
+        'name': 'Cliente', 'company': 'Empresa & Cia'
+    }
+
+
+def test_packs_by_count_and_by_bytes():
+    by_count = BatchBuilder(VARIABLES, 4, 10 ** 6)
+    assert [len(batch) for batch in by_count.pack(make_contacts(10))] == [4, 4, 2]
+
+    by_bytes = BatchBuilder(VARIABLES, 1000, 5000)
+    batches = list(by_bytes.pack(make_contacts(10, note_size=1000)))
+    assert len(batches) > 1
+    assert all(by_bytes.base_bytes + batch.size <= 5000 for batch in batches)
+    assert sum(len(batch) for batch in batches) == 10
+
+
+def test_rejected_batches_are_split_in_halves():
+    assert is_payload_rejected(413)
+    assert is_payload_rejected(400, 'Message size exceeds the limit')
+    assert not is_payload_rejected(400, "'to' parameter is missing")
+
+    with MailgunStub(max_payload_bytes=20000) as stub:
+        client = MailgunClient(api_key='test', api_url=stub.url)
+        result = client.send_personalized_batch(
+            make_contacts(40, note_size=1000), 'Olá %recipient.name%', 'Corpo', variables=VARIABLES
+        )
+
+    assert result['success']
+    assert stub.messages_received == 40
+    assert stub.payloads_rejected > 0
+    assert len(result['message_ids']) == 40
+    assert len(set(result['message_ids'].values())) == result['requests']
+
+
+def main():
+    """Executa as verificações fora do pytest"""
+    tests = [
+        test_encoded_body_matches_recipient_variables,
+        test_packs_by_count_and_by_bytes,
+        test_rejected_batches_are_split_in_halves,
+    ]
+    failures = 0
+
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failures += 1
+            print(f"❌ {test.__name__}: {e}")
+
+    print(f"\nResultado: {len(tests) - failures}/{len(tests)} verificações passaram")
+
+
+if __name__ == '__main__':
+    main()
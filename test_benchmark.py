@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Verifica a suíte de benchmarks (benchmark.py) e as falhas sorteadas do Mailgun falso.
+
+Execute com: python -m pytest test_benchmark.py  (ou python test_benchmark.py)
+"""
+
+import os
+import tempfile
+
+import requests
+
+import benchmark
+from mailgun_stub import MailgunStub
+
+
+def test_stub_faults_are_reproducible():
+    first = MailgunStub(error_rate=0.3, throttle_rate=0.3, retry_after=2, seed=7)
+    second = MailgunStub(error_rate=0.3, throttle_rate=0.3, retry_after=2, seed=7)
+    draws = [first.random_fault() for _ in range(50)]
+    assert draws == [second.random_fault() for _ in range(50)]
+    assert {(429, 2), (503, None), None} == set(draws)
+
+    with MailgunStub(throttle_rate=1, retry_after=3) as stub:
+        response = requests.post(f'{stub.url}/v3/mg/messages', data={'to': 'a@exemplo.com'})
+        assert response.status_code == 429 and response.headers['Retry-After'] == '3'
+        assert stub.messages_received == 0 and stub.faults_returned == 1
+
+
+def test_generators_are_deterministic():
+    first = list(benchmark.synthetic_contacts(200, seed=3))
+    assert first == list(benchmark.synthetic_contacts(200, seed=3))
+    assert first != list(benchmark.synthetic_contacts(200, seed=4))
+    assert any('@' not in contact['email'] for contact in first)
+
+
+def bench_dirs() -> set:
+    return {name for name in os.listdir(tempfile.gettempdir()) if name.startswith('bench_')}
+
+
+def test_scenarios_scale_with_size():
+    before = bench_dirs()
+    result = benchmark.run_scenario('campaign_send', size=300)
+    assert (result['contacts'], result['sent'], result['dead_letters']) == (300, 300, 0)
+
+    result = benchmark.run_scenario('batch_activation', size=500, repeat=2)
+    assert result['contacts'] == 500 and result['count_sendable_ms'] >= 0
+
+    # Os bancos temporários de cada execução são apagados
+    assert bench_dirs() <= before and not benchmark.TEMP_DIRS
+
+
+def test_compare_flags_regressions_by_direction():
+    base = {'results': {'send': {'msgs_per_sec': 100.0, 'seconds': 1.0, 'sent': 10, 'dead_letters': 0}}}
+    new = {'results': {'send': {'msgs_per_sec': 80.0, 'seconds': 0.5, 'sent': 10, 'dead_letters': 2}}}
+    verdicts = {key: verdict for _, key, _, _, _, verdict in benchmark.compare_results(base, new)}
+    assert verdicts == {'msgs_per_sec': 'pior', 'seconds': 'melhor', 'sent': '', 'dead_letters': ''}
+
+
+def main():
+    """Executa as verificações fora do pytest"""
+    tests = [
+        test_stub_faults_are_reproducible,
+        test_generators_are_deterministic,
+        test_scenarios_scale_with_size,
+        test_compare_flags_regressions_by_direction,
+    ]
+    failures = 0
+
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failures += 1
+            print(f"❌ {test.__name__}: {e}")
+
+    print(f"\nResultado: {len(tests) - failures}/{len(tests)} verificações passaram")
+
+
+if __name__ == '__main__':
+    main()
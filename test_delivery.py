@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Verifica novas tentativas, circuit breaker e dead letters contra o Mailgun falso com falhas injetadas.
+
+Execute com: python -m pytest test_delivery.py  (ou python test_delivery.py)
+"""
+
+import os
+import tempfile
+import threading
+import time
+
+from database import Database
+from delivery import (
+    NETWORK_ERROR, RATE_LIMITED, REJECTED, SERVER_ERROR, CircuitBreaker,
+    backoff_delay, classify_failure, parse_retry_after
+)
+from dispatch_scheduler import DispatchScheduler
+from mailgun_client import MailgunClient
+from mailgun_stub import MailgunStub
+from quota import DailyQuota
+
+
+def make_scheduler(stub: MailgunStub, workers: int = 2, batch_size: int = 3, **options):
+    """Banco temporário com 6 contatos e um despachante que envia para o stub"""
+    db = Database(os.path.join(tempfile.mkdtemp(prefix='delivery_'), 'delivery.db'))
+    for i in range(6):
+        db.add_contact(f'contato{i}@exemplo.com', name=f'Contato {i}')
+    campaign_id = db.create_campaign('Teste', 'Olá {name}', 'Corpo')
+    client = MailgunClient(api_key='test', api_url=stub.url)
+
+    settings = {
+        'workers': workers, 'rate_per_minute': 60000, 'burst': 1000, 'batch_delay': 0,
+        'poll_interval': 0.05, 'retry_base': 0.01, 'retry_cap': 0.05,
+        'breaker': CircuitBreaker(db, 'teste', failure_threshold=10, cooldown_seconds=0.05),
+        **options
+    }
+    scheduler = DispatchScheduler(
+        db, lambda job: client.send_personalized_batch(job.contacts, **job.payload), **settings
+    )
+    batches = list(db.iter_recipient_batches(batch_size, limit=6))
+    payload = {'mailgun_subject': 'Olá %recipient.name%', 'mailgun_body': 'Corpo', 'campaign_tag': 'teste'}
+    return db, scheduler, campaign_id, batches, payload
+
+
+def test_classifies_failures():
+    assert classify_failure(429) == RATE_LIMITED
+    assert classify_failure(503) == SERVER_ERROR
+    assert classify_failure(None) == NETWORK_ERROR
+    assert classify_failure(400) == REJECTED
+    assert parse_retry_after('12') == 12.0
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT', now=1445412470.0) == 10.0
+
+    # Jitter completo dentro do teto, e nunca antes do Retry-After
+    assert backoff_delay(10, 1, 30, rand=lambda: 1.0) == 30
+    assert backoff_delay(3, 1, 30, rand=lambda: 0.5) == 2.0
+    assert backoff_delay(1, 1, 30, retry_after=45, rand=lambda: 0.5) == 45
+
+
+def test_temporary_failures_are_retried():
+    with MailgunStub() as stub:
+        stub.inject_faults((429, 0), 503)
+        db, scheduler, campaign_id, batches, payload = make_scheduler(stub)
+        dispatch = scheduler.submit(campaign_id, batches, payload)
+        assert dispatch.wait(timeout=10)
+        scheduler.stop()
+
+    jobs = db.get_send_jobs(campaign_id=campaign_id)
+    assert [job['status'] for job in jobs] == ['done', 'done']
+    assert sum(job['attempts'] for job in jobs) == 4
+    assert stub.messages_received == 6
+    assert db.get_dead_letter_counts(campaign_id) == {}
+
+
+def test_permanent_failures_go_to_dead_letters_and_can_be_requeued():
+    with MailgunStub() as stub:
+        stub.inject_faults(400)
+        db, scheduler, campaign_id, batches, payload = make_scheduler(stub, workers=1)
+        scheduler.submit(campaign_id, batches, payload).wait(timeout=10)
+
+        assert db.get_dead_letter_counts(campaign_id) == {REJECTED: 3}
+        assert stub.messages_received == 3
+
+        contact_ids = db.take_dead_letters(campaign_id)
+        requeued = [db.get_recipients_by_ids(contact_ids)]
+        assert scheduler.submit(campaign_id, requeued, payload).wait(timeout=10)
+        scheduler.stop()
+
+    assert stub.messages_received == 6
+    assert db.get_dead_letters(campaign_id) == []
+
+
+def count_send_logs(db: Database, campaign_id: int) -> int:
+    with db.connection() as conn:
+        return conn.execute('SELECT COUNT(*) FROM email_logs WHERE campaign_id = ?', (campaign_id,)).fetchone()[0]
+
+
+def test_jobs_waiting_for_rate_limit_keep_their_lease():
+    with MailgunStub() as stub:
+        # Espera pelos tokens (0,5s, 1,5s e 2,5s) maior que a reserva de 1s
+        db, scheduler, campaign_id, batches, payload = make_scheduler(
+            stub, workers=3, batch_size=2, rate_per_minute=120, burst=1, lease_seconds=1
+        )
+        # Outro processo no mesmo banco recuperando reservas expiradas o tempo todo
+        stopping = threading.Event()
+
+        def other_process():
+            while not stopping.wait(0.05):
+                db.requeue_stale_send_jobs(1, time.time(), live_worker='outra-maquina:1')
+
+        other = threading.Thread(target=other_process, daemon=True)
+        other.start()
+        try:
+            assert scheduler.submit(campaign_id, batches, payload).wait(timeout=15)
+        finally:
+            stopping.set()
+            scheduler.stop()
+
+    assert stub.requests_received == 3
+    assert count_send_logs(db, campaign_id) == 6
+
+
+def test_quota_reservations_live_as_long_as_the_job_lease():
+    with MailgunStub() as stub:
+        db, scheduler, campaign_id, batches, payload = make_scheduler(
+            stub, workers=3, batch_size=2, rate_per_minute=120, burst=1, lease_seconds=1
+        )
+        quota = scheduler.quota = DailyQuota(db, daily_limit=6)
+        # Outro processo devolvendo à cota as reservas antigas o tempo todo
+        stopping = threading.Event()
+        totals = []
+
+        def other_process():
+            while not stopping.wait(0.05):
+                db.expire_send_quota_reservations(1, time.time())
+                used = db.get_send_quota(quota.today())
+                totals.append(used['sent'] + used['reserved'])
+
+        other = threading.Thread(target=other_process, daemon=True)
+        other.start()
+        try:
+            assert scheduler.submit(campaign_id, batches, payload).wait(timeout=15)
+        finally:
+            stopping.set()
+            scheduler.stop()
+
+    # Depois de reservada, a cota dos lotes à espera de tokens nunca volta a ficar livre
+    assert 6 in totals and min(totals[totals.index(6):]) == 6
+    assert db.get_send_quota(quota.today()) == {'sent': 6, 'reserved': 0}
+
+
+def test_results_of_a_lost_claim_are_discarded():
+    db = Database(os.path.join(tempfile.mkdtemp(prefix='delivery_'), 'delivery.db'))
+    for i in range(2):
+        db.add_contact(f'contato{i}@exemplo.com')
+    campaign_id = db.create_campaign('Teste', 'Assunto', 'Corpo')
+    contacts = next(db.iter_recipient_batches(2))
+    db.enqueue_send_jobs(campaign_id, [contacts], {}, time.time(), 0)
+
+    now = time.time()
+    first = db.claim_send_job('a:1', now)
+    # A reserva de "a" expira e o job é reservado por "b"
+    assert db.requeue_stale_send_jobs(1, now + 2) == 1
+    second = db.claim_send_job('b:1', now + 2)
+
+    assert db.complete_send_job(first['id'], 'a:1', first['claimed_at'], campaign_id, contacts) is None
+    assert not db.renew_send_job(first['id'], 'a:1', first['claimed_at'], now + 3)
+    assert db.complete_send_job(second['id'], 'b:1', second['claimed_at'], campaign_id, contacts) == 2
+    assert count_send_logs(db, campaign_id) == 2
+
+    # As reservas do próprio processo (live_worker) nunca são recuperadas
+    db.enqueue_send_jobs(campaign_id, [contacts], {}, time.time(), 0)
+    db.claim_send_job('a:1', now)
+    assert db.requeue_stale_send_jobs(1, now + 2, live_worker='a:1') == 0
+
+
+def test_circuit_opens_after_consecutive_failures():
+    db = Database(os.path.join(tempfile.mkdtemp(prefix='delivery_'), 'delivery.db'))
+    breaker = CircuitBreaker(db, 'mailgun:exemplo.com', failure_threshold=2, cooldown_seconds=0.05)
+
+    assert breaker.record(False) == 'closed'
+    assert breaker.record(False) == 'open'
+    assert breaker.acquire() > 0
+
+    time.sleep(0.06)
+    # Só uma tentativa de teste passa; uma falha nela reabre o circuito
+    assert breaker.acquire() == 0
+    assert breaker.acquire() > 0
+    assert breaker.record(False) == 'open'
+
+    time.sleep(0.06)
+    assert breaker.acquire() == 0
+    assert breaker.record(True) == 'closed'
+    assert breaker.acquire() == 0
+
+
+def main():
+    """Executa as verificações fora do pytest"""
+    tests = [
+        test_classifies_failures,
+        test_temporary_failures_are_retried,
+        test_permanent_failures_go_to_dead_letters_and_can_be_requeued,
+        test_jobs_waiting_for_rate_limit_keep_their_lease,
+        test_quota_reservations_live_as_long_as_the_job_lease,
+        test_results_of_a_lost_claim_are_discarded,
+        test_circuit_opens_after_consecutive_failures,
+    ]
+    failures = 0
+
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failures += 1
+            print(f"❌ {test.__name__}: {e}")
+
+    print(f"\nResultado: {len(tests) - failures}/{len(tests)} verificações passaram")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Verifica o validador de emails contra o Mailgun falso (mailgun_stub.py).
+
+Execute com: python -m pytest test_email_validation.py  (ou python test_email_validation.py)
+"""
+
+import os
+import tempfile
+
+from database import Database
+from email_validation import EmailValidator, classify_validation
+from mailgun_client import MailgunClient
+from mailgun_stub import MailgunStub
+
+
+def make_validator(stub: MailgunStub) -> EmailValidator:
+    """Cria um validador com banco temporário apontando para o stub"""
+    db = Database(os.path.join(tempfile.mkdtemp(prefix='validation_'), 'validation.db'))
+    client = MailgunClient(api_key='test', api_url=stub.url)
+    return EmailValidator(db, client, concurrency=4, rate_per_minute=60000, check_mx=False)
+
+
+def test_classifies_api_results():
+    with MailgunStub() as stub:
+        validator = make_validator(stub)
+        results = validator.validate_many([
+            'Contato@Exemplo.com', 'invalid.user@exemplo.com', 'temp@mailinator.com', 'sem-arroba'
+        ])
+
+    assert results['contato@exemplo.com']['status'] == 'valid'
+    assert results['invalid.user@exemplo.com']['status'] == 'invalid'
+    assert results['temp@mailinator.com']['status'] == 'disposable'
+    assert results['sem-arroba'] == {'status': 'invalid', 'reason': 'syntax', 'source': 'syntax'}
+    # O endereço com sintaxe inválida não chega à API
+    assert stub.validations_received == 3
+
+
+def test_cached_addresses_skip_the_api():
+    with MailgunStub() as stub:
+        validator = make_validator(stub)
+        emails = [f'contato{i}@exemplo.com' for i in range(20)]
+        validator.validate_many(emails)
+        results = validator.validate_many(emails + ['novo@exemplo.com'])
+
+    assert stub.validations_received == 21
+    assert results['contato3@exemplo.com']['source'] == 'cache'
+    assert results['novo@exemplo.com']['source'] == 'api'
+
+
+def test_temporary_api_errors_are_not_cached():
+    assert classify_validation({'valid': False, 'error': 'busy', 'status_code': 429})['status'] == 'unknown'
+    assert classify_validation({'valid': False, 'error': 'bad', 'status_code': 400})['status'] == 'invalid'
+
+
+def test_validate_contacts_groups_by_status():
+    with MailgunStub() as stub:
+        validator = make_validator(stub)
+        grouped = validator.validate_contacts([
+            {'id': 1, 'email': 'ok@exemplo.com'},
+            {'id': 2, 'email': 'invalid@exemplo.com'},
+            {'id': 3, 'email': 'ok@exemplo.com'},
+        ])
+
+    assert [contact['id'] for contact in grouped['valid']] == [1, 3]
+    assert [contact['id'] for contact in grouped['invalid']] == [2]
+    assert stub.validations_received == 2
+
+
+def main():
+    """Executa as verificações fora do pytest"""
+    tests = [
+        test_classifies_api_results,
+        test_cached_addresses_skip_the_api,
+        test_temporary_api_errors_are_not_cached,
+        test_validate_contacts_groups_by_status,
+    ]
+    failures = 0
+
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failures += 1
+            print(f"❌ {test.__name__}: {e}")
+
+    print(f"\nResultado: {len(tests) - failures}/{len(tests)} verificações passaram")
+
+
+if __name__ == '__main__':
+    main()
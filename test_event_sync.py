@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Verifica a sincronização de eventos pela API /events (event_sync.py) contra o Mailgun falso:
+retomada pelo cursor gravado, janela de acomodação e deduplicação no backfill.
+
+Execute com: python -m pytest test_event_sync.py  (ou python test_event_sync.py)
+"""
+
+import os
+import tempfile
+
+from database import Database
+from event_sync import EventSync
+from mailgun_client import MailgunClient
+from mailgun_stub import MailgunStub
+
+MESSAGE_ID = 'eventos@exemplo.com'
+NOW = 1700010000
+
+# Bancos criados pelo teste em andamento, apagados em teardown_function
+OPEN_DATABASES = []
+
+
+def make_sync(stub: MailgunStub, **options) -> EventSync:
+    """Banco temporário com uma campanha enviada para 4 contatos e a sincronização apontando para o stub"""
+    tmp_dir = tempfile.TemporaryDirectory(prefix='events_')
+    db = Database(os.path.join(tmp_dir.name, 'events.db'))
+    OPEN_DATABASES.append((db, tmp_dir))
+    campaign_id = db.create_campaign('Eventos', 'Assunto', 'Corpo')
+    db.log_emails_sent_bulk(campaign_id, [
+        {'id': db.add_contact(f'contato{i}@exemplo.com'), 'email': f'contato{i}@exemplo.com'}
+        for i in range(4)
+    ], f'<{MESSAGE_ID}>')
+    client = MailgunClient(api_key='test', api_url=stub.url)
+    settings = {'page_size': 100, 'settle_seconds': 600, 'lookback_seconds': 3600, 'interval': 0, **options}
+    return EventSync(db, client, **settings)
+
+
+def teardown_function(function=None):
+    """Fecha o pool e apaga o diretório de cada banco criado pelo teste"""
+    while OPEN_DATABASES:
+        db, tmp_dir = OPEN_DATABASES.pop()
+        db.close()
+        tmp_dir.cleanup()
+
+
+def api_event(event_id: str, recipient: str, event: str, timestamp: float) -> dict:
+    """Evento no formato da API /events"""
+    return {
+        'id': event_id, 'event': event, 'recipient': recipient, 'timestamp': timestamp,
+        'message': {'headers': {'message-id': MESSAGE_ID}}
+    }
+
+
+def count_logs(db: Database, column: str) -> int:
+    with db.connection() as conn:
+        return conn.execute(f'SELECT COUNT({column}) FROM email_logs').fetchone()[0]
+
+
+def test_sync_resumes_from_cursor_and_waits_for_the_settle_window():
+    with MailgunStub() as stub:
+        sync = make_sync(stub)
+        stub.load_events([
+            api_event('entregue', 'contato0@exemplo.com', 'delivered', NOW - 3000),
+            # Mais recente que a janela de acomodação (600s): fica para a próxima execução
+            api_event('aberto', 'contato0@exemplo.com', 'opened', NOW - 100),
+        ])
+
+        first = sync.sync(now=NOW)
+        second = sync.sync(now=NOW + 60)
+        third = sync.sync(now=NOW + 600)
+        backfill = sync.backfill(NOW - 3600, NOW)
+
+    assert (first['begin'], first['end']) == (NOW - 3600, NOW - 600)
+    assert (first['new'], first['duplicates']) == (1, 0)
+    # A segunda execução começa onde a primeira terminou
+    assert (second['begin'], second['new'], second['events']) == (NOW - 600, 0, 0)
+    assert (third['new'], third['duplicates']) == (1, 0)
+    # O backfill cobre o mesmo período: nada é aplicado duas vezes
+    assert (backfill['new'], backfill['duplicates']) == (0, 2)
+    assert count_logs(sync.db, 'delivered_at') == count_logs(sync.db, 'opened_at') == 1
+
+
+def test_backfill_applies_only_late_events():
+    with MailgunStub() as stub:
+        sync = make_sync(stub)
+        stub.load_events([api_event('entregue', 'contato1@exemplo.com', 'delivered', NOW - 2000)])
+        assert sync.sync(now=NOW)['new'] == 1
+
+        # Evento que chegou à API depois de a janela já ter sido sincronizada
+        stub.load_events([api_event('atrasado', 'contato2@exemplo.com', 'delivered', NOW - 1500)])
+        assert sync.sync(now=NOW + 60)['new'] == 0
+        backfill = sync.backfill(NOW - 3600, NOW)
+
+    assert (backfill['new'], backfill['duplicates']) == (1, 1)
+    assert count_logs(sync.db, 'delivered_at') == 2
+
+
+def test_interrupted_sync_resumes_from_the_stored_page():
+    with MailgunStub() as stub:
+        sync = make_sync(stub, page_size=1)
+        stub.load_events([
+            api_event(f'entregue{i}', f'contato{i}@exemplo.com', 'delivered', NOW - 3000 + i)
+            for i in range(4)
+        ])
+
+        # Parada no meio da janela: grava a próxima página e não avança o início
+        sync._stopping.set()
+        interrupted = sync.sync(now=NOW)
+        sync._stopping.clear()
+        cursor = sync.load_cursor(EventSync.CHECKPOINT)
+        resumed = sync.sync(now=NOW + 300)
+
+    assert interrupted['interrupted'] and interrupted['new'] == 1
+    assert cursor['end'] == NOW - 600 and cursor['next']
+    # Termina a mesma janela a partir da página gravada, sem reler a primeira
+    assert resumed['end'] == NOW - 600
+    assert (resumed['pages'], resumed['new'], resumed['duplicates']) == (3, 3, 0)
+    assert sync.load_cursor(EventSync.CHECKPOINT) == {'begin': NOW - 600}
+    assert count_logs(sync.db, 'delivered_at') == 4
+
+
+def main():
+    """Executa as verificações fora do pytest"""
+    tests = [
+        test_sync_resumes_from_cursor_and_waits_for_the_settle_window,
+        test_backfill_applies_only_late_events,
+        test_interrupted_sync_resumes_from_the_stored_page,
+    ]
+    failures = 0
+
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failures += 1
+            print(f"❌ {test.__name__}: {e}")
+        finally:
+            teardown_function(test)
+
+    print(f"\nResultado: {len(tests) - failures}/{len(tests)} verificações passaram")
+
+
+if __name__ == '__main__':
+    main()
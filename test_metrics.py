@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Verifica as métricas de /metrics (metrics.py): formato de exposição, soma entre processos e
+a medição dos métodos de Database.
+
+Execute com: python -m pytest test_metrics.py  (ou python test_metrics.py)
+"""
+
+import os
+import tempfile
+
+from database import Database
+from metrics import DB_ERRORS, DB_QUERY_SECONDS, MetricsRegistry
+
+
+def test_renders_prometheus_text_format():
+    registry = MetricsRegistry(directory='')
+    requests_total = registry.counter('requests_total', 'Requisições', ('status',))
+    latency = registry.histogram('latency_seconds', 'Latência', buckets=(0.1, 1.0))
+    requests_total.inc(status=200)
+    requests_total.inc(2, status='a"b')
+    latency.observe(0.1)
+    latency.observe(0.5)
+    latency.observe(3)
+
+    lines = registry.render().splitlines()
+    assert '# TYPE requests_total counter' in lines
+    assert 'requests_total{status="200"} 1' in lines
+    assert r'requests_total{status="a\"b"} 2' in lines
+    # Faixas acumuladas; o limite é inclusivo (le)
+    assert 'latency_seconds_bucket{le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{le="1.0"} 2' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 3' in lines
+    assert 'latency_seconds_sum 3.6' in lines and 'latency_seconds_count 3' in lines
+
+
+def make_registry(directory: str) -> MetricsRegistry:
+    registry = MetricsRegistry(directory=directory)
+    registry.counter('sent_total', 'Enviados')
+    registry.gauge('queue_depth', 'Fila')
+    registry.histogram('flush_seconds', 'Gravação', buckets=(1.0,))
+    return registry
+
+
+def test_values_are_summed_across_processes():
+    directory = tempfile.mkdtemp(prefix='metrics_')
+    registry = make_registry(directory)
+
+    # Um "worker" que grava as suas métricas e termina
+    pid = os.fork()
+    if pid == 0:
+        child = make_registry(directory)
+        child._metrics['sent_total'].inc(5)
+        child._metrics['queue_depth'].set(7)
+        child._metrics['flush_seconds'].observe(2)
+        child.flush()
+        os._exit(0)
+    os.waitpid(pid, 0)
+
+    registry._metrics['sent_total'].inc(1)
+    registry._metrics['queue_depth'].set(3)
+    registry._metrics['flush_seconds'].observe(0.5)
+    lines = registry.render().splitlines()
+
+    assert 'sent_total 6' in lines
+    assert 'flush_seconds_bucket{le="1.0"} 1' in lines and 'flush_seconds_count 2' in lines
+    # O gauge de um processo que já terminou não entra na soma
+    assert 'queue_depth 3' in lines
+
+
+def test_database_methods_are_timed():
+    db = Database(os.path.join(tempfile.mkdtemp(prefix='metrics_'), 'metrics.db'))
+
+    def count(method):
+        counts = DB_QUERY_SECONDS.samples().get((method,))
+        return sum(counts[:-1]) if counts else 0
+
+    before = count('get_campaigns')
+    db.get_campaigns()
+    db.get_campaigns()
+    assert count('get_campaigns') == before + 2
+
+    errors = DB_ERRORS.samples().get(('get_send_quota',), 0)
+    try:
+        db.get_send_quota(None, 'argumento extra')
+    except TypeError:
+        pass
+    assert DB_ERRORS.samples()[('get_send_quota',)] == errors + 1
+
+
+def main():
+    """Executa as verificações fora do pytest"""
+    tests = [
+        test_renders_prometheus_text_format,
+        test_values_are_summed_across_processes,
+        test_database_methods_are_timed,
+    ]
+    failures = 0
+
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failures += 1
+            print(f"❌ {test.__name__}: {e}")
+
+    print(f"\nResultado: {len(tests) - failures}/{len(tests)} verificações passaram")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Verifica o progresso dos envios em tempo real (progress_stream.py) contra o Mailgun falso.
+
+Execute com: python -m pytest test_progress_stream.py  (ou python test_progress_stream.py)
+"""
+
+import json
+import os
+import tempfile
+import time
+
+from database import Database
+from delivery import CircuitBreaker
+from dispatch_scheduler import DispatchScheduler
+from mailgun_client import MailgunClient
+from mailgun_stub import MailgunStub
+from progress_stream import ProgressBroker
+
+
+def parse(message: str):
+    """(evento, dados) de uma mensagem SSE; comentários viram (None, None)"""
+    if message.startswith(':'):
+        return None, None
+    event, data = message.strip().split('\n')
+    return event[len('event: '):], json.loads(data[len('data: '):])
+
+
+def collect(subscription, timeout: float = 10):
+    """Eventos recebidos até o stream terminar"""
+    events = []
+    deadline = time.monotonic() + timeout
+    for message in subscription.stream(heartbeat=0.05):
+        event, data = parse(message)
+        if event:
+            events.append((event, data))
+        assert time.monotonic() < deadline, 'stream não terminou'
+    return events
+
+
+def test_slow_subscriber_is_dropped():
+    broker = ProgressBroker(max_buffer=3)
+    subscription = broker.subscribe(1)
+    for _ in range(3):
+        broker.batches_queued(1, 1)
+
+    # O quarto evento não cabe no buffer: o assinante é descartado sem atrasar quem publica
+    assert subscription.dropped and broker.dropped == 1
+    assert broker.subscriber_count(1) == 0
+    assert [event for event, _ in collect(subscription)] == ['dropped']
+
+
+def test_stream_sends_keepalive_and_ends_on_completion():
+    broker = ProgressBroker()
+    broker.batches_queued(7, 1)
+    queue = {'batches_total': 1, 'batches_done': 0, 'batches_failed': 0}
+    subscription = broker.subscribe(7, load_snapshot=lambda: dict(queue))
+    stream = subscription.stream(heartbeat=0.01)
+
+    event, data = parse(next(stream))
+    assert event == 'snapshot' and data['batches_total'] == 1
+    assert next(stream) == ': keepalive\n\n'
+
+    queue['batches_done'] = 1
+    broker.batch_finished(7, 1, {'success': True, 'recipients_count': 10, 'message_id': '<id>'})
+    assert [parse(message)[0] for message in stream] == ['batch_dispatched', 'progress', 'completed']
+    assert broker.subscriber_count() == 0
+
+
+def test_snapshot_is_loaded_only_for_untracked_campaigns():
+    broker = ProgressBroker()
+    loads = []
+
+    def load_snapshot():
+        loads.append(1)
+        return {'batches_total': 4, 'batches_done': 4, 'batches_failed': 0}
+
+    events = collect(broker.subscribe(3, load_snapshot))
+    assert [event for event, _ in events] == ['snapshot', 'completed']
+    collect(broker.subscribe(3, load_snapshot))
+    assert loads == [1]
+
+
+def test_progress_is_reseeded_from_the_queue_on_heartbeat():
+    # Lotes enviados por outro processo: este broker não recebe nenhum batch_finished
+    broker = ProgressBroker()
+    queue = {'batches_total': 4, 'batches_done': 0, 'batches_failed': 0}
+    subscription = broker.subscribe(5, load_snapshot=lambda: dict(queue))
+    stream = subscription.stream(heartbeat=0.01)
+    assert parse(next(stream))[0] == 'snapshot'
+
+    queue['batches_done'] = 2
+    event, data = parse(next(message for message in stream if not message.startswith(':')))
+    assert event == 'progress' and data['batches_done'] == 2
+
+    queue.update(batches_done=3, batches_failed=1)
+    events = [parse(message) for message in stream if not message.startswith(':')]
+    assert [event for event, _ in events] == ['progress', 'completed']
+    assert events[-1][1]['progress'] == 100
+    assert broker.subscriber_count() == 0
+
+
+def test_completion_is_confirmed_by_the_queue():
+    broker = ProgressBroker()
+    broker.batches_queued(8, 1)
+    # Outro processo reenviou um lote: a fila ainda tem um job pendente
+    queue = {'batches_total': 2, 'batches_done': 1, 'batches_failed': 0}
+    subscription = broker.subscribe(8, load_snapshot=lambda: dict(queue))
+    broker.batch_finished(8, 1, {'success': True, 'recipients_count': 3})
+    assert not subscription.closed and broker.subscriber_count(8) == 1
+
+    queue['batches_done'] = 2
+    names = [parse(message)[0] for message in subscription.stream(heartbeat=0.01)]
+    assert names[-1] == 'completed' and names.count('completed') == 1
+
+
+def test_dispatch_publishes_batch_results():
+    with MailgunStub() as stub:
+        stub.inject_faults((429, 0))
+        db = Database(os.path.join(tempfile.mkdtemp(prefix='progress_'), 'progress.db'))
+        for i in range(6):
+            db.add_contact(f'contato{i}@exemplo.com', name=f'Contato {i}')
+        campaign_id = db.create_campaign('Teste', 'Olá {name}', 'Corpo')
+        client = MailgunClient(api_key='test', api_url=stub.url)
+        broker = ProgressBroker()
+        scheduler = DispatchScheduler(
+            db, lambda job: client.send_personalized_batch(job.contacts, **job.payload),
+            workers=1, rate_per_minute=60000, burst=1000, batch_delay=0, poll_interval=0.05,
+            retry_base=0.01, retry_cap=0.05, progress=broker,
+            breaker=CircuitBreaker(db, 'teste', failure_threshold=10, cooldown_seconds=0.05)
+        )
+        subscription = broker.subscribe(campaign_id)
+        payload = {'mailgun_subject': 'Olá %recipient.name%', 'mailgun_body': 'Corpo', 'campaign_tag': 'teste'}
+        try:
+            scheduler.submit(campaign_id, list(db.iter_recipient_batches(3, limit=6)), payload)
+            events = collect(subscription)
+        finally:
+            scheduler.stop(timeout=5)
+
+    names = [event for event, _ in events]
+    assert names[:2] == ['snapshot', 'queued']
+    assert names.count('batch_dispatched') == 2 and names[-1] == 'completed'
+
+    # O 429 volta para a fila: aparece como falha com retry_in, mas o lote não conta como finalizado
+    failed = [data for event, data in events if event == 'batch_failed']
+    assert len(failed) == 1 and failed[0]['retry_in'] is not None
+    final = events[-1][1]
+    assert (final['batches_done'], final['batches_failed'], final['recipients_sent']) == (2, 0, 6)
+    assert final['progress'] == 100 and final['eta_seconds'] == 0
+
+
+def main():
+    """Executa as verificações fora do pytest"""
+    tests = [
+        test_slow_subscriber_is_dropped,
+        test_stream_sends_keepalive_and_ends_on_completion,
+        test_snapshot_is_loaded_only_for_untracked_campaigns,
+        test_progress_is_reseeded_from_the_queue_on_heartbeat,
+        test_completion_is_confirmed_by_the_queue,
+        test_dispatch_publishes_batch_results,
+    ]
+    failures = 0
+
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failures += 1
+            print(f"❌ {test.__name__}: {e}")
+
+    print(f"\nResultado: {len(tests) - failures}/{len(tests)} verificações passaram")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Verifica o plano de execução (EXPLAIN QUERY PLAN) das consultas mais frequentes.
+
+Captura o SQL realmente executado pelos métodos do Database e garante que
+nenhuma consulta sobre email_logs volte a fazer varredura completa da tabela.
+
+Execute com: python -m pytest test_query_plans.py  (ou python test_query_plans.py)
+"""
+
+import os
+import tempfile
+
+from database import Database, SCHEMA_VERSION
+from stats_rollup import StatsRollup
+
+# Bancos criados pelo teste em andamento, apagados em teardown_function
+OPEN_DATABASES = []
+
+
+def make_database() -> Database:
+    """Cria um banco temporário com alguns dados"""
+    tmp_dir = tempfile.TemporaryDirectory(prefix='plans_')
+    db = Database(os.path.join(tmp_dir.name, 'plans.db'))
+    OPEN_DATABASES.append((db, tmp_dir))
+    campaign_id = db.create_campaign('Plano', 'Assunto', 'Corpo')
+    contacts = [
+        {'id': db.add_contact(f'contato{i}@exemplo.com', name=f'Contato {i}'), 'email': f'contato{i}@exemplo.com'}
+        for i in range(20)
+    ]
+    db.log_emails_sent_bulk(campaign_id, contacts, '<plano@exemplo.com>')
+    return db
+
+
+def teardown_function(function=None):
+    """Fecha o pool e apaga o diretório de cada banco criado pelo teste"""
+    while OPEN_DATABASES:
+        db, tmp_dir = OPEN_DATABASES.pop()
+        db.close()
+        tmp_dir.cleanup()
+
+
+def capture_statements(db: Database, action, table: str = 'email_logs') -> list:
+    """Executa a ação e retorna os comandos SQL (com parâmetros expandidos) sobre a tabela que ela gerou"""
+    statements = []
+    conn = db.pool.acquire()
+    conn.set_trace_callback(statements.append)
+    db.pool.release(conn)  # o pool é LIFO: a próxima chamada usa esta conexão
+
+    try:
+        action()
+    finally:
+        conn.set_trace_callback(None)
+
+    return [
+        statement for statement in statements
+        if table in statement and not statement.lstrip().upper().startswith(('BEGIN', 'COMMIT'))
+    ]
+
+
+def table_plan(db: Database, statement: str, table: str) -> list:
+    """Detalhes do plano que envolvem a tabela informada"""
+    with db.connection() as conn:
+        rows = conn.execute(f'EXPLAIN QUERY PLAN {statement}').fetchall()
+    return [row[3] for row in rows if table in row[3]]
+
+
+def email_logs_plan(db: Database, statement: str) -> list:
+    """Detalhes do plano que envolvem a tabela email_logs"""
+    return table_plan(db, statement, 'email_logs')
+
+
+def assert_no_scan(db: Database, action):
+    statements = capture_statements(db, action)
+    assert statements, 'nenhuma consulta sobre email_logs foi capturada'
+
+    for statement in statements:
+        details = email_logs_plan(db, statement)
+        for detail in details:
+            assert detail.startswith('SEARCH'), f'varredura completa em: {statement}\n  plano: {detail}'
+
+
+def test_schema_version():
+    db = make_database()
+    with db.connection() as conn:
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_VERSION
+
+
+def test_update_email_status_uses_index():
+    db = make_database()
+    assert_no_scan(db, lambda: db.update_email_status(
+        'contato3@exemplo.com', 'opened', opened_at='2024-01-01 10:00:00'
+    ))
+
+
+def test_update_by_message_id_uses_index():
+    db = make_database()
+    assert_no_scan(db, lambda: db.update_email_status_by_message(
+        'plano@exemplo.com', 'contato3@exemplo.com', 'delivered'
+    ))
+    assert_no_scan(db, lambda: db.update_email_status_by_message(
+        None, 'contato3@exemplo.com', 'opened'
+    ))
+
+
+def test_update_by_message_id_touches_one_row():
+    db = make_database()
+    updated = db.update_email_status_by_message('<plano@exemplo.com>', 'contato3@exemplo.com', 'opened')
+    assert updated == 1
+    assert db.get_campaign_stats(1)['total_opened'] == 1
+
+
+def test_campaign_stats_reconciliation_uses_index():
+    db = make_database()
+    assert_no_scan(db, lambda: db.compute_campaign_stats(1))
+
+
+def test_campaign_stats_summary_matches_logs():
+    db = make_database()
+    db.update_email_status('contato3@exemplo.com', 'opened', opened_at='2024-01-01 10:00:00')
+    assert db.get_campaign_stats(1) == db.compute_campaign_stats(1)
+
+
+def test_daily_stats_reads_rollups():
+    db = make_database()
+    stats = StatsRollup(db)
+
+    assert not capture_statements(db, stats.daily), 'o painel não deve consultar email_logs'
+    statements = capture_statements(db, stats.daily, table='stats_hourly')
+    assert statements
+    for statement in statements:
+        for detail in table_plan(db, statement, 'stats_hourly'):
+            assert detail.startswith('SEARCH'), f'varredura completa em: {statement}\n  plano: {detail}'
+
+
+def test_contacts_keyset_page_uses_index():
+    db = make_database()
+    statements = []
+    conn = db.pool.acquire()
+    conn.set_trace_callback(statements.append)
+    db.pool.release(conn)
+    try:
+        db.get_contacts_page(status='active', after_id=5, limit=10)
+        db.get_contacts_page(batch_id='lote', after_id=5, limit=10)
+    finally:
+        conn.set_trace_callback(None)
+
+    selects = [statement for statement in statements if 'FROM contacts' in statement]
+    assert len(selects) == 2
+    for statement in selects:
+        for detail in table_plan(db, statement, 'contacts'):
+            assert detail.startswith('SEARCH') and 'rowid>' in detail, f'página sem índice: {detail}'
+
+
+def test_sendable_contacts_use_indexes():
+    db = make_database()
+    db.add_contacts_bulk([{'email': f'lote{i}@exemplo.com'} for i in range(20)], batch_id='lote')
+    db.activate_batch('lote')
+
+    # Caminho de toda campanha: página de 'sendable' e contagem, com o registro de lotes
+    statements = capture_statements(db, lambda: (
+        db.get_contacts_page(status='sendable', after_id=5, limit=10),
+        db.count_sendable_contacts()
+    ), table='FROM contacts')
+    assert len(statements) == 2
+    page, count = statements
+    for statement, expected in ((page, 'rowid>'), (count, 'idx_contacts_status')):
+        # 'contact' casa com contacts e com contact_batches
+        for detail in table_plan(db, statement, 'contact'):
+            if 'contact_batches' in detail:
+                assert 'idx_contact_batches_active' in detail, f'lotes sem índice: {detail}'
+            else:
+                assert detail.startswith('SEARCH') and expected in detail, f'contatos sem índice: {detail}'
+
+
+def main():
+    """Executa as verificações fora do pytest"""
+    tests = [
+        test_schema_version,
+        test_update_email_status_uses_index,
+        test_update_by_message_id_uses_index,
+        test_update_by_message_id_touches_one_row,
+        test_campaign_stats_reconciliation_uses_index,
+        test_campaign_stats_summary_matches_logs,
+        test_daily_stats_reads_rollups,
+        test_contacts_keyset_page_uses_index,
+        test_sendable_contacts_use_indexes,
+    ]
+    failures = 0
+
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failures += 1
+            print(f"❌ {test.__name__}: {e}")
+        finally:
+            teardown_function(test)
+
+    print(f"\nResultado: {len(tests) - failures}/{len(tests)} verificações passaram")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Verifica o cache de respostas dos endpoints de leitura (response_cache.py).
+
+Execute com: python -m pytest test_response_cache.py  (ou python test_response_cache.py)
+"""
+
+import os
+import tempfile
+import time
+
+from flask import Flask, jsonify
+
+from database import Database
+from response_cache import ResponseCache
+
+
+def make_app(**options):
+    """App Flask mínimo com as rotas de campanhas em cache e um contador de leituras do banco"""
+    db = Database(os.path.join(tempfile.mkdtemp(prefix='cache_'), 'cache.db'))
+    cache = ResponseCache(db.versions, ttl=options.get('ttl', 30), max_entries=options.get('max_entries', 16))
+    reads = []
+    app = Flask(__name__)
+
+    @app.route('/campaigns')
+    @cache.cached('campaigns')
+    def list_campaigns():
+        reads.append('campaigns')
+        return jsonify({'campaigns': db.get_campaigns()})
+
+    @app.route('/campaigns/<int:campaign_id>/stats')
+    @cache.cached(lambda campaign_id: f'campaign:{campaign_id}', 'events')
+    def campaign_stats(campaign_id):
+        reads.append(campaign_id)
+        if not db.get_campaign(campaign_id):
+            return jsonify({'error': 'Campanha não encontrada'}), 404
+        return jsonify({'stats': db.get_campaign_stats(campaign_id)})
+
+    return app.test_client(), db, cache, reads
+
+
+def test_unchanged_responses_are_served_from_cache():
+    client, db, cache, reads = make_app()
+    db.create_campaign('Primeira', 'Assunto', 'Corpo')
+
+    first = client.get('/campaigns')
+    second = client.get('/campaigns')
+    assert first.data == second.data and first.headers['ETag']
+    assert reads == ['campaigns']
+
+    # Revalidação: 304 sem corpo e sem consultar o banco
+    revalidated = client.get('/campaigns', headers={'If-None-Match': first.headers['ETag']})
+    assert revalidated.status_code == 304 and revalidated.data == b''
+    assert reads == ['campaigns']
+    assert (cache.hits, cache.not_modified) == (2, 1)
+
+
+def test_writes_invalidate_only_dependent_entries():
+    client, db, cache, reads = make_app()
+    first_id = db.create_campaign('Primeira', 'Assunto', 'Corpo')
+    second_id = db.create_campaign('Segunda', 'Assunto', 'Corpo')
+    etag = client.get('/campaigns').headers['ETag']
+    client.get(f'/campaigns/{first_id}/stats')
+    client.get(f'/campaigns/{second_id}/stats')
+
+    db.update_campaign(first_id, 'Primeira (editada)', 'Assunto', 'Corpo')
+    reads.clear()
+
+    changed = client.get('/campaigns', headers={'If-None-Match': etag})
+    assert changed.status_code == 200 and b'editada' in changed.data
+    client.get(f'/campaigns/{first_id}/stats')
+    client.get(f'/campaigns/{second_id}/stats')
+    assert reads == ['campaigns', first_id]
+
+
+def test_writes_from_another_process_invalidate_entries():
+    client, db, cache, reads = make_app()
+    db.create_campaign('Primeira', 'Assunto', 'Corpo')
+    client.get('/campaigns')
+
+    # Outro worker do gunicorn: outra instância (e outro pool de conexões) sobre o mesmo arquivo
+    other = Database(db.db_path)
+    other.create_campaign('Segunda', 'Assunto', 'Corpo')
+    response = client.get('/campaigns')
+    assert b'Segunda' in response.data and reads == ['campaigns', 'campaigns']
+
+    # Uma escrita desfeita (rollback) não muda a versão
+    try:
+        with other.changing('campaigns') as conn:
+            conn.execute("UPDATE campaigns SET name = 'Desfeita'")
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    client.get('/campaigns')
+    assert reads == ['campaigns', 'campaigns']
+
+
+def test_errors_are_not_cached():
+    client, db, cache, reads = make_app()
+
+    assert client.get('/campaigns/99/stats').status_code == 404
+    assert client.get('/campaigns/99/stats').status_code == 404
+    assert reads == [99, 99]
+
+
+def test_entries_expire_and_are_bounded():
+    client, db, cache, reads = make_app(ttl=0.05, max_entries=2)
+    for campaign_id in (1, 2, 3):
+        db.create_campaign(f'Campanha {campaign_id}', 'Assunto', 'Corpo')
+        client.get(f'/campaigns/{campaign_id}/stats')
+    assert cache.stats()['entries'] == 2
+
+    client.get('/campaigns/3/stats')
+    time.sleep(0.06)
+    client.get('/campaigns/3/stats')
+    assert reads == [1, 2, 3, 3]
+
+
+def main():
+    """Executa as verificações fora do pytest"""
+    tests = [
+        test_unchanged_responses_are_served_from_cache,
+        test_writes_invalidate_only_dependent_entries,
+        test_writes_from_another_process_invalidate_entries,
+        test_errors_are_not_cached,
+        test_entries_expire_and_are_bounded,
+    ]
+    failures = 0
+
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failures += 1
+            print(f"❌ {test.__name__}: {e}")
+
+    print(f"\nResultado: {len(tests) - failures}/{len(tests)} verificações passaram")
+
+
+if __name__ == '__main__':
+    main()
@@ -133,10 +133,12 @@ def test_database():
         contacts = db.get_contacts()
         print(f"✅ Contatos recuperados: {len(contacts)}")
         
-        # Remove arquivo de teste
+        # Fecha as conexões do pool e remove arquivos de teste (inclusive WAL)
+        db.close()
         import os
-        if os.path.exists('test.db'):
-            os.remove('test.db')
+        for path in ('test.db', 'test.db-wal', 'test.db-shm'):
+            if os.path.exists(path):
+                os.remove(path)
         
         return True
         
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Verifica os resumos por hora (stats_hourly), os contadores do painel e as janelas de fuso (stats_rollup.py).
+
+Execute com: python -m pytest test_stats_rollup.py  (ou python test_stats_rollup.py)
+"""
+
+import os
+import tempfile
+import time
+from datetime import date
+
+from database import SCHEMA_MIGRATIONS, Database
+from stats_rollup import StatsRollup
+
+
+def make_database() -> Database:
+    """Banco temporário com uma campanha enviada para 10 contatos"""
+    db = Database(os.path.join(tempfile.mkdtemp(prefix='rollup_'), 'rollup.db'))
+    campaign_id = db.create_campaign('Resumo', 'Assunto', 'Corpo')
+    contacts = [
+        {'id': db.add_contact(f'contato{i}@exemplo.com'), 'email': f'contato{i}@exemplo.com'}
+        for i in range(10)
+    ]
+    db.log_emails_sent_bulk(campaign_id, contacts, '<resumo@exemplo.com>')
+    return db
+
+
+def logged_totals(db: Database) -> dict:
+    """Totais calculados direto de email_logs, para comparar com os resumos"""
+    with db.connection() as conn:
+        row = conn.execute('''
+            SELECT COUNT(sent_at), COUNT(delivered_at), COUNT(opened_at), COUNT(clicked_at), COUNT(bounced_at)
+            FROM email_logs
+        ''').fetchone()
+    return dict(zip(('sent', 'delivered', 'opened', 'clicked', 'bounced'), row))
+
+
+def rollup_totals(db: Database) -> dict:
+    return db.get_event_totals('0000-00-00 00:00', '9999-12-31 23:00')
+
+
+def test_windows_follow_the_configured_offset():
+    assert StatsRollup(None, -3).window(date(2024, 1, 1), date(2024, 1, 1)) == (
+        '2024-01-01 03:00', '2024-01-02 03:00'
+    )
+    # Fuso de meia hora: a hora cheia que começa antes da meia-noite local fica no dia anterior
+    assert StatsRollup(None, 5.5).window(date(2024, 1, 1), date(2024, 1, 2)) == (
+        '2023-12-31 19:00', '2024-01-02 19:00'
+    )
+
+
+def test_rollups_follow_logs():
+    db = make_database()
+    db.update_email_status_by_message('resumo@exemplo.com', 'contato1@exemplo.com', 'delivered')
+    db.update_email_status_by_message('resumo@exemplo.com', 'contato1@exemplo.com', 'opened')
+    db.update_email_status_by_message('resumo@exemplo.com', 'contato1@exemplo.com', 'opened')
+    db.update_email_status('contato2@exemplo.com', 'bounced', bounced_at='2024-01-01 10:00:00')
+    assert rollup_totals(db) == logged_totals(db) == {
+        'sent': 10, 'delivered': 1, 'opened': 1, 'clicked': 0, 'bounced': 1
+    }
+
+    db.delete_campaign(1)
+    assert rollup_totals(db) == logged_totals(db)
+
+
+def test_migration_backfills_existing_logs():
+    db = make_database()
+    db.update_email_status_by_message('resumo@exemplo.com', 'contato1@exemplo.com', 'clicked')
+    with db.connection() as conn:
+        conn.execute('DELETE FROM stats_hourly')
+        conn.execute('DELETE FROM stat_counters')
+        conn.execute('PRAGMA user_version = 9')
+
+    db.init_database()
+    assert rollup_totals(db) == logged_totals(db)
+    assert db.get_stat_counters() == {'sendable_contacts': 10, 'campaigns': 1}
+
+
+def test_counters_follow_contacts_batches_and_campaigns():
+    db = make_database()
+    db.add_contacts_bulk([{'email': f'lote{i}@exemplo.com'} for i in range(5)], batch_id='lote_a')
+    db.set_contacts_status([1, 2], 'unsubscribed')
+    assert db.get_stat_counters()['sendable_contacts'] == db.count_sendable_contacts() == 13
+
+    db.deactivate_batch('lote_a')
+    assert db.get_stat_counters()['sendable_contacts'] == db.count_sendable_contacts() == 8
+    db.activate_batch('lote_a')
+    assert db.get_stat_counters()['sendable_contacts'] == db.count_sendable_contacts() == 13
+
+    db.create_campaign('Outra', 'Assunto', 'Corpo')
+    db.delete_campaign(1)
+    assert db.get_stat_counters()['campaigns'] == 1
+
+
+def test_batch_migration_keeps_contacts_deactivated_individually():
+    db = Database(os.path.join(tempfile.mkdtemp(prefix='rollup_'), 'rollup.db'))
+    db.add_contacts_bulk([{'email': f'antigo{i}@exemplo.com'} for i in range(3)], batch_id='antigo')
+    db.add_contacts_bulk([{'email': f'atual{i}@exemplo.com'} for i in range(2)], batch_id='atual')
+    with db.connection() as conn:
+        # Banco anterior ao registro de lotes: a desativação gravava o mesmo updated_at no lote inteiro
+        conn.execute('''
+            UPDATE contacts SET status = 'inactive', updated_at = '2024-01-01 10:00:00'
+            WHERE batch_id = 'antigo'
+        ''')
+        # ... e um contato desativado individualmente depois
+        conn.execute("UPDATE contacts SET updated_at = '2024-01-02 09:00:00' WHERE email = 'antigo0@exemplo.com'")
+        conn.execute('DELETE FROM contact_batches')
+        conn.execute('PRAGMA user_version = 7')
+
+    db.init_database()
+    statuses = {contact['email']: contact['status'] for contact in db.get_contacts_page()}
+    assert statuses['antigo0@exemplo.com'] == 'inactive'
+    assert statuses['antigo1@exemplo.com'] == statuses['antigo2@exemplo.com'] == 'active'
+    assert {batch['batch_id']: batch['batch_status'] for batch in db.get_active_batches()} == {
+        'antigo': 'inactive', 'atual': 'active'
+    }
+
+    # 'sendable' (padrão de GET /contacts) considera o lote; 'active' é só o status do contato
+    assert sorted(contact['email'] for contact in db.get_contacts()) == [
+        'atual0@exemplo.com', 'atual1@exemplo.com'
+    ]
+    assert len(db.get_contacts(status='active')) == len(db.get_contacts_page(status='active')) == 4
+    assert len(db.get_contacts_page(status='sendable', batch_id='antigo')) == 0
+
+
+def test_batch_migration_scales_with_batch_size():
+    db = Database(os.path.join(tempfile.mkdtemp(prefix='rollup_'), 'rollup.db'))
+    for batch_id in ('antigo', 'outro'):
+        db.add_contacts_bulk(
+            [{'email': f'{batch_id}{i}@exemplo.com'} for i in range(3000)], batch_id=batch_id
+        )
+    with db.connection() as conn:
+        conn.execute("UPDATE contacts SET status = 'inactive', updated_at = '2024-01-01 10:00:00'")
+        # Um em cada cem desativado individualmente depois da desativação do lote
+        conn.execute("UPDATE contacts SET updated_at = '2024-01-02 09:00:00' WHERE id % 100 = 0")
+        conn.execute('DELETE FROM contact_batches')
+        conn.execute('PRAGMA user_version = 7')
+
+        # O menor updated_at por lote é calculado uma vez, não em uma subconsulta por linha
+        reset = next(statement for statement in SCHEMA_MIGRATIONS[7] if 'first_update' in statement)
+        plan = ' '.join(row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {reset}'))
+        assert 'CORRELATED' not in plan, plan
+
+    started = time.perf_counter()
+    db.init_database()
+    assert time.perf_counter() - started < 5
+    assert len(db.get_contacts_page(status='inactive', limit=1000)) == 60
+    assert len(db.get_contacts(status='active')) == 5940
+
+
+def test_series_is_continuous_in_local_time():
+    db = make_database()
+    stats = StatsRollup(db)
+    today = stats.today()
+
+    days = stats.series(date.fromordinal(today.toordinal() - 2), today)
+    assert [bucket['sent'] for bucket in days] == [0, 0, 10]
+    assert days[-1]['bucket'] == today.isoformat()
+
+    hours = stats.series(today, today, granularity='hour', campaign_id=1)
+    assert len(hours) == 24
+    assert sum(bucket['sent'] for bucket in hours) == 10
+    assert stats.daily()['emails_sent_today'] == 10
+    assert stats.series(today, today, campaign_id=2)[0]['sent'] == 0
+
+
+def main():
+    """Executa as verificações fora do pytest"""
+    tests = [
+        test_windows_follow_the_configured_offset,
+        test_rollups_follow_logs,
+        test_migration_backfills_existing_logs,
+        test_counters_follow_contacts_batches_and_campaigns,
+        test_batch_migration_keeps_contacts_deactivated_individually,
+        test_batch_migration_scales_with_batch_size,
+        test_series_is_continuous_in_local_time,
+    ]
+    failures = 0
+
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failures += 1
+            print(f"❌ {test.__name__}: {e}")
+
+    print(f"\nResultado: {len(tests) - failures}/{len(tests)} verificações passaram")
+
+
+if __name__ == '__main__':
+    main()
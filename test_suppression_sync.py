@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Verifica a sincronização incremental das listas de supressão (suppression_sync.py) contra o Mailgun falso.
+
+Execute com: python -m pytest test_suppression_sync.py  (ou python test_suppression_sync.py)
+"""
+
+import os
+import tempfile
+
+from database import Database
+from mailgun_client import MailgunClient
+from mailgun_stub import MailgunStub
+from suppression_sync import SuppressionIndex, SuppressionSync
+
+# Bancos criados pelo teste em andamento, apagados em teardown_function
+OPEN_DATABASES = []
+
+# created_at das supressões (o Mailgun grava com precisão de segundos)
+START = 1700000000
+
+
+def make_sync(stub: MailgunStub, contacts: int = 6) -> SuppressionSync:
+    """Banco temporário com contatos e uma sincronização com páginas de 2 entradas"""
+    tmp_dir = tempfile.TemporaryDirectory(prefix='suppressions_')
+    db = Database(os.path.join(tmp_dir.name, 'suppressions.db'))
+    OPEN_DATABASES.append((db, tmp_dir))
+    for i in range(contacts):
+        db.add_contact(f'contato{i}@exemplo.com')
+    client = MailgunClient(api_key='test', api_url=stub.url)
+    return SuppressionSync(db, client, SuppressionIndex(db), page_size=2)
+
+
+def teardown_function(function=None):
+    """Fecha o pool e apaga o diretório de cada banco criado pelo teste"""
+    while OPEN_DATABASES:
+        db, tmp_dir = OPEN_DATABASES.pop()
+        db.close()
+        tmp_dir.cleanup()
+
+
+def statuses(db: Database) -> dict:
+    return {contact['email']: contact['status'] for contact in db.get_contacts_page(limit=100)}
+
+
+def test_first_sync_reads_every_page_and_updates_contacts():
+    with MailgunStub() as stub:
+        sync = make_sync(stub)
+        for i in range(5):
+            stub.add_suppression('bounces', f'Contato{i}@Exemplo.com', created_at=START + i, error='550')
+        stub.add_suppression('unsubscribes', 'contato5@exemplo.com', created_at=START)
+        sync.db.set_contacts_status([1], 'unsubscribed')
+
+        summary = sync.sync()
+
+    assert summary['bounces'] == {'pages': 3, 'fetched': 5, 'new_entries': 5, 'contacts_updated': 4}
+    assert summary['unsubscribes']['contacts_updated'] == 1
+    assert summary['complaints'] == {'pages': 0, 'fetched': 0, 'new_entries': 0, 'contacts_updated': 0}
+
+    # Emails normalizados; um status já final (descadastro) não é sobrescrito pelo bounce
+    found = statuses(sync.db)
+    assert found['contato0@exemplo.com'] == 'unsubscribed'
+    assert [found[f'contato{i}@exemplo.com'] for i in range(1, 5)] == ['bounced'] * 4
+    assert found['contato5@exemplo.com'] == 'unsubscribed'
+    assert 'contato3@exemplo.com' in sync.index and len(sync.index) == 6
+    assert sync.db.get_sync_checkpoint(SuppressionSync.checkpoint_name('bounces')) == str(float(START + 4))
+
+
+def test_next_sync_resumes_from_checkpoint_and_stops_early():
+    with MailgunStub() as stub:
+        sync = make_sync(stub)
+        for i in range(5):
+            stub.add_suppression('bounces', f'contato{i}@exemplo.com', created_at=START + i)
+        sync.sync_list('bounces')
+
+        stub.add_suppression('bounces', 'contato5@exemplo.com', created_at=START + 10)
+        second = sync.sync_list('bounces')
+
+        # Lista completa de novo: percorre todas as páginas, mesmo já sincronizadas
+        full = sync.sync_list('bounces', full=True)
+
+    # Página 1: a nova entrada e a do segundo do checkpoint (regravada); página 2 alcança o checkpoint
+    assert second == {'pages': 2, 'fetched': 4, 'new_entries': 2, 'contacts_updated': 1}
+    assert statuses(sync.db)['contato5@exemplo.com'] == 'bounced'
+    assert sync.db.get_sync_checkpoint('suppressions:bounces') == str(float(START + 10))
+    assert (full['pages'], full['fetched'], full['new_entries']) == (3, 6, 6)
+
+
+def test_failed_sync_keeps_the_checkpoint():
+    with MailgunStub() as stub:
+        sync = make_sync(stub)
+        stub.add_suppression('bounces', 'contato0@exemplo.com', created_at=START)
+        sync.sync(['bounces'])
+        for i in range(1, 4):
+            stub.add_suppression('bounces', f'contato{i}@exemplo.com', created_at=START + i)
+
+        # A conexão cai depois da primeira página
+        iter_suppressions = sync.mailgun.iter_suppressions
+
+        def interrupted(kind, limit):
+            pages = iter_suppressions(kind, limit)
+            yield next(pages)
+            raise ConnectionError('conexão perdida')
+
+        sync.mailgun.iter_suppressions = interrupted
+        summary = sync.sync(['bounces'])
+
+    # Nada da página lida é aplicado e o checkpoint não avança: a próxima execução retoma do mesmo ponto
+    assert summary['bounces'] == {'error': 'conexão perdida'}
+    assert sync.db.get_sync_checkpoint('suppressions:bounces') == str(float(START))
+    assert statuses(sync.db)['contato3@exemplo.com'] == 'active'
+
+
+def main():
+    """Executa as verificações fora do pytest"""
+    tests = [
+        test_first_sync_reads_every_page_and_updates_contacts,
+        test_next_sync_resumes_from_checkpoint_and_stops_early,
+        test_failed_sync_keeps_the_checkpoint,
+    ]
+    failures = 0
+
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failures += 1
+            print(f"❌ {test.__name__}: {e}")
+        finally:
+            teardown_function(test)
+
+    print(f"\nResultado: {len(tests) - failures}/{len(tests)} verificações passaram")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Verifica o compilador de templates de personalização (template_engine.py).
+
+Execute com: python -m pytest test_template_engine.py  (ou python test_template_engine.py)
+"""
+
+import os
+import tempfile
+
+from database import Database
+from template_engine import CompiledCampaign, TemplateCache, compile_template, recipient_variables
+
+
+def test_converts_any_field_and_keeps_plain_braces():
+    compiled = compile_template('Olá {name}, {city}! {{ a: b }} { color: red }')
+
+    assert compiled.mailgun == 'Olá %recipient.name%, %recipient.city%! {{ a: b }} { color: red }'
+
+
+def test_defaults_apply_to_empty_fields():
+    compiled = CompiledCampaign('Olá {name|Cliente}', 'Oi {name}, da {company|sua empresa}')
+
+    # O mesmo campo com e sem padrão vira duas variáveis no Mailgun
+    assert compiled.variables == {
+        'name': ('name', 'Cliente'),
+        'name__1': ('name', None),
+        'company': ('company', 'sua empresa')
+    }
+    assert compiled.render({'name': '', 'company': None}) == {'subject': 'Olá Cliente', 'body': 'Oi , da sua empresa'}
+    assert compiled.render({'name': 'Ana', 'company': 'ACME'})['body'] == 'Oi Ana, da ACME'
+    assert compiled.required_fields() == ['name']
+
+
+def test_local_render_matches_mailgun_substitution():
+    compiled = CompiledCampaign('{name|Cliente}: {company}', '<style>p { width: 100% }</style>{{ {name} }} {company} {name}')
+    contact = {'name': 'Ana', 'company': ''}
+
+    # A renderização local (um %s por tag) produz o mesmo texto que o Mailgun gera a partir de mailgun
+    values = recipient_variables(contact, compiled.variables)
+    expected = {'subject': compiled.subject.render(values), 'body': compiled.body.render(values)}
+    assert compiled.render(contact) == expected
+    assert expected['body'] == '<style>p { width: 100% }</style>{{ Ana }}  Ana'
+
+
+def test_reports_unknown_fields():
+    compiled = CompiledCampaign('Olá {name}', '{nome} na {company}')
+
+    assert compiled.unknown_fields(['id', 'email', 'name', 'company']) == ['nome']
+
+
+def test_cache_recompiles_when_campaign_changes():
+    cache = TemplateCache()
+    campaign = {'id': 1, 'updated_at': '2024-01-01', 'subject': 'Olá {name}', 'body_template': 'x'}
+
+    first = cache.get(campaign)
+    assert cache.get(dict(campaign)) is first
+
+    edited = cache.get({**campaign, 'updated_at': '2024-01-02', 'subject': 'Oi {name}'})
+    assert edited is not first
+    assert edited.subject.mailgun == 'Oi %recipient.name%'
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_recipients_load_extra_template_fields():
+    db = Database(os.path.join(tempfile.mkdtemp(prefix='templates_'), 'templates.db'))
+    db.add_contact('ana@exemplo.com', name='Ana')
+
+    batch = next(db.iter_recipient_batches(10, fields=['name', 'status', 'coluna_inexistente']))
+
+    assert batch[0]['status'] == 'active'
+    assert batch[0].get('coluna_inexistente') is None
+    assert db.count_missing_fields(['name', 'company']) == {'name': 0, 'company': 1}
+
+
+def main():
+    """Executa as verificações fora do pytest"""
+    tests = [
+        test_converts_any_field_and_keeps_plain_braces,
+        test_defaults_apply_to_empty_fields,
+        test_local_render_matches_mailgun_substitution,
+        test_reports_unknown_fields,
+        test_cache_recompiles_when_campaign_changes,
+        test_recipients_load_extra_template_fields,
+    ]
+    failures = 0
+
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failures += 1
+            print(f"❌ {test.__name__}: {e}")
+
+    print(f"\nResultado: {len(tests) - failures}/{len(tests)} verificações passaram")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Verifica a ingestão de webhooks em lote (webhook_ingestor.py): gravação agrupada, eventos
+repetidos, backpressure com o buffer cheio e os contadores de metrics().
+
+Execute com: python -m pytest test_webhook_ingestor.py  (ou python test_webhook_ingestor.py)
+"""
+
+import os
+import tempfile
+import threading
+
+from database import Database
+from webhook_ingestor import WebhookIngestor
+
+MESSAGE_ID = '<webhook@exemplo.com>'
+
+# Bancos criados pelo teste em andamento, apagados em teardown_function
+OPEN_DATABASES = []
+
+
+def make_database(contacts: int = 20) -> Database:
+    """Banco temporário com uma campanha enviada para os contatos"""
+    tmp_dir = tempfile.TemporaryDirectory(prefix='webhook_')
+    db = Database(os.path.join(tmp_dir.name, 'webhook.db'))
+    OPEN_DATABASES.append((db, tmp_dir))
+    campaign_id = db.create_campaign('Webhook', 'Assunto', 'Corpo')
+    db.log_emails_sent_bulk(campaign_id, [
+        {'id': db.add_contact(f'contato{i}@exemplo.com'), 'email': f'contato{i}@exemplo.com'}
+        for i in range(contacts)
+    ], MESSAGE_ID)
+    return db
+
+
+def teardown_function(function=None):
+    """Fecha o pool e apaga o diretório de cada banco criado pelo teste"""
+    while OPEN_DATABASES:
+        db, tmp_dir = OPEN_DATABASES.pop()
+        db.close()
+        tmp_dir.cleanup()
+
+
+def webhook(email: str, event: str = 'delivered', **extra) -> dict:
+    return {'recipient': email, 'event': event, 'timestamp': '1700000000', 'message-id': MESSAGE_ID, **extra}
+
+
+def count_logs(db: Database, column: str) -> int:
+    with db.connection() as conn:
+        return conn.execute(f'SELECT COUNT({column}) FROM email_logs').fetchone()[0]
+
+
+def test_concurrent_submits_are_flushed_in_batches():
+    db = make_database()
+    ingestor = WebhookIngestor(db, max_queue=1000, batch_size=50, flush_interval=0.05, enqueue_timeout=1)
+
+    def send():
+        for i in range(20):
+            ingestor.submit(webhook(f'contato{i}@exemplo.com'))
+            ingestor.submit(webhook(f'contato{i}@exemplo.com', 'opened'))
+        # Ignorados: evento desconhecido e falha temporária
+        ingestor.submit(webhook('contato0@exemplo.com', 'accepted'))
+        ingestor.submit(webhook('contato0@exemplo.com', 'failed', severity='temporary'))
+
+    threads = [threading.Thread(target=send) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    ingestor.stop()
+
+    metrics = ingestor.metrics()
+    assert (metrics['accepted'], metrics['ignored'], metrics['rejected']) == (320, 16, 0)
+    assert metrics['flushed_events'] == 320 and metrics['failed_flushes'] == 0
+    # Vários eventos por transação
+    assert 0 < metrics['flushes'] < 320 and metrics['queue_depth'] == 0
+    assert count_logs(db, 'delivered_at') == count_logs(db, 'opened_at') == 20
+
+
+def test_duplicate_events_are_coalesced():
+    db = make_database(contacts=3)
+    ingestor = WebhookIngestor(db)
+    events = [
+        (MESSAGE_ID, f'contato{i}@exemplo.com', 'delivered', None)
+        for _ in range(4) for i in range(3)
+    ]
+
+    assert ingestor.flush(events)
+    metrics = ingestor.metrics()
+    # Cada (mensagem, destinatário, status) é gravado uma vez; todos os eventos contam como gravados
+    assert (metrics['flushed_events'], metrics['updated_rows']) == (12, 3)
+
+
+def test_full_buffer_rejects_events():
+    db = make_database(contacts=3)
+    ingestor = WebhookIngestor(db, max_queue=2, enqueue_timeout=0)
+    ingestor.start = lambda: None  # sem a thread de gravação, ninguém esvazia a fila
+
+    results = [ingestor.submit(webhook(f'contato{i}@exemplo.com')) for i in range(3)]
+    assert results == ['accepted', 'accepted', 'rejected']
+    metrics = ingestor.metrics()
+    assert (metrics['accepted'], metrics['rejected'], metrics['queue_depth']) == (2, 1, 2)
+
+
+def test_full_buffer_answers_503():
+    import app as app_module
+
+    service = app_module.email_service
+    original = service.webhook_ingestor
+    stalled = WebhookIngestor(make_database(contacts=1), max_queue=1, enqueue_timeout=0)
+    stalled.start = lambda: None
+    service.webhook_ingestor = stalled
+    try:
+        client = app_module.app.test_client()
+        payload = {'event-data': {'recipient': 'contato0@exemplo.com', 'event': 'delivered'}}
+        assert client.post('/webhook/mailgun', json=payload).status_code == 200
+        response = client.post('/webhook/mailgun', json=payload)
+    finally:
+        service.webhook_ingestor = original
+
+    # O Mailgun tenta de novo depois do Retry-After
+    assert response.status_code == 503 and response.headers['Retry-After'] == '30'
+
+
+def main():
+    """Executa as verificações fora do pytest"""
+    tests = [
+        test_concurrent_submits_are_flushed_in_batches,
+        test_duplicate_events_are_coalesced,
+        test_full_buffer_rejects_events,
+        test_full_buffer_answers_503,
+    ]
+    failures = 0
+
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failures += 1
+            print(f"❌ {test.__name__}: {e}")
+        finally:
+            teardown_function(test)
+
+    print(f"\nResultado: {len(tests) - failures}/{len(tests)} verificações passaram")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+import atexit
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from config import Config
+from database import Database
+from metrics import ERRORS, WEBHOOK_EVENTS, WEBHOOK_FLUSH_SECONDS, WEBHOOK_QUEUE_DEPTH
+
+# Mapeia eventos do Mailgun para status internos
+WEBHOOK_STATUS_MAPPING = {
+    'delivered': 'delivered',
+    'opened': 'opened',
+    'clicked': 'clicked',
+    'bounced': 'bounced',
+    'failed': 'bounced',
+    'complained': 'complained',
+    'unsubscribed': 'unsubscribed'
+}
+
+
+def flatten_event(event: Dict) -> Dict:
+    """Converte um evento no formato event-data (webhook JSON ou API /events) no formato plano"""
+    headers = event.get('message', {}).get('headers', {})
+    return {
+        'recipient': event.get('recipient'),
+        'event': event.get('event'),
+        'severity': event.get('severity'),
+        'timestamp': event.get('timestamp'),
+        'message-id': headers.get('message-id'),
+        'id': event.get('id')
+    }
+
+
+def parse_webhook_event(event_data: Dict) -> Optional[tuple]:
+    """Valida o evento e retorna (message_id, email, status, timestamp), ou None se for ignorado"""
+    email = event_data.get('recipient')
+    event = event_data.get('event')
+
+    if not email or event not in WEBHOOK_STATUS_MAPPING:
+        return None
+
+    # Falhas temporárias serão reenviadas pelo Mailgun; não são bounces
+    if event == 'failed' and event_data.get('severity') == 'temporary':
+        return None
+
+    timestamp = event_data.get('timestamp')
+    try:
+        timestamp = datetime.fromtimestamp(float(timestamp)) if timestamp else None
+    except (TypeError, ValueError):
+        return None
+
+    return (event_data.get('message-id'), email, WEBHOOK_STATUS_MAPPING[event], timestamp)
+
+
+class WebhookIngestor:
+    """Enfileira eventos de webhook e os grava em lotes por uma thread de fundo"""
+
+    def __init__(self, db: Database, max_queue: int = None, batch_size: int = None,
+                 flush_interval: float = None, enqueue_timeout: float = None):
+        self.db = db
+        self.max_queue = max_queue or Config.WEBHOOK_QUEUE_SIZE
+        self.batch_size = batch_size or Config.WEBHOOK_BATCH_SIZE
+        self.flush_interval = flush_interval or Config.WEBHOOK_FLUSH_INTERVAL
+        self.enqueue_timeout = (Config.WEBHOOK_ENQUEUE_TIMEOUT
+                                if enqueue_timeout is None else enqueue_timeout)
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._pending: List[tuple] = []
+        # Contadores atualizados pelas threads das requisições e pela thread de gravação
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'accepted': 0,
+            'ignored': 0,
+            'rejected': 0,
+            'flushed_events': 0,
+            'updated_rows': 0,
+            'flushes': 0,
+            'failed_flushes': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0
+        }
+        atexit.register(self.stop)
+
+    def start(self):
+        """Inicia a thread de gravação (idempotente)"""
+        with self._start_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='webhook-flusher', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Grava o que estiver no buffer e encerra a thread"""
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def submit(self, event_data: Dict) -> str:
+        """Valida e enfileira um evento: 'accepted', 'ignored' ou 'rejected' (buffer cheio)"""
+        event = parse_webhook_event(event_data)
+        if event is None:
+            self._count('ignored')
+            WEBHOOK_EVENTS.inc(outcome='ignored')
+            return 'ignored'
+
+        self.start()
+        try:
+            self._queue.put(event, timeout=self.enqueue_timeout)
+        except queue.Full:
+            self._count('rejected')
+            WEBHOOK_EVENTS.inc(outcome='rejected')
+            return 'rejected'
+
+        self._count('accepted')
+        WEBHOOK_EVENTS.inc(outcome='accepted')
+        return 'accepted'
+
+    def _count(self, name: str, amount: int = 1):
+        """Soma em um contador de metrics()"""
+        with self._stats_lock:
+            self._stats[name] += amount
+
+    def metrics(self) -> Dict:
+        """Profundidade da fila e latência das gravações"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        flushes = stats.pop('flushes')
+        total_flush_ms = stats.pop('total_flush_ms')
+        stats.update({
+            'queue_depth': self._queue.qsize(),
+            'queue_capacity': self.max_queue,
+            'pending_retry': len(self._pending),
+            'flushes': flushes,
+            'avg_flush_ms': total_flush_ms / flushes if flushes else 0.0,
+            'running': bool(self._thread and self._thread.is_alive())
+        })
+        return stats
+
+    def _collect(self) -> List[tuple]:
+        """Junta eventos até completar um lote ou vencer o intervalo de gravação"""
+        batch = self._pending
+        self._pending = []
+        deadline = time.monotonic() + self.flush_interval
+
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    @staticmethod
+    def _coalesce(events: List[tuple]) -> List[tuple]:
+        """Remove eventos repetidos (mesma mensagem, destinatário e status), mantendo o primeiro"""
+        seen = set()
+        unique = []
+        for event in events:
+            key = event[:3]
+            if key not in seen:
+                seen.add(key)
+                unique.append(event)
+        return unique
+
+    def flush(self, events: List[tuple]) -> bool:
+        """Grava um lote de eventos em uma transação"""
+        if not events:
+            return True
+
+        started = time.perf_counter()
+        try:
+            updated = self.db.apply_email_events(self._coalesce(events))
+        except Exception as e:
+            # Mantém o lote para a próxima tentativa; a fila limitada gera backpressure
+            self._count('failed_flushes')
+            ERRORS.inc(component='webhook')
+            self._pending = events + self._pending
+            print(f"Erro ao gravar {len(events)} eventos de webhook: {e}")
+            return False
+
+        elapsed = time.perf_counter() - started
+        WEBHOOK_FLUSH_SECONDS.observe(elapsed)
+        elapsed_ms = elapsed * 1000
+        with self._stats_lock:
+            self._stats['flushes'] += 1
+            self._stats['flushed_events'] += len(events)
+            self._stats['updated_rows'] += updated
+            self._stats['last_flush_ms'] = elapsed_ms
+            self._stats['total_flush_ms'] += elapsed_ms
+            self._stats['max_flush_ms'] = max(self._stats['max_flush_ms'], elapsed_ms)
+        return True
+
+    def _run(self):
+        while not self._stopping.is_set():
+            WEBHOOK_QUEUE_DEPTH.set(self._queue.qsize() + len(self._pending))
+            if not self.flush(self._collect()):
+                # Aguarda antes de tentar novamente (ex: banco bloqueado)
+                self._stopping.wait(self.flush_interval)
+
+        # Esvazia o buffer antes de sair
+        remaining = self._pending
+        self._pending = []
+        while True:
+            try:
+                remaining.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        self.flush(remaining)